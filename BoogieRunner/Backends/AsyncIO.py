@@ -0,0 +1,326 @@
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  A backend that supervises tools from a single asyncio event loop.
+
+  Every instance of the backend in a process shares one ``Supervisor``
+  which runs an event loop on its own thread. The exit of each tool is
+  watched with a pidfd on the loop, timeouts are enforced with loop
+  timers and the memory use of every running tool is sampled by a single
+  task. Opening the log file and forking the tool block, so they run on
+  the loop's default executor rather than stalling the loop. No threads
+  are created per tool so hundreds of tools can be supervised at once.
+  Tools are reaped by the backend rather than by
+  asyncio so that their process group is only signalled before the tool
+  is reaped (see ``ProcessTree.ProcessGroup``).
+
+  ``run()`` blocks the calling thread until the tool finishes.
+  ``runAsync()`` is a coroutine that must be run on the supervisor's
+  loop (see ``getSupervisor()``).
+"""
+from . BackendBase import *
+from .. import ProcessTree
+import asyncio
+import logging
+import os
+import pprint
+import psutil
+import signal
+import subprocess
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+class AsyncIOBackendException(BackendException):
+  pass
+
+class _Job:
+  def __init__(self, process, group, memoryLimit, pollTimePeriod):
+    self.process = process
+    self.group = group
+    self.memoryLimit = memoryLimit
+    self.pollTimePeriod = pollTimePeriod
+    self.outOfMemory = False
+
+class Supervisor:
+  """
+    Owns the event loop that the tools are supervised from.
+  """
+  def __init__(self):
+    self.loop = asyncio.new_event_loop()
+    self._jobs = set()
+    self._samplerTask = None
+    self._thread = threading.Thread(target=self._runLoop, name='asyncio_supervisor', daemon=True)
+    self._thread.start()
+
+  def _runLoop(self):
+    asyncio.set_event_loop(self.loop)
+    self.loop.run_forever()
+
+  @property
+  def inLoopThread(self):
+    return threading.current_thread() is self._thread
+
+  def submit(self, coroutine):
+    """
+      Schedule ``coroutine`` on the loop from another thread.
+      Returns a ``concurrent.futures.Future``.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+  def watchExit(self, pid):
+    """
+      Returns a future that is done once the child process ``pid`` has
+      exited. The process is not reaped. Must be called on the loop.
+    """
+    exited = self.loop.create_future()
+    def setExited():
+      if not exited.done():
+        exited.set_result(None)
+    try:
+      pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+      # Needs Python >= 3.9 and Linux >= 5.3
+      pidfd = None
+    if pidfd != None:
+      def onExit():
+        self.loop.remove_reader(pidfd)
+        os.close(pidfd)
+        setExited()
+      self.loop.add_reader(pidfd, onExit)
+    else:
+      def waitForExit():
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+        self.loop.call_soon_threadsafe(setExited)
+      threading.Thread(target=waitForExit, name='exit_watcher-{}'.format(pid), daemon=True).start()
+    return exited
+
+  def register(self, job):
+    """
+      Start sampling the memory use of ``job``. Must be called on the loop.
+    """
+    self._jobs.add(job)
+    if self._samplerTask == None or self._samplerTask.done():
+      self._samplerTask = self.loop.create_task(self._sampleMemory())
+
+  def unregister(self, job):
+    self._jobs.discard(job)
+
+  async def _sampleMemory(self):
+    """
+      Periodically sample the memory use of every registered job in a
+      single pass and kill the jobs that are over their limit.
+    """
+    while len(self._jobs) > 0:
+      await asyncio.sleep(min([ job.pollTimePeriod for job in self._jobs ]))
+      for job in list(self._jobs):
+        if job.outOfMemory:
+          continue
+        try:
+          totalMemoryUsage = _processTreeMemoryUsageInMiB(job.process)
+        except psutil.NoSuchProcess:
+          continue
+        if totalMemoryUsage > job.memoryLimit:
+          _logger.warning('Memory limit reached (recorded {} MiB). Killing tool with PID {}'.format(
+            totalMemoryUsage, job.process.pid))
+          job.outOfMemory = True
+          # Give the tool a chance to clean up after itself before aggressively killing it
+          self.loop.create_task(_terminateProcessTree(job.process, job.group, pause=1.0))
+
+_supervisor = None
+_supervisorPid = None
+_supervisorLock = threading.Lock()
+
+def getSupervisor():
+  """
+    Returns the supervisor of this process, starting it if necessary.
+  """
+  global _supervisor, _supervisorPid
+  with _supervisorLock:
+    # A forked worker process does not inherit the loop's thread
+    if _supervisor == None or _supervisorPid != os.getpid():
+      _supervisor = Supervisor()
+      _supervisorPid = os.getpid()
+    return _supervisor
+
+def _getProcessMemoryUsageInMiB(process):
+  # use Virtual memory size rather than resident set
+  return process.memory_info()[1] / (2**20)
+
+def _processTreeMemoryUsageInMiB(process):
+  totalMemoryUsage = _getProcessMemoryUsageInMiB(process)
+  # The process might of forked so add the memory usage of its children too
+  for child in ProcessTree.descendants(process):
+    try:
+      totalMemoryUsage += _getProcessMemoryUsageInMiB(child)
+    except psutil.NoSuchProcess:
+      pass
+  return totalMemoryUsage
+
+def _signalProcessTree(process, group, kill):
+  children = ProcessTree.descendants(process)
+  # The tool is the leader of its process group which also holds any
+  # descendants that have been orphaned.
+  group.signal(signal.SIGKILL if kill else signal.SIGTERM)
+  for p in [ process ] + children:
+    try:
+      if kill:
+        p.kill()
+      else:
+        p.terminate()
+    except psutil.NoSuchProcess:
+      pass
+
+async def _terminateProcessTree(process, group, pause):
+  _logger.debug('Trying to terminate PID:{}'.format(process.pid))
+  _signalProcessTree(process, group, kill=False)
+  if pause > 0.0:
+    await asyncio.sleep(pause)
+  _logger.info('Trying to kill PID:{}'.format(process.pid))
+  _signalProcessTree(process, group, kill=True)
+
+class AsyncIOBackend(BackendBaseClass):
+  def __init__(self, hostProgramPath, workingDirectory, timeLimit, memoryLimit, stackLimit, **kwargs):
+    super().__init__(hostProgramPath, workingDirectory, timeLimit, memoryLimit, stackLimit, **kwargs)
+    memoryLimitTimePeriodKey = 'memory_limit_poll_time_period'
+    if memoryLimitTimePeriodKey in kwargs:
+      self.memoryLimitPollTimePeriodInSeconds = kwargs[memoryLimitTimePeriodKey]
+      if memoryLimit == 0:
+        raise AsyncIOBackendException('Cannot have "{}" specified with no memory limit'.format(
+          memoryLimitTimePeriodKey))
+    else:
+      # default
+      self.memoryLimitPollTimePeriodInSeconds = 0.5
+
+    if not (isinstance(self.memoryLimitPollTimePeriodInSeconds, float) and
+        self.memoryLimitPollTimePeriodInSeconds > 0.0 ):
+      raise AsyncIOBackendException(
+        '{} must be a float > 0.0'.format(memoryLimitTimePeriodKey))
+
+    self._process = None
+    self._group = None
+
+  @property
+  def name(self):
+    return "AsyncIO"
+
+  def kill(self):
+    # Safe to call from any thread
+    process, group = self._process, self._group
+    if process != None and group != None:
+      _signalProcessTree(process, group, kill=True)
+
+  def programPath(self):
+    # We run directly on the host so nothing special here
+    return self.hostProgramPath
+
+  def run(self, cmdLine, logFilePath, envVars):
+    supervisor = getSupervisor()
+    if supervisor.inLoopThread:
+      raise AsyncIOBackendException('run() cannot be called from the supervisor thread. Use runAsync()')
+    return supervisor.submit(self.runAsync(cmdLine, logFilePath, envVars)).result()
+
+  async def runAsync(self, cmdLine, logFilePath, envVars):
+    """
+      Coroutine version of ``run()``. Must be run on the supervisor's loop.
+    """
+    supervisor = getSupervisor()
+    assert supervisor.inLoopThread
+
+    _logger.info('Running:\n{}\nwith env:{}'.format(
+      pprint.pformat(cmdLine),
+      pprint.pformat(envVars)))
+
+    exitCode = None
+    popen = None
+    group = None
+    job = None
+    outOfTime = False
+    startTime = time.perf_counter()
+    try:
+      self._logPreExecLimits()
+      spawned = supervisor.loop.run_in_executor(None, self._spawn, cmdLine, logFilePath, envVars)
+      try:
+        popen = await asyncio.shield(spawned)
+      except asyncio.CancelledError:
+        # Wait for the tool to start so that it is killed below
+        popen = await asyncio.shield(spawned)
+        raise
+      finally:
+        if popen != None:
+          exited = supervisor.watchExit(popen.pid)
+          # The tool is only reaped below so this can't fail
+          self._group = group = ProcessTree.ProcessGroup(popen.pid)
+          self._process = psutil.Process(popen.pid)
+
+      if self.memoryLimit > 0:
+        job = _Job(self._process, group, self.memoryLimit, self.memoryLimitPollTimePeriodInSeconds)
+        supervisor.register(job)
+
+      _logger.info('Running with timeout of {} seconds'.format(self.timeLimit))
+      try:
+        await asyncio.wait_for(asyncio.shield(exited),
+                               self.timeLimit if self.timeLimit > 0 else None)
+      except asyncio.TimeoutError:
+        outOfTime = True
+    finally:
+      if job != None:
+        supervisor.unregister(job)
+      if popen != None:
+        # Kill the tool (or what is left of its process tree)
+        _signalProcessTree(self._process, group, kill=True)
+        # Reap the tool. This isn't cancellable so a cancelled job
+        # doesn't leave a zombie behind.
+        await asyncio.shield(exited)
+        returnCode = group.reap(lambda: self._reap(popen))
+        if not outOfTime:
+          exitCode = returnCode
+      self._process = None
+      runTime = time.perf_counter() - startTime
+
+    return BackendResult(exitCode, runTime, outOfTime, job != None and job.outOfMemory)
+
+  def _spawn(self, cmdLine, logFilePath, envVars):
+    """
+      Start the tool writing to ``logFilePath``. Forking a large runner
+      (without vfork() when there is a ``preexec_fn``) blocks so this is
+      run on the loop's executor.
+    """
+    preExecFn = None
+    if self.stackLimit != None or self.cpuAffinity != None:
+      preExecFn = self._preExec
+    with open(logFilePath, 'w') as f:
+      _logger.info('writing to log file {}'.format(logFilePath))
+      # Run the tool in its own session so it and everything it forks
+      # are in a process group that can be signalled at once.
+      return subprocess.Popen(cmdLine,
+                              cwd=self.workingDirectory,
+                              stdout=f,
+                              stderr=f,
+                              env=envVars,
+                              preexec_fn=preExecFn,
+                              start_new_session=True)
+
+  def _reap(self, popen):
+    _, status = os.waitpid(popen.pid, 0)
+    if os.WIFSIGNALED(status):
+      exitCode = -os.WTERMSIG(status)
+    else:
+      exitCode = os.WEXITSTATUS(status)
+    # Stop subprocess from trying to reap the tool itself
+    popen.returncode = exitCode
+    return exitCode
+
+  def checkToolExists(self, toolPath):
+    assert os.path.isabs(toolPath)
+    if not os.path.exists(toolPath):
+      raise AsyncIOBackendException('Tool "{}" does not exist'.format(toolPath))
+
+  @property
+  def workingDirectoryInternal(self):
+    # Nothing special here. We work directly on the host
+    return self.workingDirectory
+
+
+def get():
+  return AsyncIOBackend
@@ -9,13 +9,15 @@ class BackendException(Exception):
   pass
 
 class BackendResult:
-  def __init__(self, exitCode, runTime, oot, oom, userCpuTime=None, sysCpuTime=None):
+  def __init__(self, exitCode, runTime, oot, oom, userCpuTime=None, sysCpuTime=None, peakMemory=None):
     self.exitCode = exitCode
     self.runTime = runTime
     self.outOfTime = oot
     self.outOfMemory = oom
     self.userCpuTime = userCpuTime
     self.sysCpuTime = sysCpuTime
+    # Peak memory use of the tool in MiB if the backend measures it
+    self.peakMemory = peakMemory
 
     if not (isinstance(self.exitCode, int) or self.exitCode == None):
       msg = 'exitCode was expected to be an int or None but was a {}'.format(
@@ -47,6 +49,11 @@ class BackendResult:
              ' {}'.format(self.sysCpuTime))
       _logger.error(msg)
       raise BackendException(msg)
+    if not (isinstance(self.peakMemory, float) or self.peakMemory == None):
+      msg = ('peakMemory was expected to be a float or None but was'
+             ' {}'.format(self.peakMemory))
+      _logger.error(msg)
+      raise BackendException(msg)
 
 class BackendBaseClass(metaclass=abc.ABCMeta):
   def __init__(self, hostProgramPath, workingDirectory, timeLimit, memoryLimit, stackLimit, **kwargs):
@@ -63,6 +70,7 @@ class BackendBaseClass(metaclass=abc.ABCMeta):
     self.timeLimit = timeLimit
     self.memoryLimit = memoryLimit
     self.stackLimit = stackLimit
+    self.cpuAffinity = None
 
   @property
   def hostProgramPath(self):
@@ -111,7 +119,55 @@ class BackendBaseClass(metaclass=abc.ABCMeta):
     if not ((isinstance(value, int) and value >= 0) or value == None):
       raise BackendException('stackLimit should be an integer >=0 or None. But instead was {}'.format(value))
     self._stackLimit = value
-    
+
+  @property
+  def cpuAffinity(self):
+    """
+      Set of CPU ids the tool is restricted to running on.
+      None implies no restriction.
+    """
+    return self._cpuAffinity
+  @cpuAffinity.setter
+  def cpuAffinity(self, value):
+    if value != None:
+      if not (isinstance(value, (set, frozenset)) and len(value) > 0 and
+              all([ isinstance(cpu, int) and cpu >= 0 for cpu in value ])):
+        raise BackendException('cpuAffinity should be a non empty set of integers >= 0 or None. But instead was {}'.format(value))
+      value = frozenset(value)
+    self._cpuAffinity = value
+
+  def _preExec(self):
+    """
+      Designed to be called subprocess.POpen() after fork.
+      It applies the stack limit and the CPU affinity. Backends that need
+      to do more before the tool is exec'ed should extend this.
+      Note do not try to use the _logger here are the file descriptors have been changed.
+    """
+    if self.stackLimit != None:
+      self._setStacksize()
+    if self.cpuAffinity != None:
+      os.sched_setaffinity(0, self.cpuAffinity)
+
+  def _setStacksize(self):
+    """
+      Designed to be called subprocess.POpen() after fork.
+      It will set any limits as appropriate.
+      Note do not try to use the _logger here are the file descriptors have been changed.
+    """
+    assert self.stackLimit != None
+    assert isinstance(self.stackLimit, int)
+    import resource
+    if self.stackLimit == 0:
+      resource.setrlimit(resource.RLIMIT_STACK, (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
+    else:
+      resource.setrlimit(resource.RLIMIT_STACK, (self.stackLimit, self.stackLimit))
+
+  def _logPreExecLimits(self):
+    if self.stackLimit != None:
+      _logger.info('Using stacksize limit: {} KiB'.format(
+      'unlimited' if self.stackLimit == 0 else self.stackLimit))
+    if self.cpuAffinity != None:
+      _logger.info('Using CPU affinity: {}'.format(sorted(self.cpuAffinity)))
 
   @abc.abstractproperty
   def name(self):
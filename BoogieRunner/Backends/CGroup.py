@@ -0,0 +1,281 @@
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  A backend that runs each tool in its own cgroup v2 leaf below a
+  delegated cgroup. The kernel enforces the memory limit (``memory.max``
+  with no swap) and optionally a CPU limit (``cpu.max``) so no memory
+  polling is needed and the tool can't overshoot its limit. Running out
+  of memory is detected from ``memory.events``. The peak memory use and
+  CPU time of the tool and its children are read from ``memory.peak``
+  and ``cpu.stat``.
+"""
+from . BackendBase import *
+import itertools
+import logging
+import os
+import pprint
+import psutil
+import signal
+import time
+
+_logger = logging.getLogger(__name__)
+
+class CGroupBackendException(BackendException):
+  pass
+
+# Makes the name of each leaf unique within this process
+_leafIds = itertools.count()
+
+# The period (in microseconds) used for ``cpu.max``
+_cpuPeriod = 100000
+
+def _readFile(path):
+  with open(path, 'r') as f:
+    return f.read()
+
+def _writeFile(path, value):
+  with open(path, 'w') as f:
+    f.write(value)
+
+def _readKeyedFile(path):
+  """
+    Read a flat keyed file (e.g. ``memory.events``) into a dictionary.
+  """
+  values = { }
+  for line in _readFile(path).splitlines():
+    parts = line.split()
+    if len(parts) == 2:
+      values[parts[0]] = int(parts[1])
+  return values
+
+class CGroupBackend(BackendBaseClass):
+  def __init__(self, hostProgramPath, workingDirectory, timeLimit, memoryLimit, stackLimit, **kwargs):
+    super().__init__(hostProgramPath, workingDirectory, timeLimit, memoryLimit, stackLimit, **kwargs)
+    self._cgroupRoot = None
+    self._cpuLimit = None
+    self._swapLimit = 0
+
+    if not 'cgroup_root' in kwargs:
+      raise CGroupBackendException('"cgroup_root" must be specified')
+    for key, value in kwargs.items():
+      if key == 'cgroup_root':
+        if not (isinstance(value, str) and os.path.isabs(value)):
+          raise CGroupBackendException('"cgroup_root" must be an absolute path')
+        self._cgroupRoot = value
+        continue
+      if key == 'cpu_limit':
+        if not (isinstance(value, (int, float)) and value > 0):
+          raise CGroupBackendException('"cpu_limit" must be a number > 0')
+        self._cpuLimit = value
+        continue
+      if key == 'swap_limit':
+        if not (isinstance(value, int) and value >= 0):
+          raise CGroupBackendException('"swap_limit" must be an integer >= 0')
+        if memoryLimit == 0:
+          raise CGroupBackendException('Cannot have "swap_limit" specified with no memory limit')
+        self._swapLimit = value
+        continue
+      # Not recognised option
+      raise CGroupBackendException('"{}" key is not a recognised option'.format(key))
+
+    self._enableControllers()
+    self._process = None
+    self._leaf = None
+
+  @property
+  def name(self):
+    return "CGroup"
+
+  def _enableControllers(self):
+    """
+      Check ``cgroup_root`` is a cgroup v2 directory that we can create
+      leaves in and enable the controllers we need for its children.
+    """
+    controllersFile = os.path.join(self._cgroupRoot, 'cgroup.controllers')
+    if not os.path.exists(controllersFile):
+      raise CGroupBackendException('"{}" is not a cgroup v2 directory'.format(self._cgroupRoot))
+    needed = [ ]
+    if self.memoryLimit > 0:
+      needed.append('memory')
+    if self._cpuLimit != None:
+      needed.append('cpu')
+    available = _readFile(controllersFile).split()
+    missing = [ c for c in needed if not c in available ]
+    if len(missing) > 0:
+      raise CGroupBackendException('The {} controller(s) are not available in "{}"'.format(
+        ', '.join(missing), self._cgroupRoot))
+    subtreeControlFile = os.path.join(self._cgroupRoot, 'cgroup.subtree_control')
+    enabled = _readFile(subtreeControlFile).split()
+    toEnable = [ c for c in needed if not c in enabled ]
+    if len(toEnable) > 0:
+      try:
+        _writeFile(subtreeControlFile, ' '.join([ '+' + c for c in toEnable ]))
+      except OSError as e:
+        raise CGroupBackendException('Failed to enable the {} controller(s) in "{}". It must be writable '
+          'and must not contain any processes: {}'.format(', '.join(toEnable), self._cgroupRoot, e))
+
+  def kill(self):
+    leaf = self._leaf
+    if leaf != None:
+      self._killCGroup(leaf)
+
+  def _killCGroup(self, leaf):
+    """
+      Kill every process in ``leaf``.
+    """
+    killFile = os.path.join(leaf, 'cgroup.kill')
+    try:
+      if os.path.exists(killFile):
+        _writeFile(killFile, '1')
+        return
+      # Kernels older than 5.14. Processes might fork whilst we kill them
+      # so keep going until the cgroup is empty.
+      for _ in range(0, 100):
+        pids = [ int(pid) for pid in _readFile(os.path.join(leaf, 'cgroup.procs')).split() ]
+        if len(pids) == 0:
+          return
+        for pid in pids:
+          try:
+            os.kill(pid, signal.SIGKILL)
+          except ProcessLookupError:
+            pass
+        time.sleep(0.01)
+    except FileNotFoundError:
+      # The leaf has already been removed
+      pass
+
+  def _removeCGroup(self, leaf):
+    # A cgroup can only be removed once all of its processes have exited
+    eventsFile = os.path.join(leaf, 'cgroup.events')
+    for _ in range(0, 500):
+      if _readKeyedFile(eventsFile).get('populated', 0) == 0:
+        break
+      time.sleep(0.01)
+    try:
+      os.rmdir(leaf)
+    except OSError as e:
+      _logger.warning('Failed to remove cgroup "{}": {}'.format(leaf, e))
+
+  def _readStats(self, leaf):
+    """
+      Returns ``(outOfMemory, userCpuTime, sysCpuTime, peakMemory)``
+    """
+    outOfMemory = False
+    if self.memoryLimit > 0:
+      events = _readKeyedFile(os.path.join(leaf, 'memory.events'))
+      outOfMemory = events.get('oom_kill', 0) > 0 or events.get('oom_group_kill', 0) > 0
+    cpuStat = _readKeyedFile(os.path.join(leaf, 'cpu.stat'))
+    userCpuTime = cpuStat['user_usec'] / 1e6 if 'user_usec' in cpuStat else None
+    sysCpuTime = cpuStat['system_usec'] / 1e6 if 'system_usec' in cpuStat else None
+    peakMemory = None
+    peakFile = os.path.join(leaf, 'memory.peak')
+    # memory.peak needs Linux >= 5.19 and the memory controller
+    if os.path.exists(peakFile):
+      peakMemory = int(_readFile(peakFile)) / (2**20)
+    return (outOfMemory, userCpuTime, sysCpuTime, peakMemory)
+
+  def _createCGroup(self):
+    leaf = os.path.join(self._cgroupRoot, 'boogie-runner-{}-{}'.format(os.getpid(), next(_leafIds)))
+    try:
+      os.mkdir(leaf)
+    except OSError as e:
+      raise CGroupBackendException('Failed to create cgroup "{}": {}'.format(leaf, e))
+    try:
+      if self.memoryLimit > 0:
+        _writeFile(os.path.join(leaf, 'memory.max'), str(self.memoryLimit * (2**20)))
+        swapMaxFile = os.path.join(leaf, 'memory.swap.max')
+        # Doesn't exist if swap accounting is disabled
+        if os.path.exists(swapMaxFile):
+          _writeFile(swapMaxFile, str(self._swapLimit * (2**20)))
+        else:
+          _logger.debug('"{}" does not exist. Not limiting swap'.format(swapMaxFile))
+        # Kill the whole tool rather than just one of its processes
+        _writeFile(os.path.join(leaf, 'memory.oom.group'), '1')
+      if self._cpuLimit != None:
+        _writeFile(os.path.join(leaf, 'cpu.max'), '{} {}'.format(int(self._cpuLimit * _cpuPeriod), _cpuPeriod))
+    except OSError as e:
+      os.rmdir(leaf)
+      raise CGroupBackendException('Failed to set limits of cgroup "{}": {}'.format(leaf, e))
+    return leaf
+
+  def programPath(self):
+    # We run directly on the host so nothing special here
+    return self.hostProgramPath
+
+  def run(self, cmdLine, logFilePath, envVars):
+    _logger.info('Running:\n{}\nwith env:{}'.format(
+      pprint.pformat(cmdLine),
+      pprint.pformat(envVars)))
+
+    exitCode = None
+    outOfTime = False
+    stats = (False, None, None, None)
+    self._process = None
+    self._leaf = None
+    startTime = time.perf_counter()
+    try:
+      self._leaf = self._createCGroup()
+      _logger.info('Using cgroup {}'.format(self._leaf))
+      with open(logFilePath, 'w') as f:
+        _logger.info('writing to log file {}'.format(logFilePath))
+        self._logPreExecLimits()
+        self._process = psutil.Popen(cmdLine,
+                                     cwd=self.workingDirectory,
+                                     stdout=f,
+                                     stderr=f,
+                                     env=envVars,
+                                     preexec_fn=self._preExec)
+
+        _logger.info('Running with timeout of {} seconds'.format(self.timeLimit))
+        exitCode = self._process.wait(timeout=self.timeLimit if self.timeLimit > 0 else None)
+        if exitCode != None:
+          # Newer psutil versions return an enum when the tool is killed
+          # by a signal which does not serialise to plain YAML.
+          exitCode = int(exitCode)
+    except psutil.TimeoutExpired:
+      outOfTime = True
+      # Note the code in the finally block will sort out clean up
+    finally:
+      leaf = self._leaf
+      if leaf != None:
+        # Kill anything the tool left behind
+        self._killCGroup(leaf)
+      if self._process != None:
+        self._process.wait()
+        self._process = None
+      runTime = time.perf_counter() - startTime
+      if leaf != None:
+        try:
+          stats = self._readStats(leaf)
+        except (OSError, ValueError) as e:
+          _logger.warning('Failed to read statistics of cgroup "{}": {}'.format(leaf, e))
+        self._removeCGroup(leaf)
+        self._leaf = None
+
+    outOfMemory, userCpuTime, sysCpuTime, peakMemory = stats
+    if outOfMemory:
+      _logger.warning('Memory limit reached. Tool was killed')
+    return BackendResult(exitCode, runTime, outOfTime, outOfMemory,
+                         userCpuTime=userCpuTime, sysCpuTime=sysCpuTime, peakMemory=peakMemory)
+
+  def _preExec(self):
+    """
+      Designed to be called subprocess.POpen() after fork.
+      Note do not try to use the _logger here are the file descriptors have been changed.
+    """
+    # Join the leaf before exec so every process of the tool is inside it
+    _writeFile(os.path.join(self._leaf, 'cgroup.procs'), '0')
+    super()._preExec()
+
+  def checkToolExists(self, toolPath):
+    assert os.path.isabs(toolPath)
+    if not os.path.exists(toolPath):
+      raise CGroupBackendException('Tool "{}" does not exist'.format(toolPath))
+
+  @property
+  def workingDirectoryInternal(self):
+    # Nothing special here. We work directly on the host
+    return self.workingDirectory
+
+
+def get():
+  return CGroupBackend
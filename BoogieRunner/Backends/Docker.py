@@ -156,6 +156,10 @@ class DockerBackend(BackendBaseClass):
       extraHostCfgArgs['memswap_limit']='{}m'.format(self.memoryLimit)
       _logger.info('Setting memory limit to {} MiB'.format(self.memoryLimit))
 
+    if self.cpuAffinity != None:
+      extraContainerArgs['cpuset'] = ','.join([ str(cpu) for cpu in sorted(self.cpuAffinity) ])
+      _logger.info('Using CPU set "{}"'.format(extraContainerArgs['cpuset']))
+
     if self._userToUseInsideContainer != None:
       extraContainerArgs['user'] = self._userToUseInsideContainer
       _logger.info('Using user "{}" inside container'.format(self._userToUseInsideContainer))
@@ -1,9 +1,14 @@
 # vim: set sw=2 ts=2 softtabstop=2 expandtab:
 from . BackendBase import *
+from .. import ProcessTree
 import logging
 import os
 import pprint
 import psutil
+import re
+import select
+import signal
+import subprocess
 import threading
 import time
 
@@ -12,6 +17,175 @@ _logger = logging.getLogger(__name__)
 class PythonPsUtilBackendException(BackendException):
   pass
 
+# The ways ``memory_limit_mode`` can enforce the memory limit. ``poll``
+# samples the memory use of the tool. The others set a resource limit on
+# every process of the tool so allocations beyond the limit fail.
+_memoryLimitModes = {
+  'poll': None,
+  'rlimit_as': 'RLIMIT_AS',
+  'rlimit_data': 'RLIMIT_DATA',
+}
+
+# Messages printed by tools (or their runtimes) when an allocation fails
+_allocationFailurePattern = re.compile(
+  r'std::bad_alloc|MemoryError|OutOfMemoryException|Cannot allocate memory|out of memory',
+  re.IGNORECASE)
+
+# How much of the end of the log is searched for allocation failures
+_allocationFailureLogBytes = 64 * 1024
+
+def _peakResidentSetSizeInMiB(process):
+  """
+    Returns the peak resident set size (``VmHWM``) of ``process`` in MiB
+    or None if it has exited. Unlike ``ru_maxrss`` this only covers the
+    memory mapped since the tool was exec'ed so it does not include the
+    memory of the runner that forked it.
+  """
+  try:
+    with open('/proc/{}/status'.format(process.pid), 'r') as f:
+      for line in f:
+        if line.startswith('VmHWM:'):
+          # In KiB
+          return int(line.split()[1]) / 1024
+  except (FileNotFoundError, ProcessLookupError):
+    pass
+  # Zombies have no memory statistics
+  return None
+
+class _MonitoredJob:
+  def __init__(self, backend, process, memoryLimit, pollTimePeriod):
+    self.backend = backend
+    self.process = process
+    # Zero implies the memory limit is not enforced by sampling
+    self.memoryLimit = memoryLimit
+    self.pollTimePeriod = pollTimePeriod
+    # Sample straight away so the peak of short lived tools is known
+    self.nextSampleTime = time.monotonic()
+    # Highest sum of the peak resident set sizes of the processes of the tool
+    self.peakMemory = None
+    # Thread killing the tool once it has run out of memory
+    self.killThread = None
+
+  def updatePeakMemory(self, processes):
+    total = None
+    for process in processes:
+      peak = _peakResidentSetSizeInMiB(process)
+      if peak != None:
+        total = peak if total == None else total + peak
+    if total != None and (self.peakMemory == None or total > self.peakMemory):
+      self.peakMemory = total
+
+class _ResourceMonitor:
+  """
+    A single thread that samples the memory use of every running tool in
+    this process, recording its peak and enforcing its memory limit. Each
+    tick the memory use of the process tree of every job that is due to be
+    sampled is computed in one pass. The thread exits when no jobs are
+    registered.
+  """
+  def __init__(self):
+    self._condition = threading.Condition()
+    self._jobs = set()
+    # Jobs being sampled right now
+    self._sampling = set()
+    self._thread = None
+
+  def register(self, job):
+    with self._condition:
+      self._jobs.add(job)
+      if self._thread == None:
+        self._thread = threading.Thread(target=self._run, name='resource_monitor', daemon=True)
+        self._thread.start()
+      self._condition.notify_all()
+
+  def unregister(self, job):
+    """
+      Stop monitoring ``job``. If it is being sampled this waits for the
+      sample to finish so any out of memory kill has been started.
+    """
+    with self._condition:
+      self._jobs.discard(job)
+      self._condition.notify_all()
+      while job in self._sampling:
+        self._condition.wait()
+
+  def _run(self):
+    _logger.debug('Resource monitor started')
+    while True:
+      with self._condition:
+        if len(self._jobs) == 0:
+          self._thread = None
+          _logger.debug('Resource monitor stopped')
+          return
+        now = time.monotonic()
+        due = [ job for job in self._jobs if job.nextSampleTime <= now and job.killThread == None ]
+        if len(due) == 0:
+          waiting = [ job.nextSampleTime for job in self._jobs if job.killThread == None ]
+          self._condition.wait(max(0.0, min(waiting) - now) if len(waiting) > 0 else None)
+          continue
+        for job in due:
+          job.nextSampleTime = now + job.pollTimePeriod
+        self._sampling.update(due)
+      try:
+        self._sample(due)
+      finally:
+        with self._condition:
+          self._sampling.clear()
+          self._condition.notify_all()
+
+  def _sample(self, jobs):
+    for job in jobs:
+      try:
+        if not job.backend._processIsRunning(job.process):
+          continue
+        children = ProcessTree.descendants(job.process)
+        job.updatePeakMemory([ job.process ] + children)
+        if job.memoryLimit == 0:
+          continue
+        totalMemoryUsage = job.backend._getProcessMemoryUsageInMiB(job.process)
+      except psutil.NoSuchProcess:
+        continue
+      # The process might of forked so add the memory usage of its children too
+      childCount = 0
+      for child in children:
+        try:
+          totalMemoryUsage += job.backend._getProcessMemoryUsageInMiB(child)
+          childCount += 1
+        except psutil.NoSuchProcess:
+          _logger.warning('Child process disappeared whilst examining it\'s memory use')
+
+      _logger.debug('Total memory usage in MiB:{} of PID {}'.format(totalMemoryUsage, job.process.pid))
+      _logger.debug('Total number of children: {}'.format(childCount))
+
+      if totalMemoryUsage > job.memoryLimit:
+        _logger.warning('Memory limit reached (recorded {} MiB). Killing tool with PID {}'.format(
+          totalMemoryUsage, job.process.pid))
+        job.backend._outOfMemory = True
+        # Give the tool a chance to clean up after itself before aggressively
+        # killing it. Do that on another thread so other jobs are still sampled.
+        job.killThread = threading.Thread(target=self._killOutOfMemory, args=(job,),
+          name='memory_killer-{}'.format(job.process.pid), daemon=True)
+        job.killThread.start()
+
+  def _killOutOfMemory(self, job):
+    try:
+      job.backend._terminateProcess(job.process, pause=1.0)
+    except psutil.NoSuchProcess:
+      _logger.warning('Main process no longer available')
+
+_monitor = None
+_monitorPid = None
+_monitorLock = threading.Lock()
+
+def _getMonitor():
+  global _monitor, _monitorPid
+  with _monitorLock:
+    # A forked worker process does not inherit the monitor's thread
+    if _monitor == None or _monitorPid != os.getpid():
+      _monitor = _ResourceMonitor()
+      _monitorPid = os.getpid()
+    return _monitor
+
 class PythonPsUtilBackend(BackendBaseClass):
   def __init__(self, hostProgramPath, workingDirectory, timeLimit, memoryLimit, stackLimit, **kwargs):
     super().__init__(hostProgramPath, workingDirectory, timeLimit, memoryLimit, stackLimit, **kwargs)
@@ -30,20 +204,41 @@ class PythonPsUtilBackend(BackendBaseClass):
       raise PythonPsUtilBackendException(
         '{} must be a float > 0.0'.format(memoryLimitTimePeriodKey))
 
+    memoryLimitModeKey = 'memory_limit_mode'
+    self.memoryLimitMode = kwargs.get(memoryLimitModeKey, 'poll')
+    if not self.memoryLimitMode in _memoryLimitModes:
+      raise PythonPsUtilBackendException('{} must be one of {}'.format(
+        memoryLimitModeKey, ', '.join(sorted(_memoryLimitModes.keys()))))
+    if self.memoryLimitMode != 'poll':
+      if memoryLimit == 0:
+        raise PythonPsUtilBackendException('Cannot have "{}" specified with no memory limit'.format(
+          memoryLimitModeKey))
+      if memoryLimitTimePeriodKey in kwargs:
+        raise PythonPsUtilBackendException('Cannot have "{}" specified when "{}" is "{}"'.format(
+          memoryLimitTimePeriodKey, memoryLimitModeKey, self.memoryLimitMode))
+
     self._process = None
-    self._eventObj = None
+    self._group = None
 
   @property
   def name(self):
     return "PythonPsUtil"
 
   def kill(self):
-    if self._process != None:
+    process = self._process
+    if process != None:
       try:
-        if self._process.is_running():
-          self._terminateProcess(self._process, 0.0)
+        if process.is_running():
+          self._terminateProcess(process, 0.0)
       except psutil.NoSuchProcess:
         pass
+      # Descendants that outlived the tool are still in its process group
+      self._signalProcessGroup(signal.SIGKILL)
+
+  def _signalProcessGroup(self, signalNumber):
+    group = self._group
+    if group != None:
+      group.signal(signalNumber)
 
   def programPath(self):
     # We run directly on the host so nothing special here
@@ -60,9 +255,12 @@ class PythonPsUtilBackend(BackendBaseClass):
 
     # Run the tool
     exitCode = None
+    rusage = None
+    popen = None
     self._process = None
+    self._group = None
     startTime = time.perf_counter()
-    pollThread = None
+    monitoredJob = None
     self._outOfMemory = False
     outOfTime = False
     runTime = 0.0
@@ -70,58 +268,176 @@ class PythonPsUtilBackend(BackendBaseClass):
       try:
         _logger.info('writing to log file {}'.format(logFilePath))
         preExecFn = None
-        if self.stackLimit != None:
-          preExecFn = self._setStacksize
-          _logger.info('Using stacksize limit: {} KiB'.format(
-          'unlimited' if self.stackLimit == 0 else self.stackLimit))
-        self._process = psutil.Popen(cmdLine,
-                                     cwd=self.workingDirectory,
-                                     stdout=f,
-                                     stderr=f,
-                                     env=envVars,
-                                     preexec_fn=preExecFn)
-
-        if self.memoryLimit > 0:
-          pollThread = self._memoryLimitPolling(self._process)
+        self._logPreExecLimits()
+        if self._usesMemoryRLimit:
+          _logger.info('Enforcing memory limit of {} MiB with {}'.format(
+            self.memoryLimit, _memoryLimitModes[self.memoryLimitMode]))
+        if self.stackLimit != None or self.cpuAffinity != None or self._usesMemoryRLimit:
+          preExecFn = self._preExec
+        # Run the tool in its own session so it and everything it forks
+        # are in a process group that can be signalled at once.
+        popen = subprocess.Popen(cmdLine,
+                                 cwd=self.workingDirectory,
+                                 stdout=f,
+                                 stderr=f,
+                                 env=envVars,
+                                 preexec_fn=preExecFn,
+                                 start_new_session=True)
+        # The tool is only reaped by _reap() so this can't fail
+        self._group = ProcessTree.ProcessGroup(popen.pid)
+        self._process = psutil.Process(popen.pid)
+
+        # The memory use of the tool is sampled to find its peak and to
+        # enforce the memory limit. Nothing polls the tool when the limit
+        # is enforced with a resource limit.
+        if not self._usesMemoryRLimit:
+          if self.memoryLimit > 0:
+            _logger.info('Monitoring memory use of PID {} with polling time period of {} seconds'.format(
+              self._process.pid, self.memoryLimitPollTimePeriodInSeconds))
+          monitoredJob = _MonitoredJob(self, self._process, self.memoryLimit, self.memoryLimitPollTimePeriodInSeconds)
+          _getMonitor().register(monitoredJob)
 
         _logger.info('Running with timeout of {} seconds'.format(self.timeLimit))
-        exitCode = self._process.wait(timeout=self.timeLimit)
+        exitCode, rusage = self._reap(popen, timeout=self.timeLimit if self.timeLimit > 0 else None)
       except (psutil.TimeoutExpired) as e:
         outOfTime = True
         # Note the code in the finally block will sort out clean up
       finally:
+        if monitoredJob != None:
+          _getMonitor().unregister(monitoredJob)
+          # Sample a tool that is still running (e.g. it timed out) one last time
+          monitoredJob.updatePeakMemory([ self._process ] + ProcessTree.descendants(self._process))
         self.kill()
-
-        # This is a sanity check to make sure that the memory polling thread exits
-        # before this method exits
-        if pollThread != None:
-          if self._eventObj != None:
-            self._eventObj.set() # Wake up polling thread if it's blocked on eventObj
-          _logger.debug('Joining memory polling thread START')
-          try:
-            pollThread.join()
-            _logger.debug('Joining memory polling thread FINISHED')
-          except RuntimeError:
-            _logger.error('RuntimeError waiting for memory polling thread to terminate')
+        if popen != None and popen.returncode == None:
+          # The tool was killed. Reap it so its resource usage is still known.
+          _, rusage = self._reap(popen, timeout=None)
+
+        # Make sure that killing a tool that ran out of memory has
+        # finished before this method exits
+        if monitoredJob != None and monitoredJob.killThread != None:
+          _logger.debug('Joining memory killer thread START')
+          monitoredJob.killThread.join()
+          _logger.debug('Joining memory killer thread FINISHED')
         self._process = None
 
         endTime = time.perf_counter()
         runTime = endTime - startTime
 
-    return BackendResult(exitCode, runTime, outOfTime, self._outOfMemory)
-  def _setStacksize(self):
+    if not outOfTime and self._allocationFailed(exitCode, logFilePath):
+      _logger.warning('Memory limit reached. Tool failed to allocate memory')
+      self._outOfMemory = True
+
+    userCpuTime, sysCpuTime, peakMemory = None, None, None
+    if rusage != None:
+      userCpuTime = float(rusage.ru_utime)
+      sysCpuTime = float(rusage.ru_stime)
+    # ru_maxrss is not used because the tool inherits the peak of the
+    # runner when it is forked
+    if monitoredJob != None:
+      peakMemory = monitoredJob.peakMemory
+
+    return BackendResult(exitCode, runTime, outOfTime, self._outOfMemory,
+                         userCpuTime=userCpuTime, sysCpuTime=sysCpuTime, peakMemory=peakMemory)
+
+  def _reap(self, popen, timeout):
+    """
+      Wait for the tool started by ``popen`` to exit and reap it with
+      ``os.wait4()`` so its resource usage is known. The usage covers the
+      tool and any of its descendants it waited for. What is left of its
+      process group is killed just before it is reaped. A ``timeout`` of
+      None waits forever.
+
+      Returns ``(exitCode, rusage)``. Raises ``psutil.TimeoutExpired`` if
+      the tool is still running after ``timeout`` seconds.
+    """
+    if timeout == None:
+      os.waitid(os.P_PID, popen.pid, os.WEXITED | os.WNOWAIT)
+    elif not self._waitForExit(popen.pid, timeout):
+      raise psutil.TimeoutExpired(timeout, popen.pid)
+    _, status, rusage = self._group.reap(lambda: os.wait4(popen.pid, 0))
+    if os.WIFSIGNALED(status):
+      exitCode = -os.WTERMSIG(status)
+    else:
+      exitCode = os.WEXITSTATUS(status)
+    # Stop subprocess from trying to reap the tool itself
+    popen.returncode = exitCode
+    return (exitCode, rusage)
+
+  def _waitForExit(self, pid, timeout):
+    """
+      Returns True if the process ``pid`` exits within ``timeout``
+      seconds. The process is not reaped.
+    """
+    try:
+      pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+      # Needs Python >= 3.9 and Linux >= 5.3
+      pidfd = None
+    if pidfd != None:
+      try:
+        poller = select.poll()
+        poller.register(pidfd, select.POLLIN)
+        return len(poller.poll(timeout * 1000)) > 0
+      finally:
+        os.close(pidfd)
+
+    # Poll in the same way as subprocess.Popen.wait()
+    endTime = time.monotonic() + timeout
+    delay = 0.0005
+    while os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) == None:
+      remaining = endTime - time.monotonic()
+      if remaining <= 0:
+        return False
+      delay = min(delay * 2, remaining, 0.05)
+      time.sleep(delay)
+    return True
+
+  @property
+  def _usesMemoryRLimit(self):
+    return self.memoryLimit > 0 and self.memoryLimitMode != 'poll'
+
+  def _allocationFailed(self, exitCode, logFilePath):
+    """
+      Returns True if the tool exited abnormally because an allocation
+      failed. A tool that hits a resource limit on memory isn't killed,
+      its allocations just fail, so this is inferred from the exit code
+      and the messages at the end of its log. It is always False when
+      the memory limit isn't a resource limit as then an allocation can
+      only fail for reasons that have nothing to do with ``max_memory``.
+    """
+    if not self._usesMemoryRLimit:
+      return False
+    if exitCode == None or exitCode == 0:
+      return False
+    try:
+      with open(logFilePath, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - _allocationFailureLogBytes))
+        logTail = f.read().decode(errors='replace')
+    except OSError as e:
+      _logger.warning('Failed to read log file "{}": {}'.format(logFilePath, e))
+      return False
+    return _allocationFailurePattern.search(logTail) != None
+
+  def _preExec(self):
     """
       Designed to be called subprocess.POpen() after fork.
-      It will set any limits as appropriate.
       Note do not try to use the _logger here are the file descriptors have been changed.
     """
-    assert self.stackLimit != None
-    assert isinstance(self.stackLimit, int)
+    super()._preExec()
+    if self._usesMemoryRLimit:
+      self._setMemoryLimit()
+
+  def _setMemoryLimit(self):
+    """
+      Designed to be called subprocess.POpen() after fork.
+      It will set the resource limit used to enforce the memory limit.
+      Note do not try to use the _logger here are the file descriptors have been changed.
+    """
+    assert self._usesMemoryRLimit
     import resource
-    if self.stackLimit == 0:
-      resource.setrlimit(resource.RLIMIT_STACK, (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
-    else:
-      resource.setrlimit(resource.RLIMIT_STACK, (self.stackLimit, self.stackLimit))
+    limit = self.memoryLimit * (2**20)
+    resource.setrlimit(getattr(resource, _memoryLimitModes[self.memoryLimitMode]), (limit, limit))
 
   def _getProcessMemoryUsageInMiB(self, process):
     # use Virtual memory size rather than resident set
@@ -130,9 +446,10 @@ class PythonPsUtilBackend(BackendBaseClass):
   def _terminateProcess(self, process, pause):
     assert isinstance(pause, float)
     assert pause >= 0.0
-    # Gently terminate
+    # Gently terminate. The tool is the leader of its process group.
     _logger.debug('Trying to terminate PID:{}'.format(process.pid))
-    children = process.children(recursive=True)
+    children = ProcessTree.descendants(process)
+    self._signalProcessGroup(signal.SIGTERM)
     process.terminate()
     for child in children:
       try:
@@ -148,7 +465,8 @@ class PythonPsUtilBackend(BackendBaseClass):
 
     # Now aggresively kill
     _logger.info('Trying to kill PID:{}'.format(process.pid))
-    children = process.children(recursive=True)
+    children = ProcessTree.descendants(process)
+    self._signalProcessGroup(signal.SIGKILL)
     process.kill()
     for child in children:
       try:
@@ -160,55 +478,6 @@ class PythonPsUtilBackend(BackendBaseClass):
   def _processIsRunning(self, process):
     return process.is_running() and not process.status() == psutil.STATUS_ZOMBIE
 
-  def _memoryLimitPolling(self, process):
-    """
-      This function launches a new thread that will periodically
-      poll the total memory usage of the tool that is being run.
-      If it goes over the limit will kill it
-    """
-    assert self.memoryLimitPollTimePeriodInSeconds > 0
-    assert self._outOfMemory == False
-
-    # Other parts of the runner can can set on this to prevent this thread
-    # from waiting on this Event object.
-    self._eventObj = threading.Event()
-    self._eventObj.clear()
-
-    def threadBody():
-      _logger.info('Launching memory limit polling thread for PID {} with polling time period of {} seconds'.format(
-        process.pid, self.memoryLimitPollTimePeriodInSeconds))
-      try:
-        while self._processIsRunning(process):
-          self._eventObj.wait(self.memoryLimitPollTimePeriodInSeconds)
-          totalMemoryUsage = 0
-          totalMemoryUsage += self._getProcessMemoryUsageInMiB(process)
-
-          # The process might of forked so add the memory usage of its children too
-          childCount = 0
-          for childProc in process.children(recursive=True):
-            try:
-              totalMemoryUsage += self._getProcessMemoryUsageInMiB(childProc)
-              childCount += 1
-            except psutil.NoSuchProcess:
-              _logger.warning('Child process disappeared whilst examining it\'s memory use')
-
-          _logger.debug('Total memory usage in MiB:{}'.format(totalMemoryUsage))
-          _logger.debug('Total number of children: {}'.format(childCount))
-
-          if totalMemoryUsage > self.memoryLimit:
-            _logger.warning('Memory limit reached (recorded {} MiB). Killing tool with PID {}'.format(totalMemoryUsage, process.pid))
-            self._outOfMemory = True
-            # Give the tool a chance to clean up after itself before aggressively killing it
-            self._terminateProcess(process, pause=1.0)
-            break
-      except psutil.NoSuchProcess:
-        _logger.warning('Main process no longer available')
-
-    newThreadName = 'memory_poller-{}'.format(process.pid)
-    thread = threading.Thread(target=threadBody, name=newThreadName, daemon=True)
-    thread.start()
-    return thread
-
   def checkToolExists(self, toolPath):
     assert os.path.isabs(toolPath)
     if not os.path.exists(toolPath):
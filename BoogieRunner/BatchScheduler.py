@@ -0,0 +1,460 @@
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Scheduler used by ``boogie-batch-runner.py`` to decide when each job
+  is submitted to the executor.
+
+  Jobs are dispatched in the order they were added unless a picker is
+  set (see ``BatchScheduler.setPicker()``). A job is only dispatched
+  when there are enough free job slots for the tools it runs and every
+  admission policy agrees that it can start.
+"""
+import collections
+import concurrent.futures
+import glob
+import logging
+import os
+import psutil
+import time
+from . import ProcessTree
+
+_logger = logging.getLogger(__name__)
+
+class BatchSchedulerException(Exception):
+  def __init__(self, msg):
+    self.msg = msg
+
+class Job:
+  """
+    A single run of a runner on a program.
+  """
+  def __init__(self, program, workDir, rc, context=None):
+    self.program = program
+    self.workDir = workDir
+    self.rc = rc
+    # Opaque object that the creator of the job can use to associate
+    # its own state with the job
+    self.context = context
+    # Set of CPU ids the job should be pinned to. None implies no pinning.
+    self.cpus = None
+    # Extra entries to add to the job's result
+    self.tags = { }
+
+  @property
+  def maxMemory(self):
+    """
+      Memory limit in MiB of the job. Zero implies unlimited.
+    """
+    return self.rc.get('max_memory', 0)
+
+  @property
+  def maxTime(self):
+    """
+      Time limit in seconds of the job. Zero implies unlimited.
+    """
+    return self.rc.get('max_time', 0)
+
+  @property
+  def tools(self):
+    """
+      A list of ``(workDir, maxMemory)`` tuples, one for each tool the
+      job runs.
+    """
+    return [ (self.workDir, self.maxMemory) ]
+
+  @property
+  def slots(self):
+    """
+      The number of job slots the job uses, one for each tool it runs
+      at the same time.
+    """
+    return 1
+
+class PortfolioJob(Job):
+  """
+    Several runners raced on the same program at the same time.
+
+    members: A list of ``(name, runnerName, workDir, rc)`` tuples (see
+             ``BatchWorker.runPortfolio()``).
+  """
+  def __init__(self, program, members, context=None):
+    assert len(members) > 0
+    super().__init__(program, None, None, context)
+    self.members = members
+
+  @property
+  def maxMemory(self):
+    # The members run at the same time so they need the sum of their limits
+    limits = [ rc.get('max_memory', 0) for _, _, _, rc in self.members ]
+    if any([ limit <= 0 for limit in limits ]):
+      return 0
+    return sum(limits)
+
+  @property
+  def maxTime(self):
+    limits = [ rc.get('max_time', 0) for _, _, _, rc in self.members ]
+    if any([ limit <= 0 for limit in limits ]):
+      return 0
+    return max(limits)
+
+  @property
+  def tools(self):
+    return [ (workDir, rc.get('max_memory', 0)) for _, _, workDir, rc in self.members ]
+
+  @property
+  def slots(self):
+    return len(self.members)
+
+class AdmissionPolicy:
+  """
+    Base class for policies that decide if a job can start.
+  """
+  # If not None the scheduler will re-check blocked jobs at least
+  # this often (in seconds) rather than only when a job finishes.
+  pollTimePeriod = None
+
+  def queued(self, pendingJobs, runningJobs):
+    """
+      Called before the scheduler tries to dispatch jobs with the jobs
+      that may still be dispatched (in the order they were added). The
+      policy must not modify ``pendingJobs``.
+    """
+    pass
+
+  def canAdmit(self, job, runningJobs):
+    return True
+
+  def started(self, job):
+    pass
+
+  def finished(self, job):
+    pass
+
+class MemoryBudgetPolicy(AdmissionPolicy):
+  """
+    Only admit a job if its ``max_memory`` fits inside the memory budget.
+
+    By default the ``max_memory`` of every running job is reserved. If
+    ``sampleUsage`` is True then the memory actually used by the tools
+    running is sampled instead which allows the budget to be overcommited
+    when tools use less than their limit. The ``max_memory`` of a tool is
+    still reserved until it has been sampled at least once. Otherwise the
+    jobs admitted together (before any of their tools have started) would
+    not count against the budget.
+  """
+  def __init__(self, budgetInMiB, sampleUsage=False, pollTimePeriod=1.0, sampler=None):
+    """
+      sampler: Function used instead of ``sampleToolMemoryUsageInMiB()``
+               when ``sampleUsage`` is True.
+    """
+    assert budgetInMiB > 0
+    self.budgetInMiB = budgetInMiB
+    self.sampleUsage = sampleUsage
+    self._sampler = sampler if sampler != None else sampleToolMemoryUsageInMiB
+    # Maps the working directory of each running tool that has been
+    # sampled to the memory (in MiB) it used when it was last sampled.
+    self._sampled = { }
+    if self.sampleUsage:
+      self.pollTimePeriod = pollTimePeriod
+
+  def check(self, job):
+    """
+      Raise an exception if ``job`` could never be admitted.
+    """
+    if job.maxMemory == 0:
+      raise BatchSchedulerException('"max_memory" must be set to use a memory budget')
+    if job.maxMemory > self.budgetInMiB:
+      raise BatchSchedulerException('"max_memory" ({} MiB) is larger than the memory budget ({} MiB)'.format(
+        job.maxMemory, self.budgetInMiB))
+
+  def canAdmit(self, job, runningJobs):
+    if len(runningJobs) == 0:
+      return True
+    if self.sampleUsage:
+      used = self._sampleUsage(runningJobs)
+    else:
+      used = sum([ j.maxMemory for j in runningJobs ])
+    return used + job.maxMemory <= self.budgetInMiB
+
+  def _sampleUsage(self, runningJobs):
+    tools = [ tool for j in runningJobs for tool in j.tools ]
+    usage = self._sampler([ workDir for workDir, _ in tools ])
+    used = 0
+    for workDir, maxMemory in tools:
+      if workDir in usage:
+        self._sampled[workDir] = usage[workDir]
+      # A tool that hasn't started yet (or whose memory use can't be
+      # sampled) keeps its reservation.
+      used += self._sampled.get(workDir, maxMemory)
+    return used
+
+  def finished(self, job):
+    for workDir, _ in job.tools:
+      self._sampled.pop(workDir, None)
+
+class CpuSlotPolicy(AdmissionPolicy):
+  """
+    Give each running job a dedicated CPU slot. A job is only admitted
+    when a slot is free. The job's ``cpus`` are set to the CPUs of its
+    slot and the slot id is recorded in the job's tags as ``cpu_slot``.
+  """
+  def __init__(self, slots):
+    """
+      slots: A list of sets of CPU ids. The index of each set is its slot id.
+    """
+    assert len(slots) > 0
+    self.slots = [ frozenset(s) for s in slots ]
+    self._free = list(range(0, len(self.slots)))
+
+  def canAdmit(self, job, runningJobs):
+    return len(self._free) > 0
+
+  def started(self, job):
+    # Always use the lowest free slot so slot usage is predictable
+    slotId = self._free.pop(0)
+    job.cpus = self.slots[slotId]
+    job.tags['cpu_slot'] = slotId
+
+  def finished(self, job):
+    slotId = job.tags['cpu_slot']
+    assert not slotId in self._free
+    self._free.append(slotId)
+    self._free.sort()
+
+def parseCpuList(cpuList):
+  """
+    Parse a CPU list in the format used by the kernel
+    (e.g. ``0-3,8,10-11``) into a sorted list of CPU ids.
+  """
+  cpus = set()
+  for part in cpuList.strip().split(','):
+    if len(part) == 0:
+      continue
+    try:
+      if '-' in part:
+        first, last = part.split('-', 1)
+        first, last = int(first), int(last)
+        if first > last:
+          raise ValueError()
+        cpus.update(range(first, last +1))
+      else:
+        cpus.add(int(part))
+    except ValueError:
+      raise BatchSchedulerException('"{}" is not a valid CPU list'.format(cpuList))
+  if len(cpus) == 0:
+    raise BatchSchedulerException('CPU list "{}" is empty'.format(cpuList))
+  return sorted(cpus)
+
+def availableCpus():
+  """
+    Returns the sorted list of CPU ids that this process may run on.
+  """
+  return sorted(os.sched_getaffinity(0))
+
+def logicalCpuSlots():
+  """
+    Returns a slot for every CPU this process may run on.
+  """
+  return [ { cpu } for cpu in availableCpus() ]
+
+def physicalCoreSlots():
+  """
+    Returns a slot for every physical core that this process may run
+    on. Only the lowest numbered SMT sibling of each core is used so
+    jobs never share a core.
+  """
+  available = set(availableCpus())
+  cores = { }
+  for path in glob.glob('/sys/devices/system/cpu/cpu[0-9]*/topology/thread_siblings_list'):
+    with open(path, 'r') as f:
+      siblings = parseCpuList(f.read())
+    usable = [ cpu for cpu in siblings if cpu in available ]
+    if len(usable) > 0:
+      cores[tuple(siblings)] = usable[0]
+
+  if len(cores) == 0:
+    raise BatchSchedulerException('Could not determine the physical cores of this machine')
+  return [ { cpu } for cpu in sorted(cores.values()) ]
+
+def _workingDirectory(pid):
+  try:
+    return os.readlink('/proc/{}/cwd'.format(pid))
+  except OSError:
+    # The process exited or isn't ours
+    return None
+
+def sampleToolMemoryUsageInMiB(workDirs):
+  """
+    Returns a dictionary mapping each directory in ``workDirs`` to the
+    total resident memory (in MiB) used by the tool running in it. A tool
+    is found by following the descendants of this process until one is
+    reached whose working directory is in ``workDirs``. Its descendants
+    are counted with it. The processes in between (e.g. worker processes)
+    are not counted. Directories with no tool running are left out.
+  """
+  byRealPath = { os.path.realpath(workDir): workDir for workDir in workDirs }
+  usage = { }
+  toVisit = ProcessTree.childPids(os.getpid())
+  while len(toVisit) > 0:
+    pid = toVisit.pop()
+    workDir = byRealPath.get(_workingDirectory(pid), None)
+    if workDir == None:
+      toVisit.extend(ProcessTree.childPids(pid))
+      continue
+    total = 0
+    for toolPid in [ pid ] + ProcessTree.descendantPids(pid):
+      try:
+        total += psutil.Process(toolPid).memory_info().rss
+      except psutil.NoSuchProcess:
+        pass
+    usage[workDir] = usage.get(workDir, 0) + total / (2**20)
+  return usage
+
+def detectMemoryBudgetInMiB():
+  """
+    Returns the memory currently available on the host in MiB.
+  """
+  return int(psutil.virtual_memory().available / (2**20))
+
+class BatchScheduler:
+  def __init__(self, maxJobs):
+    assert maxJobs > 0
+    self.maxJobs = maxJobs
+    self._pending = collections.deque()
+    self._running = { } # Future to job
+    self._policies = [ ]
+    self._picker = None
+    self._cancelled = False
+    self._stopped = False
+
+  def addPolicy(self, policy):
+    self._policies.append(policy)
+
+  def setPicker(self, picker):
+    """
+      picker: A function that takes the pending jobs and returns the one
+              to dispatch next or None if no more jobs should be
+              dispatched. The scheduler then stops (see ``stopped``).
+    """
+    self._picker = picker
+
+  def addJob(self, job):
+    """
+      Add a job to the end of the queue. This may be called
+      whilst ``run()`` is executing.
+    """
+    if job.slots > self.maxJobs:
+      raise BatchSchedulerException('Job for "{}" runs {} tools at once but only {} jobs may run at once'.format(
+        job.program, job.slots, self.maxJobs))
+    self._pending.append(job)
+
+  @property
+  def pendingCount(self):
+    return len(self._pending)
+
+  @property
+  def runningJobs(self):
+    return list(self._running.values())
+
+  @property
+  def usedSlots(self):
+    return sum([ job.slots for job in self._running.values() ])
+
+  @property
+  def cancelled(self):
+    return self._cancelled
+
+  @property
+  def stopped(self):
+    """
+      True if the picker stopped the scheduler. The running jobs are
+      left to finish but the jobs that were never dispatched are
+      yielded with a cancelled future.
+    """
+    return self._stopped
+
+  def cancel(self):
+    """
+      Stop dispatching jobs and cancel the futures of any jobs that
+      have not started. This is safe to call from a signal handler.
+    """
+    self._cancelled = True
+    for future in list(self._running.keys()):
+      future.cancel()
+
+  def _canAdmit(self, job):
+    runningJobs = self.runningJobs
+    for policy in self._policies:
+      if not policy.canAdmit(job, runningJobs):
+        return False
+    return True
+
+  def _dispatch(self, submit):
+    pendingJobs = self._pending if not (self._cancelled or self._stopped) else collections.deque()
+    for policy in self._policies:
+      policy.queued(pendingJobs, self.runningJobs)
+    while (not self._cancelled and not self._stopped and len(self._pending) > 0 and
+           self.usedSlots < self.maxJobs):
+      if self._picker != None:
+        job = self._picker(self._pending)
+        if job == None:
+          _logger.info('Not dispatching the remaining {} jobs'.format(len(self._pending)))
+          self._stopped = True
+          return False
+      else:
+        job = self._pending[0]
+      if self.usedSlots + job.slots > self.maxJobs:
+        _logger.debug('Job for "{}" waiting for {} free job slots'.format(job.program, job.slots))
+        return False
+      if not self._canAdmit(job):
+        _logger.debug('Job for "{}" not admitted yet'.format(job.program))
+        return True
+      if job is self._pending[0]:
+        self._pending.popleft()
+      else:
+        self._pending.remove(job)
+      for policy in self._policies:
+        policy.started(job)
+      self._running[submit(job)] = job
+    return False
+
+  def run(self, submit):
+    """
+      Generator that dispatches the jobs and yields ``(job, future)``
+      tuples as each job finishes.
+
+      submit: A function that takes a job, submits it to an executor
+              and returns the future.
+
+      When cancelled or stopped the jobs that were never dispatched are
+      yielded with a cancelled future.
+    """
+    while len(self._pending) > 0 or len(self._running) > 0:
+      blocked = self._dispatch(submit)
+
+      if self._cancelled or self._stopped:
+        while len(self._pending) > 0:
+          future = concurrent.futures.Future()
+          future.cancel()
+          yield (self._pending.popleft(), future)
+
+      timeout = None
+      if blocked:
+        periods = [ p.pollTimePeriod for p in self._policies if p.pollTimePeriod != None ]
+        if len(periods) > 0:
+          timeout = min(periods)
+
+      if len(self._running) == 0:
+        if blocked:
+          if timeout == None:
+            raise BatchSchedulerException('Job for "{}" cannot be admitted'.format(self._pending[0].program))
+          # A polling policy (e.g. waiting for the scheduling daemon) may admit it later
+          time.sleep(timeout)
+        continue
+
+      done, _ = concurrent.futures.wait(list(self._running.keys()), timeout=timeout,
+        return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        job = self._running.pop(future)
+        for policy in self._policies:
+          policy.finished(job)
+        yield (job, future)
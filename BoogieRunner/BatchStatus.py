@@ -0,0 +1,224 @@
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Periodically write the progress of ``boogie-batch-runner.py`` to a
+  JSON status file so long runs can be monitored without reading logs.
+
+  The file is rewritten atomically (written to a temporary file and then
+  renamed) so readers never see a partially written file.
+"""
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from .BrUtil import FinalResultType, classifyResult
+
+_logger = logging.getLogger(__name__)
+
+def percentile(sortedValues, p):
+  """
+    Returns the ``p``th percentile (0 <= p <= 100) of ``sortedValues``
+    using the nearest rank method.
+  """
+  assert len(sortedValues) > 0
+  assert 0 <= p <= 100
+  rank = max(1, int(-(-p * len(sortedValues) // 100)))
+  return sortedValues[rank -1]
+
+class BatchStatus:
+  def __init__(self, path, totalJobs, maxJobs, maxTime, interval):
+    """
+      path: The status file to write.
+      totalJobs: The number of jobs in the batch.
+      maxJobs: The number of jobs that can run in parallel.
+      maxTime: The time limit (in seconds) of the jobs. Zero implies no limit.
+      interval: How often (in seconds) to rewrite the status file.
+    """
+    assert interval > 0
+    self.path = path
+    self.maxJobs = maxJobs
+    self.maxTime = maxTime
+    self.interval = interval
+    self._lock = threading.Lock()
+    self._totalJobs = totalJobs
+    self._startTime = time.time()
+    self._running = { } # Job to start time
+    self._jobTimes = [ ] # Sorted
+    self._timedOut = 0
+    self._notRun = 0
+    # Statistics of the jobs that did not time out
+    self._finishedCount = 0
+    self._finishedTimeSum = 0.0
+    self._slowestFinishedTime = 0.0
+    self._typeCounts = { rType.name: 0 for rType in FinalResultType }
+    self._typeCounts['ERROR'] = 0
+    self._stop = threading.Event()
+    self._thread = None
+
+  def addJobs(self, count):
+    with self._lock:
+      self._totalJobs += count
+
+  def jobStarted(self, job):
+    with self._lock:
+      self._running[job] = time.time()
+
+  def jobNotRun(self, job):
+    """
+      Record that ``job`` will never be started (e.g. because of a deadline).
+    """
+    with self._lock:
+      self._totalJobs -= 1
+      self._notRun += 1
+
+  def jobFinished(self, job, result):
+    """
+      Record that ``job`` finished with ``result`` (which may be an
+      error log).
+    """
+    with self._lock:
+      startTime = self._running.pop(job, None)
+      if result == None or 'error' in result:
+        self._typeCounts['ERROR'] += 1
+        return
+
+      try:
+        resultType = classifyResult(result)
+      except (AssertionError, KeyError):
+        _logger.warning('Could not classify result for "{}"'.format(result.get('program')))
+        resultType = FinalResultType.UNKNOWN
+      self._typeCounts[resultType.name] += 1
+
+      jobTime = result.get('total_time', None)
+      if jobTime == None and startTime != None:
+        jobTime = time.time() - startTime
+      if jobTime == None:
+        return
+      jobTime = float(jobTime)
+      self._insertJobTime(jobTime)
+      if resultType == FinalResultType.TIMED_OUT:
+        self._timedOut += 1
+      else:
+        self._finishedCount += 1
+        self._finishedTimeSum += jobTime
+        self._slowestFinishedTime = max(self._slowestFinishedTime, jobTime)
+
+  def _insertJobTime(self, jobTime):
+    # Keep the list sorted so percentiles are cheap to compute
+    low, high = 0, len(self._jobTimes)
+    while low < high:
+      mid = (low + high) // 2
+      if self._jobTimes[mid] < jobTime:
+        low = mid +1
+      else:
+        high = mid
+    self._jobTimes.insert(low, jobTime)
+
+  def _estimateRemaining(self, now, queued):
+    """
+      Estimate the number of seconds until every job has finished.
+
+      A queued job is assumed to take the mean time of the completed
+      jobs that did not time out unless it times out which it is assumed
+      to do with the same frequency as the completed jobs. A running job
+      that has already run for longer than the slowest completed job that
+      did not time out is assumed to be going to time out.
+    """
+    completed = len(self._jobTimes)
+    if completed == 0:
+      return None
+
+    if self._finishedCount == 0:
+      typicalTime = float(self.maxTime)
+      slowestTime = float(self.maxTime)
+    else:
+      typicalTime = self._finishedTimeSum / self._finishedCount
+      slowestTime = self._slowestFinishedTime
+    timeOutFraction = float(self._timedOut) / completed if self.maxTime > 0 else 0.0
+    expectedJobTime = (1.0 - timeOutFraction) * typicalTime + timeOutFraction * self.maxTime
+
+    # Time left for each of the running jobs
+    runningLeft = [ ]
+    for startTime in self._running.values():
+      elapsed = now - startTime
+      if self.maxTime > 0 and elapsed > slowestTime:
+        runningLeft.append(max(0.0, self.maxTime - elapsed))
+      else:
+        runningLeft.append(max(0.0, expectedJobTime - elapsed))
+
+    totalWork = sum(runningLeft) + queued * expectedJobTime
+    parallelism = max(1, min(self.maxJobs, queued + len(self._running)))
+    # We can't finish before the slowest running job (or a single queued job)
+    lowerBound = max(runningLeft + [ expectedJobTime if queued > 0 else 0.0 ])
+    return max(totalWork / parallelism, lowerBound)
+
+  def snapshot(self):
+    """
+      Returns the status as a dictionary.
+    """
+    with self._lock:
+      now = time.time()
+      elapsed = now - self._startTime
+      done = sum(self._typeCounts.values())
+      running = len(self._running)
+      queued = max(0, self._totalJobs - done - running)
+      status = {
+        'time': datetime.datetime.now().isoformat(' '),
+        'elapsed': elapsed,
+        'jobs': { 'total': self._totalJobs, 'done': done, 'running': running, 'queued': queued,
+                  'not_run': self._notRun },
+        'jobs_per_hour': (done * 3600.0 / elapsed) if elapsed > 0 else 0.0,
+        'result_types': dict(self._typeCounts),
+      }
+      if len(self._jobTimes) > 0:
+        status['job_time'] = {
+          'mean': sum(self._jobTimes) / len(self._jobTimes),
+          'median': percentile(self._jobTimes, 50),
+          'p90': percentile(self._jobTimes, 90),
+          'p99': percentile(self._jobTimes, 99),
+          'max': self._jobTimes[-1],
+        }
+      else:
+        status['job_time'] = None
+      remaining = self._estimateRemaining(now, queued)
+      status['eta_seconds'] = remaining
+      if remaining != None:
+        status['eta'] = (datetime.datetime.now() + datetime.timedelta(seconds=remaining)).isoformat(' ')
+      else:
+        status['eta'] = None
+      return status
+
+  def write(self):
+    status = self.snapshot()
+    tempPath = self.path + '.tmp'
+    with open(tempPath, 'w') as f:
+      json.dump(status, f, indent=2, sort_keys=True)
+      f.write('\n')
+    os.replace(tempPath, self.path)
+
+  def start(self):
+    """
+      Start writing the status file every ``interval`` seconds from a
+      background thread.
+    """
+    def writeLoop():
+      while not self._stop.wait(self.interval):
+        try:
+          self.write()
+        except Exception as e:
+          _logger.warning('Failed to write status file "{}": {}'.format(self.path, e))
+
+    self.write()
+    self._thread = threading.Thread(target=writeLoop, name='status_writer', daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    """
+      Stop the background thread and write the final status.
+    """
+    if self._thread != None:
+      self._stop.set()
+      self._thread.join()
+      self._thread = None
+    self.write()
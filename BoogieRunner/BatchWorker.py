@@ -0,0 +1,421 @@
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Code that runs a single job for ``boogie-batch-runner.py``.
+
+  Runners are created just in time by the worker (thread or process)
+  that is going to run them. This means that the working directory,
+  runner and backend for a program only exist whilst that program is
+  being run and that setting up runners happens in parallel.
+
+  When ``--executor=process`` is used this code runs inside worker
+  processes. Runners (and their backends) are not picklable so only
+  the result dictionary is sent back to the parent process.
+
+  When ``--executor=async`` is used jobs are coroutines on the event loop
+  of the ``AsyncIO`` backend (see ``AsyncJobExecutor``).
+"""
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import os
+import shutil
+import signal
+import threading
+import time
+import traceback
+from . import RunnerFactory
+from .BrUtil import FinalResultType, classifyResult
+
+_logger = logging.getLogger(__name__)
+
+# State private to each process
+_cancelled = threading.Event()
+_activeRunners = set()
+_activeRunnersLock = threading.Lock()
+_runnerClasses = {}
+_runnerClassesLock = threading.Lock()
+
+def initWorker(cancelEvent, logLevel, logFormat):
+  """
+    Initialiser for each worker process.
+
+    cancelEvent: A ``multiprocessing.Event`` that the parent process sets
+                 when the batch is cancelled.
+  """
+  # This is a no-op if logging was inherited via fork()
+  logging.basicConfig(level=logLevel, format=logFormat)
+
+  # The parent process handles interrupts and tells us about them via
+  # ``cancelEvent``. Note we install a handler rather than using SIG_IGN
+  # because ignored signals are inherited by the tools we run.
+  signal.signal(signal.SIGINT, _handleInterrupt)
+  signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+  def watchForCancel():
+    cancelEvent.wait()
+    cancel()
+
+  watcher = threading.Thread(target=watchForCancel, name='cancel_watcher', daemon=True)
+  watcher.start()
+
+def _handleInterrupt(signum, frame):
+  _logger.debug('Worker ignoring signal {}'.format(signum))
+
+def cancel():
+  """
+    Prevent any more jobs from starting in this process and
+    kill the runners of jobs that are currently running.
+  """
+  _cancelled.set()
+  _logger.warning('Killing runners')
+  with _activeRunnersLock:
+    runners = list(_activeRunners)
+  for runner in runners:
+    runner.kill()
+
+class _Watchdog:
+  """
+    A single thread per process that kills the runners of jobs that must
+    be abandoned (see ``runJob()``). Once a job is abandoned its runner is
+    killed every time it is checked until it finishes because the runner
+    might not have started its tool when it was first killed.
+  """
+  def __init__(self):
+    self._condition = threading.Condition()
+    self._watched = { } # Runner to [ abandoned, pollTimePeriod, nextCheckTime, isAbandoned ]
+    self._thread = None
+
+  def watch(self, runner, abandoned, pollTimePeriod):
+    with self._condition:
+      self._watched[runner] = [ abandoned, pollTimePeriod, time.monotonic() + pollTimePeriod, False ]
+      if self._thread == None:
+        self._thread = threading.Thread(target=self._run, name='abandon_watchdog', daemon=True)
+        self._thread.start()
+      self._condition.notify_all()
+
+  def unwatch(self, runner):
+    """
+      Stop watching ``runner``. Returns True if its job was abandoned.
+    """
+    with self._condition:
+      entry = self._watched.pop(runner, None)
+      self._condition.notify_all()
+      return entry != None and entry[3]
+
+  def _run(self):
+    while True:
+      with self._condition:
+        if len(self._watched) == 0:
+          self._thread = None
+          return
+        now = time.monotonic()
+        due = [ (runner, entry) for runner, entry in self._watched.items() if entry[2] <= now ]
+        if len(due) == 0:
+          self._condition.wait(min([ entry[2] for entry in self._watched.values() ]) - now)
+          continue
+        for _, entry in due:
+          entry[2] = now + entry[1]
+      for runner, entry in due:
+        if not entry[3]:
+          try:
+            entry[3] = entry[0]()
+          except Exception as e:
+            _logger.warning('Failed to check if "{}" should be abandoned: {}'.format(runner.program, e))
+          if entry[3]:
+            _logger.warning('Abandoning "{}"'.format(runner.program))
+        if entry[3]:
+          runner.kill()
+
+_watchdog = None
+_watchdogPid = None
+_watchdogLock = threading.Lock()
+
+def _getWatchdog():
+  global _watchdog, _watchdogPid
+  with _watchdogLock:
+    # A forked worker process does not inherit the watchdog's thread
+    if _watchdog == None or _watchdogPid != os.getpid():
+      _watchdog = _Watchdog()
+      _watchdogPid = os.getpid()
+    return _watchdog
+
+def _getRunnerClass(runnerName):
+  # RunnerFactory searches the Runners package every time so cache the result
+  with _runnerClassesLock:
+    if not runnerName in _runnerClasses:
+      _runnerClasses[runnerName] = RunnerFactory.getRunnerClass(runnerName)
+    return _runnerClasses[runnerName]
+
+def _errorLog(program):
+  errorLog = {}
+  errorLog['program'] = program
+  errorLog['error'] = traceback.format_exc()
+  return errorLog
+
+def setupRunner(runnerName, program, workDir, rc, clean=False):
+  """
+    Create the working directory ``workDir`` and a runner for ``program``
+    that will use it.
+
+    clean: If True and ``workDir`` already exists it is removed first.
+  """
+  if clean and os.path.exists(workDir):
+    _logger.info('Removing incomplete working directory "{}"'.format(workDir))
+    shutil.rmtree(workDir)
+  os.mkdir(workDir)
+  RunnerClass = _getRunnerClass(runnerName)
+  return RunnerClass(program, workDir, rc)
+
+def runJob(runnerName, program, workDir, rc, clean=False, dry=False, cpus=None, tags=None,
+           abandoned=None, abandonPollTimePeriod=1.0):
+  """
+    Set up and run a runner for ``program`` inside ``workDir``.
+
+    Returns the runner's result dictionary. If the runner could not
+    be set up or run an error log dictionary (with ``program`` and
+    ``error`` keys) is returned instead. Exceptions are not propagated
+    because they may not survive being pickled. The exception to this
+    is ``concurrent.futures.CancelledError`` which is raised if the
+    batch was cancelled before the job could run.
+
+    dry: If True the runner is set up but not run. None is returned
+         if set up succeeded.
+    cpus: If not None the set of CPU ids the tool is pinned to.
+    tags: If not None a dictionary of extra entries to add to the result.
+    abandoned: If not None a function (that can be pickled) which is called
+               every ``abandonPollTimePeriod`` seconds whilst the job runs.
+               Once it returns True the runner is killed and an error log
+               is returned.
+  """
+  if _cancelled.is_set():
+    raise concurrent.futures.CancelledError()
+
+  if abandoned != None and abandoned():
+    return { 'program': program, 'error': 'Job was abandoned before it started' }
+
+  try:
+    runner = setupRunner(runnerName, program, workDir, rc, clean)
+    runner.cpuAffinity = cpus
+  except Exception as e:
+    _logger.error('Failed to set up runner for "{}": {}'.format(program, e))
+    return _errorLog(program)
+
+  if dry:
+    return None
+
+  with _activeRunnersLock:
+    _activeRunners.add(runner)
+  if abandoned != None:
+    _getWatchdog().watch(runner, abandoned, abandonPollTimePeriod)
+  try:
+    # We might of been cancelled whilst the runner was being created
+    if _cancelled.is_set():
+      raise concurrent.futures.CancelledError()
+    try:
+      runner.run()
+      result = runner.getResults()
+    except Exception:
+      result = _errorLog(program)
+    if abandoned != None and _getWatchdog().unwatch(runner):
+      return { 'program': program, 'error': 'Job was abandoned' }
+    if tags != None:
+      result.update(tags)
+    return result
+  finally:
+    if abandoned != None:
+      _getWatchdog().unwatch(runner)
+    with _activeRunnersLock:
+      _activeRunners.discard(runner)
+
+def _isDefinitive(result):
+  if 'error' in result:
+    return False
+  try:
+    return classifyResult(result) in { FinalResultType.BUG_FOUND, FinalResultType.FULLY_EXPLORED }
+  except (AssertionError, KeyError):
+    return False
+
+def runPortfolio(members, program, clean=False, dry=False, killPollTimePeriod=0.5):
+  """
+    Race several runners on ``program``. As soon as one of them reports
+    a definitive result (``BUG_FOUND`` or ``FULLY_EXPLORED``) the others
+    are killed.
+
+    members: A list of ``(name, runnerName, workDir, rc)`` tuples, one for
+             each runner in the portfolio.
+
+    Returns a copy of the winner's result (or if there is no winner the
+    result of the first member that did not fail) with the extra keys
+
+    * ``portfolio_winner`` - The name of the winning member or None.
+    * ``portfolio_time`` - Seconds from starting the members until the
+      winner answered or None.
+    * ``portfolio_results`` - Maps each member's name to its result. The
+      results of members that were killed have ``portfolio_cancelled``
+      set to True.
+
+    Otherwise behaves like ``runJob()``.
+  """
+  if _cancelled.is_set():
+    raise concurrent.futures.CancelledError()
+
+  runners = collections.OrderedDict()
+  results = { }
+  for name, runnerName, workDir, rc in members:
+    try:
+      runners[name] = setupRunner(runnerName, program, workDir, rc, clean)
+    except Exception as e:
+      _logger.error('Failed to set up runner "{}" for "{}": {}'.format(name, program, e))
+      results[name] = _errorLog(program)
+
+  if dry:
+    if len(results) == 0:
+      return None
+    return { 'program': program, 'error': '\n'.join([ results[name]['error'] for name in sorted(results.keys()) ]) }
+
+  lock = threading.Lock()
+  decided = threading.Event()
+  winner = None
+  answerTime = None
+  killed = set()
+  startTime = time.perf_counter()
+
+  def race(name, runner):
+    nonlocal winner, answerTime
+    if decided.is_set():
+      result = { 'program': program, 'error': 'Not run because another runner answered first' }
+    else:
+      try:
+        runner.run()
+        result = runner.getResults()
+      except Exception:
+        result = _errorLog(program)
+    with lock:
+      results[name] = result
+      if winner == None and _isDefinitive(result):
+        winner = name
+        answerTime = time.perf_counter() - startTime
+        _logger.info('"{}" answered first for "{}" after {:.2f} seconds'.format(name, program, answerTime))
+        decided.set()
+
+  with _activeRunnersLock:
+    _activeRunners.update(runners.values())
+  try:
+    if _cancelled.is_set():
+      raise concurrent.futures.CancelledError()
+    threads = { }
+    for name, runner in runners.items():
+      threads[name] = threading.Thread(target=race, args=(name, runner), name='portfolio_{}'.format(name))
+      threads[name].start()
+
+    # Keep killing the losers until they finish because a loser might not
+    # have started its tool when it was first killed.
+    while True:
+      alive = [ name for name, thread in threads.items() if thread.is_alive() ]
+      if len(alive) == 0:
+        break
+      if decided.wait(killPollTimePeriod):
+        for name in alive:
+          if name != winner:
+            _logger.debug('Killing "{}" for "{}"'.format(name, program))
+            killed.add(name)
+            runners[name].kill()
+        threads[alive[0]].join(killPollTimePeriod)
+  finally:
+    with _activeRunnersLock:
+      _activeRunners.difference_update(runners.values())
+
+  for name, result in results.items():
+    result['portfolio_cancelled'] = name in killed
+
+  orderedNames = [ m[0] for m in members ]
+  if winner != None:
+    combined = results[winner].copy()
+  else:
+    successful = [ name for name in orderedNames if not 'error' in results[name] ]
+    if len(successful) > 0:
+      combined = results[successful[0]].copy()
+    else:
+      combined = { 'program': program, 'error': 'Every runner in the portfolio failed' }
+  combined.pop('portfolio_cancelled', None)
+  combined['portfolio_winner'] = winner
+  combined['portfolio_time'] = answerTime
+  combined['portfolio_results'] = { name: results[name] for name in orderedNames }
+  return combined
+
+async def runJobAsync(helpers, runnerName, program, workDir, rc, clean=False, dry=False, cpus=None, tags=None):
+  """
+    Coroutine version of ``runJob()`` that must run on the event loop of
+    the ``AsyncIO`` backend's supervisor and the runner must use that
+    backend. Setting up the runner and analysing its results are done on
+    the ``helpers`` thread pool but no thread is used whilst waiting for
+    the tool.
+  """
+  if _cancelled.is_set():
+    raise asyncio.CancelledError()
+
+  loop = asyncio.get_event_loop()
+  def setup():
+    runner = setupRunner(runnerName, program, workDir, rc, clean)
+    runner.cpuAffinity = cpus
+    return runner
+
+  try:
+    runner = await loop.run_in_executor(helpers, setup)
+  except Exception as e:
+    _logger.error('Failed to set up runner for "{}": {}'.format(program, e))
+    return _errorLog(program)
+
+  if dry:
+    return None
+
+  with _activeRunnersLock:
+    _activeRunners.add(runner)
+  try:
+    # We might of been cancelled whilst the runner was being created
+    if _cancelled.is_set():
+      raise asyncio.CancelledError()
+    try:
+      cmdLine, env = await loop.run_in_executor(helpers, runner.buildToolRun)
+      backendResult = await runner.backend.runAsync(cmdLine, runner.logFile, env)
+      runner.recordToolRun(backendResult)
+      result = await loop.run_in_executor(helpers, runner.getResults)
+    except Exception:
+      result = _errorLog(program)
+    if tags != None:
+      result.update(tags)
+    return result
+  finally:
+    with _activeRunnersLock:
+      _activeRunners.discard(runner)
+
+class AsyncJobExecutor:
+  """
+    Runs ``runJob()`` jobs as ``runJobAsync()`` coroutines on the event
+    loop of the ``AsyncIO`` backend's supervisor. Anything else submitted
+    runs on the pool of helper threads. Helper threads are only created
+    when needed so few exist in practice.
+
+    Can be used as a context manager like the executors in
+    ``concurrent.futures``.
+  """
+  def __init__(self, maxHelperThreads):
+    from .Backends import AsyncIO
+    self._supervisor = AsyncIO.getSupervisor()
+    self._helpers = concurrent.futures.ThreadPoolExecutor(max_workers=maxHelperThreads)
+
+  def submit(self, fn, *args, **kwargs):
+    if fn is runJob:
+      return self._supervisor.submit(runJobAsync(self._helpers, *args, **kwargs))
+    return self._helpers.submit(fn, *args, **kwargs)
+
+  def shutdown(self, wait=True):
+    self._helpers.shutdown(wait)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, excType, excValue, tb):
+    self.shutdown(wait=True)
+    return False
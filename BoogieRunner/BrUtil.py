@@ -0,0 +1,13 @@
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Gives the package access to the result classification and combining
+  code in ``analysis/br_util.py`` so that the runners and the analysis
+  scripts agree on what a result means.
+"""
+import os
+import sys
+
+# Hack: br_util lives in the analysis directory which is not a package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'analysis'))
+from br_util import FinalResultType, classifyResult, combineResults, _computeTimes, \
+  CombineResultsException, ComputeTimesException
@@ -5,6 +5,13 @@ import pprint
 import traceback
 import yaml
 
+try:
+  # Try to use libyaml which is faster
+  from yaml import CLoader as Loader
+except ImportError:
+  # fall back on python implementation
+  from yaml import Loader
+
 class ConfigLoaderException(Exception):
   def __init__(self, msg):
     self.msg = msg
@@ -20,7 +27,7 @@ def load(configFileName):
   config = None
   with open(configFileName, 'r') as f:
     try:
-      config = yaml.load(f)
+      config = yaml.load(f, Loader=Loader)
     except Exception as e:
       raise ConfigLoaderException('Caught exception whilst loading config:\n' +
                                   traceback.format_exc())
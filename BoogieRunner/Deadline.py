@@ -0,0 +1,199 @@
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Support for running a batch against a deadline. Rather than running
+  the jobs in order, the job expected to give the most answers
+  (``BUG_FOUND`` or ``FULLY_EXPLORED``) per second of run time is
+  started next. The ``max_time`` of a job is shrunk so that it finishes
+  by the deadline. Once there is too little time left to be worth
+  starting a job no more jobs are started.
+
+  The chance that a program gives an answer within a time limit and the
+  time it takes are estimated from the results of previous runs (see
+  ``History``). Programs without history are estimated from the pooled
+  history of every program.
+"""
+import bisect
+import datetime
+import logging
+import re
+import time
+from . import BatchScheduler
+from .BrUtil import FinalResultType, classifyResult
+
+_logger = logging.getLogger(__name__)
+
+class DeadlineException(Exception):
+  def __init__(self, msg):
+    self.msg = msg
+
+_durationUnits = { 's': 1, 'm': 60, 'h': 3600, 'd': 86400 }
+
+def parse(deadlineString, now=None):
+  """
+    Parse a deadline given either as a duration from ``now`` (seconds
+    or a number with a unit ``s``, ``m``, ``h`` or ``d``, e.g. ``90m``)
+    or as an ISO 8601 local date and time (e.g. ``2016-04-05T09:00``).
+
+    Returns the deadline as a time comparable with ``time.time()``.
+  """
+  if now == None:
+    now = time.time()
+  match = re.fullmatch(r'\s*([0-9]+(?:\.[0-9]*)?)\s*([smhd]?)\s*', deadlineString)
+  if match:
+    return now + float(match.group(1)) * _durationUnits.get(match.group(2) or 's')
+  try:
+    return datetime.datetime.fromisoformat(deadlineString.strip()).timestamp()
+  except ValueError:
+    raise DeadlineException('"{}" is not a valid deadline. Expected a duration (e.g. "3600", "90m", "2h") '
+      'or a date and time (e.g. "2016-04-05T09:00")'.format(deadlineString))
+
+def isAnswer(result):
+  try:
+    return classifyResult(result) in (FinalResultType.BUG_FOUND, FinalResultType.FULLY_EXPLORED)
+  except (AssertionError, KeyError):
+    return False
+
+class _Profile:
+  """
+    The answers a program gave in its previous runs.
+  """
+  def __init__(self, results):
+    self.count = len(results)
+    # Sorted times of the runs that gave an answer and their prefix sums
+    self.answerTimes = sorted([ float(r['total_time']) for r in results if isAnswer(r) ])
+    self.answerTimeSums = [ 0.0 ]
+    for t in self.answerTimes:
+      self.answerTimeSums.append(self.answerTimeSums[-1] + t)
+
+  def estimate(self, timeLimit):
+    """
+      Returns ``(probability, expectedTime)`` of giving an answer with
+      ``timeLimit``, where ``expectedTime`` is the time a run is expected
+      to take given that it is killed at ``timeLimit``.
+    """
+    answered = bisect.bisect_right(self.answerTimes, timeLimit)
+    probability = answered / self.count
+    expectedTime = (self.answerTimeSums[answered] + timeLimit * (self.count - answered)) / self.count
+    return (probability, expectedTime)
+
+class ValueModel:
+  """
+    Estimates the answers per second of running a program with a given
+    time limit from ``programToResults`` (see ``History.load()``).
+  """
+  def __init__(self, programToResults):
+    self._profiles = { }
+    pooled = [ ]
+    for program, results in programToResults.items():
+      results = [ r for r in results if isinstance(r.get('total_time', None), (int, float)) ]
+      if len(results) == 0:
+        continue
+      self._profiles[program] = _Profile(results)
+      pooled.extend(results)
+    self._pooled = _Profile(pooled) if len(pooled) > 0 else None
+    _logger.info('Estimating the value of jobs from the history of {} programs'.format(len(self._profiles)))
+
+  def hasHistory(self, program):
+    return program in self._profiles
+
+  def estimate(self, program, timeLimit):
+    """
+      Returns ``(probability, expectedTime)`` of ``program`` giving an
+      answer when run with ``timeLimit``.
+    """
+    profile = self._profiles.get(program, self._pooled)
+    if profile == None:
+      # No history at all. Every job is worth the same.
+      return (1.0, timeLimit)
+    return profile.estimate(timeLimit)
+
+  def density(self, program, timeLimit):
+    """
+      Returns the expected number of answers per second of running
+      ``program`` with ``timeLimit``.
+    """
+    probability, expectedTime = self.estimate(program, timeLimit)
+    return probability / max(expectedTime, 1e-3)
+
+class DeadlinePolicy(BatchScheduler.AdmissionPolicy):
+  """
+    Picks the job to start next (see ``BatchScheduler.setPicker()``) and
+    shrinks the ``max_time`` of each job so it finishes by the deadline.
+    The limit a job was given is recorded in its tags as
+    ``deadline_max_time`` when it was shrunk.
+  """
+  def __init__(self, deadline, model, minTime):
+    """
+      deadline: The deadline as a time comparable with ``time.time()``.
+      model: The ``ValueModel`` used to rank the jobs.
+      minTime: A job is only started if it can be given at least this
+               many seconds (or its full ``max_time`` if that is less).
+               A job that can't be given its full ``max_time`` is also
+               not started if it never answered in that time before.
+    """
+    assert minTime >= 0
+    self.deadline = deadline
+    self.model = model
+    self.minTime = minTime
+    self._ranked = [ ]
+    self._rankKey = None
+    self._longest = 0
+
+  def remainingTime(self):
+    return self.deadline - time.time()
+
+  def timeLimit(self, job, remaining):
+    if job.maxTime > 0:
+      return min(job.maxTime, remaining)
+    return remaining
+
+  def _startable(self, job, remaining):
+    if job.maxTime > 0 and job.maxTime <= remaining:
+      return True
+    if remaining < self.minTime or remaining <= 0:
+      return False
+    # Don't start a job whose own history says it can't answer in the
+    # time it would get.
+    if self.model.hasHistory(job.program):
+      probability, _ = self.model.estimate(job.program, self.timeLimit(job, remaining))
+      return probability > 0
+    return True
+
+  def _rankKeyFor(self, remaining):
+    # The ranking only depends on the remaining time once that is less
+    # than a job's max_time. Rerank at most once a second after that.
+    return int(remaining) if self._longest > remaining else None
+
+  def _rank(self, pendingJobs, remaining):
+    order = { job: index for index, job in enumerate(pendingJobs) }
+    # Ties keep the order the jobs were added in
+    self._ranked = sorted(pendingJobs, key=lambda job: (
+      -self.model.density(job.program, self.timeLimit(job, remaining)), order[job]))
+    self._longest = max([ job.maxTime if job.maxTime > 0 else float('inf') for job in pendingJobs ] + [ 0 ])
+    self._rankKey = self._rankKeyFor(remaining)
+
+  def pick(self, pendingJobs):
+    """
+      Returns the pending job with the highest value density that can
+      still be started or None if no job is worth starting.
+    """
+    remaining = self.remainingTime()
+    if remaining <= 0:
+      return None
+    if len(self._ranked) != len(pendingJobs) or self._rankKeyFor(remaining) != self._rankKey:
+      self._rank(pendingJobs, remaining)
+    for job in self._ranked:
+      if self._startable(job, remaining):
+        return job
+    return None
+
+  def started(self, job):
+    self._ranked.remove(job)
+    remaining = self.remainingTime()
+    limit = self.timeLimit(job, remaining)
+    if job.maxTime == 0 or limit < job.maxTime:
+      # Keep integer limits as integers so they look the same as in config files
+      limit = max(1, int(limit))
+      job.rc = job.rc.copy()
+      job.rc['max_time'] = limit
+      job.tags['deadline_max_time'] = limit
@@ -0,0 +1,103 @@
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Predict how long running a program will take from the results of
+  previous runs.
+"""
+import logging
+import os
+import statistics
+import yaml
+from . import ResultSink
+from .BrUtil import FinalResultType, classifyResult
+
+_logger = logging.getLogger(__name__)
+
+class HistoryException(Exception):
+  def __init__(self, msg):
+    self.msg = msg
+
+def load(paths):
+  """
+    Load previous results from the report files in ``paths``.
+
+    Returns a dictionary mapping each program to a list of its
+    results. Error reports are ignored. Files that can't be read and
+    results that can't be classified are skipped with a warning.
+  """
+  programToResults = { }
+  for path in paths:
+    if not os.path.exists(path):
+      raise HistoryException('History file "{}" does not exist'.format(path))
+    _logger.info('Loading history from "{}"'.format(path))
+    try:
+      results = ResultSink.loadReport(path)
+    except ResultSink.ResultSinkException as e:
+      _logger.warning('Ignoring history file: {}'.format(e.msg))
+      continue
+    except (OSError, yaml.YAMLError) as e:
+      _logger.warning('Ignoring unreadable history file "{}": {}'.format(path, e))
+      continue
+    skipped = 0
+    for r in results:
+      if not isinstance(r, dict) or not 'program' in r:
+        skipped += 1
+        continue
+      if 'error' in r:
+        continue
+      try:
+        classifyResult(r)
+        float(r['total_time'])
+      except (AssertionError, KeyError, TypeError, ValueError):
+        skipped += 1
+        continue
+      programToResults.setdefault(r['program'], []).append(r)
+    if skipped > 0:
+      _logger.warning('Ignoring {} malformed result(s) in history file "{}"'.format(skipped, path))
+  return programToResults
+
+def estimateTime(results, maxTime):
+  """
+    Estimate the time in seconds a program will take to run given a
+    list of its previous ``results``.
+
+    maxTime: The time limit (in seconds) the program will be run with.
+             Zero implies no limit.
+
+    Results that timed out are assumed to time out again and so take
+    ``maxTime``. Every estimate is clamped to ``maxTime``. The
+    estimate is the arithmetic mean over all the results.
+  """
+  assert len(results) > 0
+  times = []
+  for r in results:
+    totalTime = float(r['total_time'])
+    if classifyResult(r) == FinalResultType.TIMED_OUT and maxTime > 0:
+      totalTime = float(maxTime)
+    elif maxTime > 0:
+      totalTime = min(totalTime, float(maxTime))
+    times.append(totalTime)
+  return statistics.mean(times)
+
+def estimateTimes(programs, programToResults, maxTime, defaultEstimate=None):
+  """
+    Returns a dictionary mapping each program in ``programs`` to its
+    estimated run time.
+
+    defaultEstimate: The estimate to use for programs that have no
+                     history. If None the median of the estimates for
+                     programs with history is used.
+  """
+  estimates = { }
+  for program in programs:
+    if program in programToResults:
+      estimates[program] = estimateTime(programToResults[program], maxTime)
+
+  _logger.info('Found history for {} out of {} programs'.format(len(estimates), len(programs)))
+  if defaultEstimate == None:
+    defaultEstimate = statistics.median(estimates.values()) if len(estimates) > 0 else 0.0
+    _logger.info('Using {:.2f} seconds as the estimate for programs without history'.format(defaultEstimate))
+
+  for program in programs:
+    if not program in estimates:
+      estimates[program] = defaultEstimate
+  return estimates
@@ -0,0 +1,69 @@
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Support for running a batch with a timeout escalation ladder. Every
+  program is first run with the shortest time limit (the first rung).
+  Only programs that time out are run again with the next time limit.
+"""
+import collections
+import logging
+import os
+from . import ResultSink
+from .BrUtil import FinalResultType, classifyResult
+
+_logger = logging.getLogger(__name__)
+
+class LadderException(Exception):
+  def __init__(self, msg):
+    self.msg = msg
+
+def parse(ladderString):
+  """
+    Parse a comma separated list of time limits in seconds
+    (e.g. ``10,60,900``) into a list of rungs.
+  """
+  try:
+    rungs = [ float(x) for x in ladderString.split(',') ]
+  except ValueError:
+    raise LadderException('"{}" is not a valid ladder. Expected a comma separated list of times'.format(ladderString))
+  # Keep integer limits as integers so they look the same as in config files
+  rungs = [ int(r) if r.is_integer() else r for r in rungs ]
+  if any([ r <= 0 for r in rungs ]):
+    raise LadderException('Ladder time limits must be > 0')
+  if any([ rungs[i] >= rungs[i +1] for i in range(0, len(rungs) -1) ]):
+    raise LadderException('Ladder time limits must be strictly increasing')
+  return rungs
+
+def rungOutputPath(path, rung):
+  """
+    Returns the path of the output of rung ``rung``.
+    E.g. ``out.yml`` becomes ``out-rung0.yml``.
+  """
+  root, ext = os.path.splitext(path)
+  return '{}-rung{}{}'.format(root, rung, ext)
+
+def timedOut(result):
+  """
+    Returns True if ``result`` should be run again on the next rung.
+  """
+  if result == None or 'error' in result:
+    return False
+  try:
+    return classifyResult(result) == FinalResultType.TIMED_OUT
+  except (AssertionError, KeyError):
+    _logger.warning('Could not classify result for "{}"'.format(result.get('program')))
+    return False
+
+def combineReports(reportPaths):
+  """
+    Combine the reports of each rung (in rung order) by taking the
+    result of the last rung each program was run on.
+
+    Returns the list of results in the order the programs first
+    appear in the reports.
+  """
+  programToResult = collections.OrderedDict()
+  for path in reportPaths:
+    _logger.info('Loading rung from "{}"'.format(path))
+    for r in ResultSink.loadReport(path):
+      programToResult[r['program']] = r
+  return list(programToResult.values())
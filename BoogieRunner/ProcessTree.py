@@ -0,0 +1,136 @@
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Find and signal the processes of a tool without scanning every
+  process on the host.
+
+  The backends start each tool in its own session, so the tool and
+  everything it forks share a process group whose id is the PID of
+  the tool. That id can be given to an unrelated process once the tool
+  has been reaped and the rest of its group has exited, so the group is
+  only signalled through a ``ProcessGroup`` which stops signalling it
+  once the tool has been reaped. The descendants of a process are found by following
+  ``/proc/<pid>/task/<tid>/children``, which only costs as much as the
+  number of processes (and threads) in the tree. If the kernel doesn't
+  provide these files psutil is used instead, which reads the parent of
+  every process on the host.
+"""
+import logging
+import os
+import psutil
+import signal
+import threading
+
+_logger = logging.getLogger(__name__)
+
+_childrenFilesAvailable = os.path.exists('/proc/{pid}/task/{pid}/children'.format(pid=os.getpid()))
+if not _childrenFilesAvailable:
+  _logger.debug('/proc/<pid>/task/<tid>/children not available. Falling back to psutil')
+
+def _childPids(pid):
+  children = [ ]
+  try:
+    threadIds = os.listdir('/proc/{}/task'.format(pid))
+  except FileNotFoundError:
+    return children
+  for tid in threadIds:
+    try:
+      with open('/proc/{}/task/{}/children'.format(pid, tid), 'r') as f:
+        children.extend([ int(child) for child in f.read().split() ])
+    except (FileNotFoundError, ProcessLookupError):
+      # The thread (or process) exited
+      pass
+  return children
+
+def childPids(pid):
+  """
+    Returns the PIDs of the children of ``pid``.
+  """
+  if not _childrenFilesAvailable:
+    try:
+      return [ p.pid for p in psutil.Process(pid).children() ]
+    except psutil.NoSuchProcess:
+      return [ ]
+  return _childPids(pid)
+
+def descendantPids(pid):
+  """
+    Returns the PIDs of the descendants of ``pid``.
+  """
+  if not _childrenFilesAvailable:
+    try:
+      return [ p.pid for p in psutil.Process(pid).children(recursive=True) ]
+    except psutil.NoSuchProcess:
+      return [ ]
+  pids = [ ]
+  seen = set()
+  toVisit = _childPids(pid)
+  while len(toVisit) > 0:
+    child = toVisit.pop()
+    if child in seen:
+      continue
+    seen.add(child)
+    pids.append(child)
+    toVisit.extend(_childPids(child))
+  return pids
+
+def descendants(process):
+  """
+    Returns the descendants of the ``psutil.Process`` ``process`` as
+    ``psutil.Process`` objects.
+  """
+  processes = [ ]
+  for pid in descendantPids(process.pid):
+    try:
+      processes.append(psutil.Process(pid))
+    except psutil.NoSuchProcess:
+      pass
+  return processes
+
+def signalProcessGroup(pgid, signalNumber):
+  """
+    Send ``signalNumber`` to every process in the process group ``pgid``.
+    This reaches descendants of a tool that have been orphaned and so
+    can't be found by following the children of the tool.
+  """
+  try:
+    os.killpg(pgid, signalNumber)
+  except (ProcessLookupError, PermissionError):
+    # The group is empty
+    pass
+
+class ProcessGroup:
+  """
+    The process group of a tool, which is led by the tool. The group id
+    can't be reused while the tool exists, even as a zombie, so the group
+    is signalled until ``reap()`` is called and never after that.
+    Safe to use from any thread.
+  """
+  def __init__(self, pgid):
+    self.pgid = pgid
+    self._lock = threading.Lock()
+    self._reaped = False
+
+  @property
+  def reaped(self):
+    return self._reaped
+
+  def signal(self, signalNumber):
+    """
+      Send ``signalNumber`` to the group unless the tool has been reaped.
+    """
+    with self._lock:
+      if not self._reaped:
+        signalProcessGroup(self.pgid, signalNumber)
+
+  def reap(self, reapLeader):
+    """
+      Kill what is left of the group and then call ``reapLeader()`` to
+      reap the tool, which must have exited. Returns what ``reapLeader()``
+      returns.
+    """
+    with self._lock:
+      assert not self._reaped
+      # Descendants that outlived the tool are still in its process group
+      signalProcessGroup(self.pgid, signal.SIGKILL)
+      self._reaped = True
+      return reapLeader()
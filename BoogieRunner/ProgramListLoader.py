@@ -1,4 +1,6 @@
 # vim: set sw=2 ts=2 softtabstop=2 expandtab:
+import collections
+import hashlib
 import logging
 import os
 
@@ -65,3 +67,28 @@ def load(programListFileName, relativePathPrefix, existCheck=True):
   l.sort()
   return l
 
+def groupByContents(programs):
+  """
+    Group the programs in ``programs`` that have identical contents.
+
+    Returns an ordered dictionary mapping the first program (in the order
+    of ``programs``) with each distinct contents to the list of the other
+    programs with the same contents.
+  """
+  hashToProgram = { }
+  groups = collections.OrderedDict()
+  for program in programs:
+    h = hashlib.sha256()
+    try:
+      with open(program, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+          h.update(block)
+    except OSError as e:
+      raise ProgramListLoaderException('Failed to read "{}": {}'.format(program, e))
+    digest = h.digest()
+    if digest in hashToProgram:
+      groups[hashToProgram[digest]].append(program)
+    else:
+      hashToProgram[digest] = program
+      groups[program] = [ ]
+  return groups
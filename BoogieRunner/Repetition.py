@@ -0,0 +1,168 @@
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Support for running each program several times and combining the
+  results of the repetitions in the same way as
+  ``analysis/merge_results.py``.
+"""
+import collections
+import logging
+import math
+import os
+import traceback
+from . import ResultSink
+from .BrUtil import FinalResultType, combineResults, _computeTimes, CombineResultsException, ComputeTimesException
+
+_logger = logging.getLogger(__name__)
+
+def repetitionOutputPath(path, repetition):
+  """
+    Returns the path of the output of repetition ``repetition``.
+    E.g. ``out.yml`` becomes ``out-rep0.yml``.
+  """
+  root, ext = os.path.splitext(path)
+  return '{}-rep{}{}'.format(root, repetition, ext)
+
+def interleave(jobs, keyOf, repetitionOf, repeat, minimumGap):
+  """
+    Returns ``jobs`` reordered so the repetitions of a job are spread
+    over the run rather than next to each other.
+
+    keyOf: Returns what the repetitions of a job have in common (e.g. its
+           config and program).
+    repetitionOf: Returns the repetition of a job.
+    minimumGap: The fewest jobs to put between two repetitions of a job
+                if there are enough jobs. E.g. the number of jobs run at
+                once so the repetitions don't run at the same time.
+
+    Jobs keep their order (e.g. longest expected first) within each
+    repetition. Repetition ``r`` of the job in slot ``i`` is moved to
+    position ``i + r * gap``, where the gap is the larger of
+    ``minimumGap`` and the number of slots divided by ``repeat``.
+    Each repetition then starts at a different point of the run but
+    they overlap, so drift in the performance of the host affects
+    every repetition in a similar way.
+  """
+  slots = { }
+  for job in jobs:
+    slots.setdefault(keyOf(job), len(slots))
+  gap = max(minimumGap, int(math.ceil(len(slots) / repeat)), 1)
+  return sorted(jobs, key=lambda job: slots[keyOf(job)] + repetitionOf(job) * gap)
+
+def combineProgramResults(program, results, maxTime):
+  """
+    Combine the results of the repetitions of ``program``.
+
+    results: A dictionary mapping the name of each repetition to its result.
+    maxTime: The time limit (in seconds) the program was run with.
+
+    Returns the combined result (see ``br_util.combineResults()``). If the
+    results cannot be combined an error log dictionary (with ``program``
+    and ``error`` keys) is returned instead.
+  """
+  failed = sorted([ name for name, r in results.items() if 'error' in r ])
+  if len(failed) > 0:
+    return { 'program': program,
+             'error': 'Cannot combine results because these repetitions failed:\n{}'.format('\n'.join(failed)) }
+  if len(results) < 2:
+    return { 'program': program, 'error': 'Cannot combine less than two results' }
+  try:
+    return combineResults(results, float(maxTime))
+  except (CombineResultsException, ComputeTimesException) as e:
+    return { 'program': program, 'error': traceback.format_exc() }
+
+def combineReports(reportPaths, maxTime):
+  """
+    Combine the reports at ``reportPaths`` which are each a repetition
+    of the same batch. A program does not need to have a result in every
+    report.
+
+    Returns the list of combined results in the order the programs
+    first appear in the reports.
+  """
+  programToResults = collections.OrderedDict()
+  for path in reportPaths:
+    _logger.info('Loading repetition from "{}"'.format(path))
+    for r in ResultSink.loadReport(path):
+      programToResults.setdefault(r['program'], { })[path] = r
+
+  return [ combineProgramResults(program, results, maxTime) for program, results in programToResults.items() ]
+
+# Two sided 95% critical values of Student's t-distribution indexed by
+# degrees of freedom.
+_tDistribution95 = {
+  1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365,
+  8: 2.306, 9: 2.262, 10: 2.228, 11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145,
+  15: 2.131, 16: 2.120, 17: 2.110, 18: 2.101, 19: 2.093, 20: 2.086, 21: 2.080,
+  22: 2.074, 23: 2.069, 24: 2.064, 25: 2.060, 26: 2.056, 27: 2.052, 28: 2.048,
+  29: 2.045, 30: 2.042, 40: 2.021, 60: 2.000, 120: 1.980,
+}
+
+def _criticalValue(degreesOfFreedom):
+  assert degreesOfFreedom > 0
+  # Use the nearest tabulated value with fewer degrees of freedom
+  # which makes the interval slightly wider (i.e. conservative).
+  return _tDistribution95[max([ df for df in _tDistribution95.keys() if df <= degreesOfFreedom ])]
+
+# The result types that ``combineResults()`` treats as taking ``maxTime``
+_resultTypesToGiveMaxTime = set(FinalResultType).difference({FinalResultType.FULLY_EXPLORED,
+  FinalResultType.BUG_FOUND, FinalResultType.BOUND_HIT})
+
+class AdaptiveRepetition:
+  """
+    Decides if a program should be run again based on how much the
+    times of its runs so far vary.
+
+    Every program is run at least ``minRuns`` times. After that it is
+    only run again whilst the relative standard deviation of its times
+    is above ``relStdDevThreshold`` or the width of the 95% confidence
+    interval of its mean time (relative to the mean) is above
+    ``ciWidthThreshold``. A program is never run more than ``maxRuns``
+    times. Times are computed using ``br_util._computeTimes()`` so they
+    match the combined results.
+  """
+  def __init__(self, maxTime, minRuns, maxRuns, relStdDevThreshold=None, ciWidthThreshold=None):
+    assert maxTime > 0
+    assert minRuns >= 2
+    assert maxRuns >= minRuns
+    assert relStdDevThreshold != None or ciWidthThreshold != None
+    self.maxTime = float(maxTime)
+    self.minRuns = minRuns
+    self.maxRuns = maxRuns
+    self.relStdDevThreshold = relStdDevThreshold
+    self.ciWidthThreshold = ciWidthThreshold
+
+  def needsRerun(self, results):
+    """
+      Returns True if the program with runs ``results`` should be run
+      again.
+    """
+    if len(results) >= self.maxRuns:
+      return False
+    if any([ 'error' in r for r in results ]):
+      # Rerunning won't help us combine the results
+      return False
+    if len(results) < self.minRuns:
+      return True
+
+    try:
+      meanTime, stdDev = _computeTimes(results, self.maxTime, _resultTypesToGiveMaxTime)
+    except (AssertionError, KeyError, ComputeTimesException):
+      # A result that can't be classified can't be combined either
+      _logger.warning('Could not compute the times of "{}". Not running it again'.format(results[0]['program']))
+      return False
+    if meanTime == 0:
+      # e.g. a clock too coarse to time the runs. There is no variation to reduce.
+      _logger.debug('Mean time of "{}" is zero. Treating it as converged'.format(results[0]['program']))
+      return False
+    relStdDev = stdDev / meanTime
+    if self.relStdDevThreshold != None and relStdDev > self.relStdDevThreshold:
+      _logger.debug('Relative stddev {:.4f} of "{}" is above threshold'.format(relStdDev, results[0]['program']))
+      return True
+
+    if self.ciWidthThreshold != None:
+      halfWidth = _criticalValue(len(results) -1) * stdDev / math.sqrt(len(results))
+      if (2 * halfWidth) / meanTime > self.ciWidthThreshold:
+        _logger.debug('Relative confidence interval width {:.4f} of "{}" is above threshold'.format(
+          (2 * halfWidth) / meanTime, results[0]['program']))
+        return True
+    return False
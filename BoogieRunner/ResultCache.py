@@ -0,0 +1,248 @@
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  An on-disk cache of results so that rerunning a batch does not rerun
+  programs whose result cannot have changed.
+
+  Results are keyed by a hash of the program's contents, the runner's
+  name, the normalised ``runner_config`` and a fingerprint of the tool.
+  The fingerprint is ``tool_fingerprint`` if the ``runner_config`` has
+  it, the ID of the image for the Docker backend and otherwise the
+  contents of ``tool_path`` (following symlinks) and of any files or
+  directories listed in ``tool_fingerprint_files`` (e.g. the libraries
+  that Boogie loads from next to it). Each result is stored in its own
+  file below the cache directory. When the cache grows larger than its
+  size limit the least recently used results are evicted.
+"""
+import hashlib
+import json
+import logging
+import os
+import yaml
+from .BrUtil import FinalResultType, classifyResult
+
+try:
+  # Try to use libyaml which is faster
+  from yaml import CLoader as Loader, CDumper as Dumper
+except ImportError:
+  # fall back on python implementation
+  from yaml import Loader, Dumper
+
+_logger = logging.getLogger(__name__)
+
+class ResultCacheException(Exception):
+  def __init__(self, msg):
+    self.msg = msg
+
+def hashFile(path):
+  h = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(2**20), b''):
+      h.update(block)
+  return h.hexdigest()
+
+def hashDirectory(root):
+  """
+    Returns a hash of the relative paths and contents of every file
+    below ``root``.
+  """
+  h = hashlib.sha256()
+  for dirPath, dirNames, fileNames in os.walk(root):
+    dirNames.sort()
+    for fileName in sorted(fileNames):
+      path = os.path.join(dirPath, fileName)
+      if not os.path.isfile(path):
+        continue
+      h.update(os.path.relpath(path, root).encode('utf-8'))
+      h.update(b'\0')
+      h.update(hashFile(path).encode('utf-8'))
+      h.update(b'\0')
+  return h.hexdigest()
+
+class ResultCache:
+  def __init__(self, root, maxSizeInMiB=0, cacheTimeouts=False):
+    """
+      root: The directory to store the cache in. It is created if necessary.
+      maxSizeInMiB: The size the cache is kept below. Zero implies no limit.
+      cacheTimeouts: If True results that timed out are cached too. Otherwise
+                     they are always rerun (e.g. because max_time changed).
+    """
+    if maxSizeInMiB < 0:
+      raise ResultCacheException('Cache size must be >= 0')
+    self.root = os.path.abspath(root)
+    self.maxSize = int(maxSizeInMiB * (2**20))
+    self.cacheTimeouts = cacheTimeouts
+    self.hits = 0
+    self.misses = 0
+    # Tool and extra files to fingerprint. Hashing a large tool for every
+    # job would be slow so tools are assumed not to change during a run.
+    self._toolFingerprints = { }
+    self._imageIds = { } # Docker image name to ID
+    try:
+      os.makedirs(self.root, exist_ok=True)
+    except OSError as e:
+      raise ResultCacheException('Failed to create cache directory "{}": {}'.format(self.root, e))
+    self._size = sum([ os.path.getsize(p) for p in self._entries() ])
+    _logger.info('Using result cache "{}" ({:.1f} MiB)'.format(self.root, self._size / (2**20)))
+    if self.maxSize > 0 and self._size > self.maxSize:
+      self.evict()
+
+  def _entries(self):
+    for dirPath, _, fileNames in os.walk(self.root):
+      for fileName in fileNames:
+        if fileName.endswith('.yml'):
+          yield os.path.join(dirPath, fileName)
+
+  def _path(self, key):
+    return os.path.join(self.root, key[:2], key + '.yml')
+
+  def _dockerImageId(self, imageName):
+    if not imageName in self._imageIds:
+      try:
+        import docker
+        self._imageIds[imageName] = docker.Client().inspect_image(imageName)['Id']
+      except Exception as e:
+        raise ResultCacheException('Failed to find ID of Docker image "{}": {}'.format(imageName, e))
+    return self._imageIds[imageName]
+
+  def toolFingerprint(self, rc):
+    """
+      Returns a string that changes if the tool used by runner config
+      ``rc`` changes. Raises ``ResultCacheException`` or ``OSError`` if
+      the tool can't be fingerprinted.
+    """
+    if 'tool_fingerprint' in rc:
+      if not isinstance(rc['tool_fingerprint'], str):
+        raise ResultCacheException('"tool_fingerprint" must be a string')
+      return 'user:' + rc['tool_fingerprint']
+    backend = rc.get('backend', { })
+    if isinstance(backend, dict) and backend.get('name') == 'Docker':
+      # tool_path is a path inside the image. A tag can be moved to a
+      # different image so use the ID.
+      return 'docker:' + self._dockerImageId(backend.get('config', { }).get('image'))
+    toolPath = os.path.realpath(os.path.expanduser(rc.get('tool_path', '')))
+    if not os.path.isfile(toolPath):
+      raise ResultCacheException('Tool "{}" does not exist'.format(toolPath))
+    extraPaths = rc.get('tool_fingerprint_files', [ ])
+    if not (isinstance(extraPaths, list) and all([ isinstance(p, str) for p in extraPaths ])):
+      raise ResultCacheException('"tool_fingerprint_files" must be a list of strings')
+    # Relative paths are relative to the directory of the tool
+    extraPaths = tuple([ os.path.realpath(os.path.join(os.path.dirname(toolPath), os.path.expanduser(p)))
+      for p in extraPaths ])
+    if not (toolPath, extraPaths) in self._toolFingerprints:
+      h = hashlib.sha256()
+      h.update(hashFile(toolPath).encode('utf-8'))
+      for path in extraPaths:
+        if os.path.isdir(path):
+          digest = hashDirectory(path)
+        elif os.path.isfile(path):
+          digest = hashFile(path)
+        else:
+          raise ResultCacheException('"{}" in "tool_fingerprint_files" does not exist'.format(path))
+        h.update(b'\0')
+        h.update(path.encode('utf-8'))
+        h.update(b'\0')
+        h.update(digest.encode('utf-8'))
+      self._toolFingerprints[(toolPath, extraPaths)] = 'sha256:' + h.hexdigest()
+    return self._toolFingerprints[(toolPath, extraPaths)]
+
+  def key(self, runnerName, program, rc):
+    """
+      Returns the key of running ``program`` with runner ``runnerName``
+      and runner config ``rc``.
+    """
+    h = hashlib.sha256()
+    h.update(runnerName.encode('utf-8'))
+    h.update(b'\0')
+    h.update(json.dumps(rc, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8'))
+    h.update(b'\0')
+    h.update(self.toolFingerprint(rc).encode('utf-8'))
+    h.update(b'\0')
+    h.update(hashFile(program).encode('utf-8'))
+    return h.hexdigest()
+
+  def get(self, key, program):
+    """
+      Returns a copy of the cached result for ``key`` with ``program``
+      set to ``program`` and ``cache_hit`` set to True or None if there
+      is no cached result.
+    """
+    path = self._path(key)
+    try:
+      with open(path, 'r') as f:
+        result = yaml.load(f, Loader=Loader)
+      # Record the use for eviction
+      os.utime(path)
+    except FileNotFoundError:
+      self.misses += 1
+      return None
+    except (OSError, yaml.YAMLError) as e:
+      _logger.warning('Ignoring unreadable cache entry "{}": {}'.format(path, e))
+      self.misses += 1
+      return None
+    if not isinstance(result, dict):
+      _logger.warning('Ignoring malformed cache entry "{}"'.format(path))
+      self.misses += 1
+      return None
+    self.hits += 1
+    result['program'] = program
+    result['cache_hit'] = True
+    return result
+
+  def cacheable(self, result):
+    if 'error' in result:
+      return False
+    try:
+      resultType = classifyResult(result)
+    except (AssertionError, KeyError):
+      return False
+    return self.cacheTimeouts or resultType != FinalResultType.TIMED_OUT
+
+  def put(self, key, result, ignoreKeys=[]):
+    """
+      Store ``result`` under ``key`` unless it is an error report or (if
+      timeouts are not cacheable) it timed out. Keys of ``result`` in
+      ``ignoreKeys`` are not stored.
+    """
+    if not self.cacheable(result):
+      return
+    toStore = { k: v for k, v in result.items() if not k in ignoreKeys and k != 'cache_hit' }
+    path = self._path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+      oldSize = os.path.getsize(path)
+    except OSError:
+      oldSize = 0
+    tempPath = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tempPath, 'w') as f:
+      f.write(yaml.dump(toStore, Dumper=Dumper, default_flow_style=False))
+    os.replace(tempPath, path)
+    self._size += os.path.getsize(path) - oldSize
+    if self.maxSize > 0 and self._size > self.maxSize:
+      self.evict()
+
+  def evict(self):
+    """
+      Remove the least recently used results until the cache is below
+      90% of its size limit so that the following puts do not each have
+      to evict.
+    """
+    entries = [ ]
+    for path in self._entries():
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue
+      entries.append((stat.st_mtime, path, stat.st_size))
+    entries.sort()
+    self._size = sum([ e[2] for e in entries ])
+    removed = 0
+    for _, path, size in entries:
+      if self._size <= 0.9 * self.maxSize:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        continue
+      self._size -= size
+      removed += 1
+    _logger.info('Evicted {} results from the result cache'.format(removed))
@@ -0,0 +1,205 @@
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Result sinks append each result to a file as soon as it is available
+  so that results survive the batch runner crashing and so that the
+  complete report never needs to be held in memory.
+
+  Two stream formats are supported
+
+  * ``yaml`` - A multi-document YAML file with one document per result.
+    Each document has an explicit start (``---``) and end (``...``) marker.
+  * ``jsonl`` - A file with one JSON object per line.
+
+  ``finalise()`` converts a stream into the single YAML list format
+  written by ``boogie-batch-runner.py``.
+"""
+import abc
+import json
+import logging
+import os
+import yaml
+
+try:
+  # Try to use libyaml which is faster
+  from yaml import CLoader as Loader, CDumper as Dumper
+except ImportError:
+  # fall back on python implementation
+  from yaml import Loader, Dumper
+
+_logger = logging.getLogger(__name__)
+
+class ResultSinkException(Exception):
+  def __init__(self, msg):
+    self.msg = msg
+
+class ResultSinkBase(metaclass=abc.ABCMeta):
+  def __init__(self, path, durable=True):
+    """
+      path: Path to the stream file. It is appended to if it already exists.
+      durable: If True each appended result is fsync()'ed to disk.
+    """
+    self.path = path
+    self.durable = durable
+    self.count = 0
+    self._file = open(self.path, 'a')
+
+  @abc.abstractproperty
+  def name(self):
+    pass
+
+  @abc.abstractmethod
+  def _serialise(self, result):
+    """
+      Returns the string to write to the stream for ``result``.
+    """
+    pass
+
+  @classmethod
+  @abc.abstractmethod
+  def load(cls, path):
+    """
+      Generator that yields each result in the stream at ``path``.
+      A truncated final record (e.g. due to a crash whilst writing)
+      is skipped.
+    """
+    pass
+
+  def append(self, result):
+    assert isinstance(result, dict)
+    if self._file == None:
+      raise ResultSinkException('Cannot append to closed sink "{}"'.format(self.path))
+    # Serialise before writing so that a serialisation error doesn't leave
+    # a partial record in the stream
+    self._file.write(self._serialise(result))
+    self._file.flush()
+    if self.durable:
+      os.fsync(self._file.fileno())
+    self.count += 1
+
+  def close(self):
+    if self._file != None:
+      self._file.close()
+      self._file = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    self.close()
+    return False
+
+class YAMLResultSink(ResultSinkBase):
+  @property
+  def name(self):
+    return 'yaml'
+
+  def _serialise(self, result):
+    # The explicit end marker lets us tell a complete document apart
+    # from one that was truncated at a line boundary.
+    return yaml.dump(result, Dumper=Dumper, default_flow_style=False,
+                     explicit_start=True, explicit_end=True)
+
+  @classmethod
+  def load(cls, path):
+    with open(path, 'r') as f:
+      lines = []
+      for line in f:
+        lines.append(line)
+        if line.rstrip('\r\n') == '...' and line.endswith('\n'):
+          yield yaml.load(''.join(lines), Loader=Loader)
+          lines = []
+
+      if len(lines) > 0:
+        _logger.warning('Skipping truncated result at end of "{}"'.format(path))
+
+class JSONLResultSink(ResultSinkBase):
+  @property
+  def name(self):
+    return 'jsonl'
+
+  def _serialise(self, result):
+    # Results may contain integer like types (e.g. from psutil) so
+    # fall back to ``str()`` for anything json doesn't know about.
+    return json.dumps(result, sort_keys=True, default=str) + '\n'
+
+  @classmethod
+  def load(cls, path):
+    with open(path, 'r') as f:
+      for lineNumber, line in enumerate(f):
+        if len(line.strip()) == 0:
+          continue
+        try:
+          if not line.endswith('\n'):
+            raise ValueError('Missing trailing newline')
+          yield json.loads(line)
+        except ValueError as e:
+          # Only the last line is allowed to be truncated
+          if f.readline() != '':
+            raise ResultSinkException('Failed to parse line {} of "{}": {}'.format(
+              lineNumber +1, path, e))
+          _logger.warning('Skipping truncated result at end of "{}"'.format(path))
+
+_sinkClasses = {
+  'yaml': YAMLResultSink,
+  'jsonl': JSONLResultSink,
+}
+
+def formats():
+  return sorted(_sinkClasses.keys())
+
+def getSinkClass(formatName):
+  try:
+    return _sinkClasses[formatName]
+  except KeyError:
+    raise ResultSinkException('"{}" is not a supported stream format'.format(formatName))
+
+def load(path, formatName):
+  """
+    Generator yielding each result in the stream ``path``.
+  """
+  return getSinkClass(formatName).load(path)
+
+def loadReport(path):
+  """
+    Load a report in the single YAML list format.
+  """
+  with open(path, 'r') as f:
+    results = yaml.load(f, Loader=Loader)
+  if results == None:
+    results = []
+  if not isinstance(results, list):
+    raise ResultSinkException('Expected top level data structure to be list in "{}"'.format(path))
+  return results
+
+def rewrite(path, formatName, results):
+  """
+    Atomically replace the stream ``path`` with one containing only
+    ``results``.
+  """
+  tempPath = path + '.tmp'
+  with getSinkClass(formatName)(tempPath, durable=False) as sink:
+    for result in results:
+      sink.append(result)
+    os.fsync(sink._file.fileno())
+  os.replace(tempPath, path)
+
+def finalise(streamPath, formatName, outputPath, header=None):
+  """
+    Write the results in the stream ``streamPath`` to ``outputPath``
+    as a single YAML list. Results are converted one at a time so the
+    whole stream is never held in memory.
+
+    Returns the number of results written.
+  """
+  count = 0
+  with open(outputPath, 'w') as f:
+    if header != None:
+      f.write('# {}\n'.format(header))
+    # A block style list is just the concatenation of the single
+    # element lists.
+    for result in load(streamPath, formatName):
+      f.write(yaml.dump([result], Dumper=Dumper, default_flow_style=False))
+      count += 1
+    if count == 0:
+      f.write(yaml.dump([], Dumper=Dumper, default_flow_style=False))
+  return count
@@ -40,7 +40,7 @@ class BoogalooRunner(RunnerBaseClass):
   def GetNewAnalyser(self, resultDict):
     return BoogalooAnalyser(resultDict)
 
-  def run(self):
+  def buildToolRun(self):
     cmdLine = [ ]
 
     cmdLine.append(self.toolPath)
@@ -62,7 +62,9 @@ class BoogalooRunner(RunnerBaseClass):
 
     # We assume that Boogaloo has no default timeout
     # so we force the timeout within the backend
-    backendResult = self.runTool(cmdLine, isDotNet=False)
+    return self.toolCommand(cmdLine, isDotNet=False)
+
+  def finishRun(self, backendResult):
     if backendResult.outOfTime:
       _logger.warning('Boogaloo hit hard timeout')
 
@@ -25,7 +25,7 @@ class BoogieRunner(RunnerBaseClass):
   def GetNewAnalyser(self, resultDict):
     return BoogieAnalyser(resultDict)
 
-  def run(self):
+  def buildToolRun(self):
     cmdLine = [self.toolPath]
 
     if self.entryPoint == None:
@@ -38,7 +38,9 @@ class BoogieRunner(RunnerBaseClass):
 
     # We assume that Boogie has no default timeout
     # so we force the timeout with the backend
-    backendResult = exitCode = self.runTool(cmdLine, isDotNet=True)
+    return self.toolCommand(cmdLine, isDotNet=True)
+
+  def finishRun(self, backendResult):
     if backendResult.outOfTime:
       _logger.warning('Boogie hit timeout')
 
@@ -25,7 +25,7 @@ class CorralRunner(RunnerBaseClass):
   def GetNewAnalyser(self, resultDict):
     return CorralAnalyser(resultDict)
 
-  def run(self):
+  def buildToolRun(self):
     # We assume that Corral has no default timeout.
     # Looking at Corral's code "/timeLimit:" seems to be
     # zero by default despite what the usage message says
@@ -40,7 +40,9 @@ class CorralRunner(RunnerBaseClass):
 
     cmdLine.extend(self.additionalArgs)
 
-    backendResult = self.runTool(cmdLine, isDotNet=True)
+    return self.toolCommand(cmdLine, isDotNet=True)
+
+  def finishRun(self, backendResult):
     if backendResult.outOfTime:
       _logger.warning('Corral hit timeout')
 
@@ -47,7 +47,7 @@ class GPUVerifyRunner(RunnerBaseClass):
   def GetNewAnalyser(self, resultDict):
     return GPUVerifyAnalyser(resultDict)
 
-  def run(self):
+  def buildToolRun(self):
     # Run using python interpreter
     cmdLine = [ sys.executable, self.toolPath ]
 
@@ -69,9 +69,11 @@ class GPUVerifyRunner(RunnerBaseClass):
     # Add the boogie source file as last arg
     cmdLine.append(self.programPathArgument)
 
-    backendResult = self.runTool(cmdLine,
+    return self.toolCommand(cmdLine,
       isDotNet=False,
       envExtra=env)
+
+  def finishRun(self, backendResult):
     if backendResult.outOfTime:
       _logger.warning('GPUVerify hit hard timeout')
 
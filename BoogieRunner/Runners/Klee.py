@@ -52,7 +52,7 @@ class KleeRunner(RunnerBaseClass):
     results['klee_dir'] = self.outputDir
     return results
 
-  def run(self):
+  def buildToolRun(self):
     # Build the command line
     cmdLine = [ self.toolPath ] + self.additionalArgs
 
@@ -78,7 +78,9 @@ class KleeRunner(RunnerBaseClass):
     # Add the LLVM bitcode file as the last arg
     cmdLine.append(self.programPathArgument)
 
-    backendResult = self.runTool(cmdLine, isDotNet=False)
+    return self.toolCommand(cmdLine, isDotNet=False)
+
+  def finishRun(self, backendResult):
     if backendResult.outOfTime:
       _logger.warning('Hard timeout hit')
 
@@ -12,6 +12,7 @@ import traceback
 import threading
 from .. import EntryPointFinder
 from .. import BackendFactory
+from ..Backends.BackendBase import BackendResult
 
 _logger = logging.getLogger(__name__)
 
@@ -21,6 +22,7 @@ class RunnerBaseException(Exception):
 
 class RunnerBaseClass(metaclass=abc.ABCMeta):
   staticCounter = 0
+  _staticCounterLock = threading.Lock()
 
   def _checkBoogieProgram(self):
     if not os.path.isabs(self.program):
@@ -274,13 +276,13 @@ class RunnerBaseClass(metaclass=abc.ABCMeta):
     else:
       return self.program
 
-  # FIXME: Add a lock so instances cannot be created in parallel
   def __init__(self, boogieProgram, workingDirectory, rc):
     _logger.debug('Initialising {}'.format(boogieProgram))
 
-    # Unique ID (we assume this constructor is never called in parallel)
-    self.uid = RunnerBaseClass.staticCounter
-    RunnerBaseClass.staticCounter += 1
+    # Unique ID. Runners may be created in parallel by the batch runner.
+    with RunnerBaseClass._staticCounterLock:
+      self.uid = RunnerBaseClass.staticCounter
+      RunnerBaseClass.staticCounter += 1
 
     self._backendResult = None
     self.program = boogieProgram # FIXME: Hide this so if make copy we only expose that
@@ -325,10 +327,40 @@ class RunnerBaseClass(metaclass=abc.ABCMeta):
   def logFile(self):
     return os.path.join(self.workingDirectory, 'log.txt')
 
-  @abc.abstractmethod
   def run(self):
+    """
+      Run the tool on the program with the backend.
+    """
+    cmdLine, env = self.buildToolRun()
+    self.recordToolRun(self._backend.run(cmdLine, self.logFile, env))
+
+  @abc.abstractmethod
+  def buildToolRun(self):
+    """
+      Returns the tuple ``(cmdLine, env)`` to run the tool with. Runners
+      should build it with ``toolCommand()``.
+    """
     pass
 
+  @abc.abstractmethod
+  def finishRun(self, backendResult):
+    """
+      Called with the ``BackendResult`` of running the tool once it has
+      finished.
+    """
+    pass
+
+  def recordToolRun(self, backendResult):
+    """
+      Record the result of running the tool with the command line and
+      environment from ``buildToolRun()`` and pass it to ``finishRun()``.
+      This is only needed if the tool isn't run by ``run()`` (e.g. it is
+      run with ``backend.runAsync()``).
+    """
+    assert isinstance(backendResult, BackendResult)
+    self._backendResult = backendResult
+    self.finishRun(backendResult)
+
   # timeouts are a little different. An analyser needs
   # to determine if this happened so getResults() needs
   # to be called to determine this.
@@ -374,6 +406,7 @@ class RunnerBaseClass(metaclass=abc.ABCMeta):
     results['backend_timeout'] = self._backendResult.outOfTime
     results['user_cpu_time'] = self._backendResult.userCpuTime
     results['sys_cpu_time'] = self._backendResult.sysCpuTime
+    results['peak_memory'] = self._backendResult.peakMemory
     return results
 
   def getResults(self):
@@ -413,6 +446,22 @@ class RunnerBaseClass(metaclass=abc.ABCMeta):
     """
     return self._backend.programPath()
 
+  @property
+  def cpuAffinity(self):
+    """
+      The set of CPU ids the tool will be restricted to running on.
+      None implies no restriction.
+    """
+    return self._backend.cpuAffinity
+
+  @cpuAffinity.setter
+  def cpuAffinity(self, value):
+    self._backend.cpuAffinity = value
+
+  @property
+  def backend(self):
+    return self._backend
+
   @property
   def workingDirectoryInBackend(self):
     """
@@ -423,8 +472,8 @@ class RunnerBaseClass(metaclass=abc.ABCMeta):
 
   def kill(self, pause=0.0):
     """
-    Subclasses need to override this if their
-    run() method doesn't use runTool()
+    Subclasses need to override this if they
+    override run()
     """
     _logger.debug('Trying to kill {}'.format(self.name))
     self._backend.kill()
@@ -439,9 +488,12 @@ class RunnerBaseClass(metaclass=abc.ABCMeta):
         _logger.debug(traceback.format_exc())
         pass
 
-  def runTool(self, cmdLine, isDotNet, envExtra = {}):
+  def toolCommand(self, cmdLine, isDotNet, envExtra = {}):
+    """
+      Returns the tuple ``(cmdLine, env)`` to run the tool with the
+      arguments ``cmdLine``.
+    """
     finalCmdLine = []
-    self._memoryLimitHit = False
 
     if isDotNet and os.name == 'posix':
       finalCmdLine.append(self.monoExecutable)
@@ -458,7 +510,4 @@ class RunnerBaseClass(metaclass=abc.ABCMeta):
     _logger.info('Running:\n{}\nwith env:{}'.format(
       pprint.pformat(finalCmdLine),
       pprint.pformat(env)))
-
-    # Run the tool
-    self._backendResult = self._backend.run(finalCmdLine, self.logFile, env)
-    return self._backendResult
+    return (finalCmdLine, env)
@@ -52,7 +52,7 @@ class SymbooglixRunner(RunnerBaseClass):
     results['__soft_timeout'] = self.softTimeout
     return results
 
-  def run(self):
+  def buildToolRun(self):
     # Build the command line
     cmdLine = [ self.toolPath ] + self.additionalArgs
 
@@ -74,7 +74,9 @@ class SymbooglixRunner(RunnerBaseClass):
     cmdLine.append(self.programPathArgument)
 
     self.hitHardTimeout = False
-    backendResult = self.runTool(cmdLine, isDotNet=True)
+    return self.toolCommand(cmdLine, isDotNet=True)
+
+  def finishRun(self, backendResult):
     if backendResult.outOfTime:
       self.hitHardTimeout = True
       _logger.warning('Hard timeout hit')
@@ -0,0 +1,435 @@
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  A local daemon that owns the job slots (and optionally a memory budget)
+  of a host so that several ``boogie-batch-runner.py`` invocations can
+  share it without oversubscribing it (see ``boogie-schedd.py``).
+
+  Clients connect over a Unix domain socket and request a slot for each
+  job they want to start. The daemon grants slots so that every user
+  (identified by the uid of the connecting process) gets a fair share:
+  a free slot goes to the user holding the fewest slots who has a
+  request waiting. If that request doesn't fit inside the memory budget
+  nothing else is granted until it does so users with large jobs are not
+  starved by users with small ones. The daemon only hands out slots.
+  Clients still run their jobs and write their results themselves.
+
+  The protocol is one JSON object per line. Client to daemon:
+
+  * ``{"op": "request", "id": <int>, "memory": <MiB>}``
+  * ``{"op": "release", "id": <int>}`` (also withdraws a waiting request)
+
+  Daemon to client:
+
+  * ``{"op": "welcome", "slots": <int>, "memory_budget": <MiB or null>}``
+    (sent on connecting)
+  * ``{"op": "grant", "id": <int>, "slot": <int>, "cpus": <list or null>}``
+  * ``{"op": "error", "id": <int or null>, "msg": <string>}``
+
+  When a client disconnects its slots are released.
+"""
+import collections
+import itertools
+import json
+import logging
+import os
+import pwd
+import socket
+import socketserver
+import stat
+import struct
+import threading
+from . import BatchScheduler
+
+_logger = logging.getLogger(__name__)
+
+class SchedulerDaemonException(Exception):
+  def __init__(self, msg):
+    self.msg = msg
+
+def _send(sock, lock, message):
+  data = (json.dumps(message) + '\n').encode('utf-8')
+  with lock:
+    sock.sendall(data)
+
+def _peerUser(sock):
+  credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+  _, uid, _ = struct.unpack('3i', credentials)
+  try:
+    return pwd.getpwuid(uid).pw_name
+  except KeyError:
+    return str(uid)
+
+class _Connection:
+  def __init__(self, sock, user):
+    self.sock = sock
+    self.user = user
+    self.sendLock = threading.Lock()
+
+class _Request:
+  def __init__(self, connection, requestId, memory, seq):
+    self.connection = connection
+    self.id = requestId
+    self.memory = memory
+    self.seq = seq
+
+class Daemon:
+  def __init__(self, socketPath, slots, memoryBudget=None):
+    """
+      socketPath: The Unix domain socket to listen on.
+      slots: A list where each element is either None or the set of CPU
+             ids of that slot. The length is the number of jobs that can
+             run at once.
+      memoryBudget: The total max_memory (in MiB) that running jobs may use.
+                    None implies no budget.
+    """
+    assert len(slots) > 0
+    assert memoryBudget == None or memoryBudget > 0
+    self.socketPath = socketPath
+    self.slots = [ frozenset(s) if s != None else None for s in slots ]
+    self.memoryBudget = memoryBudget
+    self._lock = threading.Lock()
+    self._free = list(range(0, len(self.slots)))
+    self._memoryUsed = 0
+    self._waiting = collections.OrderedDict() # (connection, id) to _Request
+    self._granted = { } # (connection, id) to (slot, memory)
+    self._seq = itertools.count()
+    self._server = None
+
+  def _heldBy(self):
+    held = collections.Counter()
+    for connection, _ in self._granted.keys():
+      held[connection.user] += 1
+    return held
+
+  def _fits(self, request):
+    return self.memoryBudget == None or self._memoryUsed + request.memory <= self.memoryBudget
+
+  def _schedule(self):
+    """
+      Grant free slots to waiting requests. Must be called with the lock held.
+    """
+    while len(self._free) > 0 and len(self._waiting) > 0:
+      # The oldest waiting request of each user
+      oldest = collections.OrderedDict()
+      for request in self._waiting.values():
+        oldest.setdefault(request.connection.user, request)
+      held = self._heldBy()
+      # Users holding the fewest slots go first. Ties go to the oldest request.
+      toGrant = min(oldest.values(), key=lambda r: (held[r.connection.user], r.seq))
+      if not self._fits(toGrant):
+        # Keep the memory that is freed for it rather than granting smaller
+        # requests that would keep it waiting forever.
+        return
+      slot = self._free.pop(0)
+      key = (toGrant.connection, toGrant.id)
+      del self._waiting[key]
+      self._granted[key] = (slot, toGrant.memory)
+      self._memoryUsed += toGrant.memory
+      _logger.debug('Granted slot {} to {} (request {})'.format(slot, toGrant.connection.user, toGrant.id))
+      try:
+        cpus = self.slots[slot]
+        _send(toGrant.connection.sock, toGrant.connection.sendLock,
+          { 'op': 'grant', 'id': toGrant.id, 'slot': slot, 'cpus': sorted(cpus) if cpus != None else None })
+      except OSError:
+        # The client has gone. Its slots are released when its handler notices.
+        pass
+
+  def _release(self, connection, requestId):
+    key = (connection, requestId)
+    if key in self._waiting:
+      del self._waiting[key]
+    elif key in self._granted:
+      slot, memory = self._granted.pop(key)
+      self._memoryUsed -= memory
+      self._free.append(slot)
+      self._free.sort()
+
+  def _handleMessage(self, connection, message):
+    op = message.get('op', None)
+    requestId = message.get('id', None)
+    if not isinstance(requestId, int):
+      _send(connection.sock, connection.sendLock, { 'op': 'error', 'id': None, 'msg': 'Missing request id' })
+      return
+    if op == 'request':
+      memory = message.get('memory', 0)
+      if self.memoryBudget != None and not (isinstance(memory, int) and 0 < memory <= self.memoryBudget):
+        _send(connection.sock, connection.sendLock, { 'op': 'error', 'id': requestId,
+          'msg': 'Memory ({}) must be > 0 and <= the memory budget ({} MiB)'.format(memory, self.memoryBudget) })
+        return
+      with self._lock:
+        key = (connection, requestId)
+        if key in self._waiting or key in self._granted:
+          return
+        self._waiting[key] = _Request(connection, requestId, memory if self.memoryBudget != None else 0,
+          next(self._seq))
+        self._schedule()
+    elif op == 'release':
+      with self._lock:
+        self._release(connection, requestId)
+        self._schedule()
+    else:
+      _send(connection.sock, connection.sendLock, { 'op': 'error', 'id': requestId,
+        'msg': 'Unknown op "{}"'.format(op) })
+
+  def _disconnected(self, connection):
+    with self._lock:
+      for key in [ k for k in list(self._waiting.keys()) + list(self._granted.keys()) if k[0] is connection ]:
+        self._release(connection, key[1])
+      self._schedule()
+    _logger.info('{} disconnected'.format(connection.user))
+
+  def serve(self):
+    """
+      Serve clients until ``shutdown()`` is called.
+    """
+    daemon = self
+    class Handler(socketserver.StreamRequestHandler):
+      def handle(self):
+        connection = _Connection(self.connection, _peerUser(self.connection))
+        _logger.info('{} connected'.format(connection.user))
+        try:
+          _send(connection.sock, connection.sendLock, { 'op': 'welcome', 'slots': len(daemon.slots),
+            'memory_budget': daemon.memoryBudget })
+          for line in self.rfile:
+            try:
+              message = json.loads(line.decode('utf-8'))
+            except ValueError:
+              _send(connection.sock, connection.sendLock, { 'op': 'error', 'id': None, 'msg': 'Invalid message' })
+              continue
+            if isinstance(message, dict):
+              daemon._handleMessage(connection, message)
+        except OSError as e:
+          _logger.debug('Connection error: {}'.format(e))
+        finally:
+          daemon._disconnected(connection)
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+      daemon_threads = True
+
+    if os.path.exists(self.socketPath):
+      if not stat.S_ISSOCK(os.stat(self.socketPath).st_mode):
+        raise SchedulerDaemonException('"{}" exists and is not a socket'.format(self.socketPath))
+      # Only remove a stale socket. Don't steal the socket of a running daemon.
+      probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      try:
+        probe.connect(self.socketPath)
+        raise SchedulerDaemonException('A daemon is already listening on "{}"'.format(self.socketPath))
+      except (ConnectionRefusedError, FileNotFoundError):
+        os.remove(self.socketPath)
+      finally:
+        probe.close()
+    self._server = Server(self.socketPath, Handler)
+    # Every user on the host may connect
+    os.chmod(self.socketPath, 0o777)
+    _logger.info('Listening on {} with {} slots{}'.format(self.socketPath, len(self.slots),
+      '' if self.memoryBudget == None else ' and a memory budget of {} MiB'.format(self.memoryBudget)))
+    try:
+      self._server.serve_forever()
+    finally:
+      self._server.server_close()
+      os.remove(self.socketPath)
+
+  def shutdown(self):
+    if self._server != None:
+      self._server.shutdown()
+
+class Grant:
+  def __init__(self, requestId, slot, cpus, memory):
+    self.id = requestId
+    self.slot = slot
+    self.cpus = frozenset(cpus) if cpus != None else None
+    self.memory = memory
+
+class Client:
+  """
+    Connection to the daemon. Grants are received by a background thread.
+  """
+  def __init__(self, socketPath):
+    self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      self._sock.connect(socketPath)
+    except OSError as e:
+      raise SchedulerDaemonException('Failed to connect to scheduling daemon at "{}": {}'.format(socketPath, e))
+    self._file = self._sock.makefile('rb')
+    self._sendLock = threading.Lock()
+    self._lock = threading.Lock()
+    self._ids = itertools.count()
+    self._requested = { } # id to memory of requests waiting for a grant
+    self._granted = { } # id to Grant
+    self.disconnected = False
+
+    welcome = self._readMessage()
+    if welcome == None or welcome.get('op', None) != 'welcome':
+      raise SchedulerDaemonException('Unexpected reply from scheduling daemon: {}'.format(welcome))
+    self.slots = welcome['slots']
+    self.memoryBudget = welcome['memory_budget']
+    self._thread = threading.Thread(target=self._readLoop, name='schedd_client', daemon=True)
+    self._thread.start()
+
+  def _readMessage(self):
+    line = self._file.readline()
+    if len(line) == 0:
+      return None
+    return json.loads(line.decode('utf-8'))
+
+  def _readLoop(self):
+    try:
+      while True:
+        message = self._readMessage()
+        if message == None:
+          break
+        if message.get('op', None) == 'grant':
+          with self._lock:
+            memory = self._requested.pop(message['id'], None)
+            if memory == None:
+              # Released before the grant arrived. The daemon has freed it.
+              continue
+            self._granted[message['id']] = Grant(message['id'], message['slot'], message['cpus'], memory)
+        elif message.get('op', None) == 'error':
+          _logger.error('Scheduling daemon: {}'.format(message.get('msg', None)))
+          with self._lock:
+            self._requested.pop(message.get('id', None), None)
+    except (OSError, ValueError) as e:
+      _logger.debug('Connection error: {}'.format(e))
+    self.disconnected = True
+    _logger.error('Lost connection to scheduling daemon')
+
+  def _send(self, message):
+    try:
+      _send(self._sock, self._sendLock, message)
+    except OSError:
+      self.disconnected = True
+
+  def request(self, memory):
+    """
+      Ask for a slot for a job that needs ``memory`` MiB. Returns the id
+      of the request.
+    """
+    with self._lock:
+      requestId = next(self._ids)
+      self._requested[requestId] = memory
+    self._send({ 'op': 'request', 'id': requestId, 'memory': memory })
+    return requestId
+
+  def grant(self, requestId):
+    """
+      Returns the grant for request ``requestId`` or None if it hasn't
+      been granted yet.
+    """
+    with self._lock:
+      return self._granted.get(requestId, None)
+
+  def release(self, requestId):
+    """
+      Withdraw request ``requestId`` or give back its slot if it was granted.
+    """
+    with self._lock:
+      self._requested.pop(requestId, None)
+      self._granted.pop(requestId, None)
+    self._send({ 'op': 'release', 'id': requestId })
+
+  @property
+  def outstandingCount(self):
+    """
+      The number of requests waiting for a grant plus grants not released.
+    """
+    with self._lock:
+      return len(self._requested) + len(self._granted)
+
+  def close(self):
+    try:
+      self._sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+      pass
+    self._sock.close()
+
+class DaemonPolicy(BatchScheduler.AdmissionPolicy):
+  """
+    Only admit a job once the scheduling daemon has granted it a slot.
+    Each request is for one job. Requests are kept in flight for the jobs
+    that would start next locally so grants are not delayed by round
+    trips. Requests (and grants) for jobs that are no longer among them
+    are given back so no slots of the daemon are held for jobs that can't
+    use them. If the daemon dies jobs are admitted without it.
+  """
+  pollTimePeriod = 0.1
+
+  def __init__(self, client, maxJobs):
+    self.client = client
+    self.maxJobs = maxJobs
+    self._requests = { } # Pending job to request id
+    self._running = { } # Running job to request id
+    self._warnedDisconnected = False
+
+  def check(self, job):
+    """
+      Raise an exception if ``job`` could never be admitted.
+    """
+    if self.client.memoryBudget == None:
+      return
+    if job.maxMemory == 0:
+      raise BatchScheduler.BatchSchedulerException(
+        '"max_memory" must be set because the scheduling daemon has a memory budget')
+    if job.maxMemory > self.client.memoryBudget:
+      raise BatchScheduler.BatchSchedulerException(
+        '"max_memory" ({} MiB) is larger than the memory budget of the scheduling daemon ({} MiB)'.format(
+        job.maxMemory, self.client.memoryBudget))
+
+  def _checkDisconnected(self):
+    if self.client.disconnected and not self._warnedDisconnected:
+      _logger.warning('Scheduling jobs without the scheduling daemon')
+      self._warnedDisconnected = True
+    return self.client.disconnected
+
+  def queued(self, pendingJobs, runningJobs):
+    if self._checkDisconnected():
+      return
+    # Only the jobs that could start next locally need a request
+    wanted = list(itertools.islice(pendingJobs, max(0, self.maxJobs - len(runningJobs))))
+    wantedSet = set(wanted)
+    for job in list(self._requests.keys()):
+      if not job in wantedSet:
+        self.client.release(self._requests.pop(job))
+    for job in wanted:
+      if not job in self._requests:
+        self._requests[job] = self.client.request(job.maxMemory)
+
+  def _fits(self, grant, job):
+    return self.client.memoryBudget == None or grant.memory >= job.maxMemory
+
+  def canAdmit(self, job, runningJobs):
+    if self._checkDisconnected():
+      return True
+    if not job in self._requests:
+      # Not among the jobs expected to start next (e.g. chosen by a picker)
+      self._requests[job] = self.client.request(job.maxMemory)
+    if self.client.grant(self._requests[job]) != None:
+      return True
+    # Use a grant of another pending job rather than leaving it unused.
+    # That job asks again when it is next wanted.
+    for other, requestId in list(self._requests.items()):
+      grant = self.client.grant(requestId)
+      if other is not job and grant != None and self._fits(grant, job):
+        self.client.release(self._requests[job])
+        self._requests[job] = self._requests.pop(other)
+        return True
+    return False
+
+  def started(self, job):
+    requestId = self._requests.pop(job, None)
+    if requestId == None:
+      # Only happens if the daemon went away
+      return
+    self._running[job] = requestId
+    grant = self.client.grant(requestId)
+    if grant != None and grant.cpus != None:
+      job.cpus = grant.cpus
+      job.tags['cpu_slot'] = grant.slot
+
+  def finished(self, job):
+    requestId = self._running.pop(job, None)
+    if requestId != None:
+      self.client.release(requestId)
+
+  def close(self):
+    self.client.close()
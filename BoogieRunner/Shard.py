@@ -0,0 +1,67 @@
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Deterministically split a program list into shards so that a batch
+  can be spread over the tasks of a job array. Every task computes the
+  same split so no coordination is needed.
+"""
+import hashlib
+import logging
+
+_logger = logging.getLogger(__name__)
+
+class ShardException(Exception):
+  def __init__(self, msg):
+    self.msg = msg
+
+def parse(shardString):
+  """
+    Parse a shard specification ``i/N`` (where ``0 <= i < N``) into
+    the tuple ``(i, N)``.
+  """
+  try:
+    index, count = [ int(x) for x in shardString.split('/') ]
+  except ValueError:
+    raise ShardException('"{}" is not a valid shard. Expected "i/N"'.format(shardString))
+  if count <= 0:
+    raise ShardException('The number of shards must be > 0')
+  if index < 0 or index >= count:
+    raise ShardException('Shard index must be >= 0 and < {}'.format(count))
+  return (index, count)
+
+def shardOfProgram(program, count):
+  """
+    Returns the shard that ``program`` belongs to when sharding by hash.
+    Unlike ``hash()`` this is stable across processes and hosts.
+  """
+  digest = hashlib.sha1(program.encode('utf-8')).hexdigest()
+  return int(digest, 16) % count
+
+def byHash(programs, index, count):
+  """
+    Returns the programs in ``programs`` that belong to shard ``index``
+    of ``count`` based on a stable hash of each program's path.
+  """
+  return [ p for p in programs if shardOfProgram(p, count) == index ]
+
+def byCost(programs, estimates, index, count):
+  """
+    Returns the programs in ``programs`` that belong to shard ``index``
+    of ``count`` where the shards are balanced by predicted cost.
+
+    estimates: A dictionary mapping each program to its predicted run time.
+
+    Programs are assigned most expensive first to the shard with the
+    least total predicted cost so far. Ties are broken by program path
+    and shard index so every task computes the same assignment.
+  """
+  shardCosts = [ 0.0 ] * count
+  inShard = set()
+  for program in sorted(programs, key=lambda p: (-estimates[p], p)):
+    shard = min(range(0, count), key=lambda s: (shardCosts[s], s))
+    shardCosts[shard] += estimates[program]
+    if shard == index:
+      inShard.add(program)
+  _logger.info('Predicted cost of shard {} is {:.1f} seconds (smallest {:.1f}, largest {:.1f})'.format(
+    index, shardCosts[index], min(shardCosts), max(shardCosts)))
+  # Preserve the order of ``programs``
+  return [ p for p in programs if p in inShard ]
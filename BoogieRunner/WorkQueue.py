@@ -0,0 +1,354 @@
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  A work queue kept in a directory on a shared file system (e.g. NFS)
+  so that ``boogie-queue-runner.py`` workers on any number of hosts can
+  run the same batch.
+
+  Only operations that are atomic on network file systems are relied
+  upon (creating a file with ``O_EXCL``, ``link()`` and ``rename()``).
+  The queue directory contains
+
+  * ``queue.yml`` - The config, program list and settings of the batch.
+  * ``claims/`` - A job is claimed by creating ``<index>.<generation>``.
+    The owner of a claim regularly touches it. If a claim has not been
+    touched for the lease time its owner is presumed dead and the job
+    is reclaimed by creating the next generation. Because claim files
+    are never replaced only one worker can win each generation.
+  * ``results/`` - ``<index>.yml`` holds the result of a job. It is
+    created with ``link()`` so the first result stored wins.
+  * ``workers/`` - A file per worker. These are touched to read the file
+    system's clock so that hosts with skewed clocks agree on when a
+    claim has expired.
+"""
+import functools
+import logging
+import os
+import socket
+import uuid
+import yaml
+
+try:
+  # Try to use libyaml which is faster
+  from yaml import CLoader as Loader, CDumper as Dumper
+except ImportError:
+  # fall back on python implementation
+  from yaml import Loader, Dumper
+
+_logger = logging.getLogger(__name__)
+
+class WorkQueueException(Exception):
+  def __init__(self, msg):
+    self.msg = msg
+
+def _claimPath(root, index, generation):
+  return os.path.join(root, 'claims', '{}.{}'.format(index, generation))
+
+def claimLost(root, index, generation):
+  """
+    Returns True if claim ``generation`` on job ``index`` of the queue in
+    ``root`` no longer belongs to the worker that made it because another
+    worker reclaimed the job (or the claim was released).
+  """
+  return (os.path.exists(_claimPath(root, index, generation +1)) or
+          not os.path.exists(_claimPath(root, index, generation)))
+
+class Claim:
+  """
+    A job claimed by a worker.
+  """
+  def __init__(self, index, generation, program, workDir):
+    self.index = index
+    self.generation = generation
+    self.program = program
+    self.workDir = workDir
+
+  @property
+  def isReclaim(self):
+    return self.generation > 0
+
+class WorkQueue:
+  def __init__(self, root):
+    """
+      Open the existing queue in directory ``root``.
+    """
+    self.root = os.path.abspath(root)
+    self.workerId = None
+    queueFile = os.path.join(self.root, 'queue.yml')
+    if not os.path.exists(queueFile):
+      raise WorkQueueException('"{}" is not a work queue'.format(self.root))
+    with open(queueFile, 'r') as f:
+      data = yaml.load(f, Loader=Loader)
+    try:
+      self.config = data['config']
+      self.programs = data['programs']
+      self.workDirsRoot = data['working_dirs_root']
+      self.leaseTime = data['lease_time']
+    except (KeyError, TypeError):
+      raise WorkQueueException('"{}" is malformed'.format(queueFile))
+
+  @classmethod
+  def create(cls, root, config, programs, workDirsRoot, leaseTime):
+    """
+      Create a new queue in the directory ``root`` which must not
+      already exist.
+
+      config: The loaded config file.
+      programs: The list of programs to run. The index of each program
+                is used to name its working directory, claims and result.
+      workDirsRoot: Directory to create working directories inside.
+      leaseTime: Time in seconds after which a claim that has not been
+                 renewed is considered stale.
+    """
+    assert leaseTime > 0
+    root = os.path.abspath(root)
+    if os.path.exists(root):
+      raise WorkQueueException('"{}" already exists'.format(root))
+    os.mkdir(root)
+    for subDir in [ 'claims', 'results', 'workers' ]:
+      os.mkdir(os.path.join(root, subDir))
+
+    data = {
+      'config': config,
+      'programs': programs,
+      'working_dirs_root': os.path.abspath(workDirsRoot),
+      'lease_time': leaseTime,
+    }
+    queueFile = os.path.join(root, 'queue.yml')
+    tempPath = queueFile + '.tmp'
+    with open(tempPath, 'w') as f:
+      yaml.dump(data, f, Dumper=Dumper, default_flow_style=False)
+      f.flush()
+      os.fsync(f.fileno())
+    # Workers treat the existence of queue.yml as the queue being ready
+    os.rename(tempPath, queueFile)
+    return cls(root)
+
+  def workDir(self, index):
+    return os.path.join(self.workDirsRoot, 'workdir-{}'.format(index))
+
+  def _claimPath(self, index, generation):
+    return _claimPath(self.root, index, generation)
+
+  def _resultPath(self, index):
+    return os.path.join(self.root, 'results', '{}.yml'.format(index))
+
+  def _workerPath(self):
+    return os.path.join(self.root, 'workers', self.workerId)
+
+  def register(self):
+    """
+      Register this process as a worker. This must be called before
+      claiming jobs.
+    """
+    self.workerId = '{}-{}-{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+    with open(self._workerPath(), 'w') as f:
+      f.write('{}\n'.format(self.workerId))
+    _logger.info('Registered worker "{}"'.format(self.workerId))
+
+  def unregister(self):
+    if self.workerId != None:
+      os.remove(self._workerPath())
+      self.workerId = None
+
+  def _now(self):
+    # Use the file system's clock rather than ours so that the time
+    # is comparable with the modification time of claims.
+    path = self._workerPath()
+    os.utime(path)
+    return os.stat(path).st_mtime
+
+  def _scan(self):
+    """
+      Returns the set of indices that have results and a dictionary
+      mapping the index of each claimed job to its latest generation.
+    """
+    results = set()
+    for name in os.listdir(os.path.join(self.root, 'results')):
+      if name.endswith('.yml'):
+        results.add(int(name[:-len('.yml')]))
+
+    claims = { }
+    for name in os.listdir(os.path.join(self.root, 'claims')):
+      try:
+        index, generation = [ int(x) for x in name.split('.') ]
+      except ValueError:
+        continue
+      claims[index] = max(generation, claims.get(index, -1))
+    return results, claims
+
+  def _tryClaim(self, index, generation):
+    path = self._claimPath(index, generation)
+    try:
+      fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+      _logger.debug('Lost race to claim job {} (generation {})'.format(index, generation))
+      return None
+    with os.fdopen(fd, 'w') as f:
+      f.write('{}\n'.format(self.workerId))
+
+    claim = Claim(index, generation, self.programs[index], self.workDir(index))
+    if os.path.exists(self._resultPath(index)):
+      # The job finished after we scanned the queue
+      self.release(claim)
+      return None
+    return claim
+
+  def claim(self):
+    """
+      Atomically claim a job. Jobs that have never been claimed are
+      preferred (in program list order) over reclaiming stale claims.
+
+      Returns a ``Claim`` or None if there is nothing to claim right now.
+    """
+    assert self.workerId != None
+    results, claims = self._scan()
+    for index in range(0, len(self.programs)):
+      if index in results or index in claims:
+        continue
+      claim = self._tryClaim(index, 0)
+      if claim != None:
+        return claim
+
+    now = None
+    for index, generation in sorted(claims.items()):
+      if index in results:
+        continue
+      try:
+        lastRenewed = os.stat(self._claimPath(index, generation)).st_mtime
+      except FileNotFoundError:
+        # Released since the scan
+        continue
+      if now == None:
+        now = self._now()
+      if now - lastRenewed <= self.leaseTime:
+        continue
+      _logger.warning('Reclaiming stale claim on "{}" (not renewed for {:.1f} seconds)'.format(
+        self.programs[index], now - lastRenewed))
+      claim = self._tryClaim(index, generation +1)
+      if claim != None:
+        return claim
+    return None
+
+  def renew(self, claim):
+    """
+      Renew the lease on ``claim``. Returns False if the claim was lost
+      (e.g. the job was reclaimed by another worker). The job must then
+      be abandoned because the other worker is running it in the same
+      working directory.
+    """
+    try:
+      os.utime(self._claimPath(claim.index, claim.generation))
+    except FileNotFoundError:
+      pass
+    if claimLost(self.root, claim.index, claim.generation):
+      _logger.warning('Job for "{}" was reclaimed by another worker'.format(claim.program))
+      return False
+    return True
+
+  def lostCheck(self, claim):
+    """
+      Returns a function that returns True once ``claim`` has been lost.
+      It can be pickled so it can be sent to worker processes (see
+      ``BatchWorker.runJob()``).
+    """
+    return functools.partial(claimLost, self.root, claim.index, claim.generation)
+
+  def release(self, claim):
+    """
+      Give up ``claim`` without storing a result so that another
+      worker can run the job straight away.
+    """
+    try:
+      os.remove(self._claimPath(claim.index, claim.generation))
+    except FileNotFoundError:
+      pass
+
+  def complete(self, claim, result):
+    """
+      Store ``result`` for the claimed job.
+
+      Returns False if the claim was lost or a result was already stored
+      by another worker (in which case ``result`` is discarded).
+    """
+    if claimLost(self.root, claim.index, claim.generation):
+      _logger.warning('Claim on "{}" was lost. Discarding result'.format(claim.program))
+      return False
+    path = self._resultPath(claim.index)
+    tempPath = '{}.{}.tmp'.format(path, self.workerId)
+    with open(tempPath, 'w') as f:
+      yaml.dump(result, f, Dumper=Dumper, default_flow_style=False)
+      f.flush()
+      os.fsync(f.fileno())
+    try:
+      os.link(tempPath, path)
+      return True
+    except FileExistsError:
+      _logger.warning('Another worker already stored a result for "{}". Discarding result'.format(claim.program))
+      return False
+    finally:
+      os.remove(tempPath)
+
+  def status(self):
+    """
+      Returns a dictionary counting the jobs that are completed, running
+      (claimed with a current lease), stale (claimed with an expired
+      lease) and pending (never claimed). The number of registered
+      workers is also included.
+    """
+    results, claims = self._scan()
+    counts = { 'total': len(self.programs), 'completed': len(results),
+               'running': 0, 'stale': 0, 'pending': 0 }
+    now = None
+    for index in range(0, len(self.programs)):
+      if index in results:
+        continue
+      if not index in claims:
+        counts['pending'] += 1
+        continue
+      try:
+        lastRenewed = os.stat(self._claimPath(index, claims[index])).st_mtime
+      except FileNotFoundError:
+        counts['pending'] += 1
+        continue
+      if now == None:
+        now = self._now() if self.workerId != None else _fileSystemTime(self.root)
+      if now - lastRenewed > self.leaseTime:
+        counts['stale'] += 1
+      else:
+        counts['running'] += 1
+    counts['workers'] = len(os.listdir(os.path.join(self.root, 'workers')))
+    return counts
+
+  @property
+  def done(self):
+    results, _ = self._scan()
+    return len(results) == len(self.programs)
+
+  def loadResults(self):
+    """
+      Returns the list of results in program list order. An exception
+      is raised if any job does not have a result yet.
+    """
+    results, _ = self._scan()
+    missing = [ self.programs[i] for i in range(0, len(self.programs)) if not i in results ]
+    if len(missing) > 0:
+      raise WorkQueueException('{} programs do not have a result yet:\n{}'.format(
+        len(missing), '\n'.join(missing)))
+
+    report = [ ]
+    for index in range(0, len(self.programs)):
+      with open(self._resultPath(index), 'r') as f:
+        report.append(yaml.load(f, Loader=Loader))
+    return report
+
+def _fileSystemTime(directory):
+  """
+    Read the clock of the file system holding ``directory``.
+  """
+  path = os.path.join(directory, '.clock-{}'.format(uuid.uuid4().hex))
+  with open(path, 'w'):
+    pass
+  try:
+    return os.stat(path).st_mtime
+  finally:
+    os.remove(path)
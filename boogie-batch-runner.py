@@ -4,44 +4,238 @@
     Script to run a Boogie tool over a set of boogie programs
 """
 import argparse
+import collections
 import datetime
 import logging
 import os
 from  BoogieRunner import ProgramListLoader
 from  BoogieRunner import ConfigLoader
 from  BoogieRunner import RunnerFactory
+from  BoogieRunner import BatchWorker
+from  BoogieRunner import ResultSink
+from  BoogieRunner import History
+from  BoogieRunner import BatchScheduler
+from  BoogieRunner import Repetition
+from  BoogieRunner import Shard
+from  BoogieRunner import BatchStatus
+from  BoogieRunner import Ladder
+from  BoogieRunner import ResultCache
+from  BoogieRunner import SchedulerDaemon
+from  BoogieRunner import Deadline
+import concurrent.futures
+import multiprocessing
 import traceback
 import yaml
 import signal
 import sys
 
 _logger = None
-futureToRunner = None
+_scheduler = None
+
+# Tags that describe how a tool was run rather than the job. They are
+# not added to cached results because no tool was run.
+_runPlacementTags = [ 'cpu_slot', 'deadline_max_time' ]
+cancelEvent = None
 
 def handleInterrupt(signum, frame):
   logging.info('Received signal {}'.format(signum))
-  if futureToRunner != None:
-    cancel(futureToRunner)
+  # Ignore repeated signals. Cancelling is not reentrant.
+  if _scheduler != None and not _scheduler.cancelled:
+    cancel(_scheduler)
 
-def cancel(futureToRunner):
+def cancel(scheduler):
   _logger.warning('Cancelling futures')
-  # Cancel all futures first. If we tried
+  # Stop dispatching and cancel all futures first. If we tried
   # to kill the runner at the same time then
   # other futures would start which we don't want
-  for future in futureToRunner.keys():
-    future.cancel()
+  scheduler.cancel()
   # Then we can kill the runners if required
-  for runner in futureToRunner.values():
-    runner.kill()
+  if cancelEvent != None:
+    # The runners live in worker processes which watch this event
+    cancelEvent.set()
+  else:
+    BatchWorker.cancel()
+
+def loadCompletedResults(paths):
+  """
+    Load the results from a previous (possibly interrupted) run.
+
+    paths: A list of (path, format) tuples where format is a stream
+           format or None for a report in the single list format.
+           Later files take precedence.
+
+    Returns a dictionary mapping program to result. Error reports
+    (e.g. from runners being cancelled) are not considered to be
+    completed results so they are not returned.
+  """
+  completed = {}
+  for path, formatName in paths:
+    if not os.path.exists(path):
+      continue
+    _logger.info('Loading previous results from "{}"'.format(path))
+    if formatName == None:
+      results = ResultSink.loadReport(path)
+    else:
+      results = ResultSink.load(path, formatName)
+    for r in results:
+      if not isinstance(r, dict) or not 'program' in r:
+        raise ResultSink.ResultSinkException('Unexpected result in "{}"'.format(path))
+      if 'error' in r:
+        completed.pop(r['program'], None)
+        continue
+      completed[r['program']] = r
+  return completed
+
+class ConfigBatch:
+  """
+    The state of running a single config over the program list.
+  """
+  def __init__(self, name, config, workDirsRoot, yamlOutputFile, streamOutputFile, repetition=None, rung=None):
+    self.name = name
+    self.config = config
+    self.repetition = repetition
+    self.rung = rung
+    self.workDirsRoot = workDirsRoot
+    self.yamlOutputFile = yamlOutputFile
+    self.streamOutputFile = streamOutputFile
+    self.completedResults = {}
+    # When streaming the results are written out as they arrive
+    # rather than being kept in ``report``.
+    self.sink = None
+    self.report = []
+    # Results written for duplicate programs that were not run
+    self.deduplicatedCount = 0
+    self.deduplicatedTime = 0.0
+    # Programs that were not started before the deadline
+    self.notRun = [ ]
+
+  def label(self, matrix):
+    """
+      Returns a string that identifies this batch amongst the others
+      or None if there is only one batch.
+    """
+    parts = [ ]
+    if matrix:
+      parts.append(self.name)
+    if self.repetition != None:
+      parts.append('repetition {}'.format(self.repetition))
+    if self.rung != None:
+      parts.append('rung {} (max_time {})'.format(self.rung, self.config['runner_config']['max_time']))
+    if len(parts) == 0:
+      return None
+    return ', '.join(parts)
+
+  def recordResult(self, result):
+    if self.sink != None:
+      self.sink.append(result)
+    else:
+      self.report.append(result)
+
+def notRunListPath(path):
+  """
+    Returns the path of the program list of the programs that were not
+    run before the deadline. E.g. ``out.yml`` becomes ``out-not-run.txt``.
+  """
+  root, _ = os.path.splitext(path)
+  return '{}-not-run.txt'.format(root)
+
+def matrixOutputPath(path, configName):
+  """
+    Returns the path of the output for config ``configName`` when
+    running a matrix. E.g. ``out.yml`` becomes ``out-boogie.yml``.
+  """
+  root, ext = os.path.splitext(path)
+  return '{}-{}{}'.format(root, configName, ext)
 
 def entryPoint(args):
-  global _logger, futureToRunner
+  global _logger, _scheduler, cancelEvent
   parser = argparse.ArgumentParser(description=__doc__)
   parser.add_argument("-l","--log-level",type=str, default="info", dest="log_level", choices=['debug','info','warning','error'])
   parser.add_argument("--rprefix", default=os.getcwd(), help="Prefix for relative paths for program_list")
-  parser.add_argument("--dry", action='store_true', help="Stop after initialising runners")
-  parser.add_argument("-j", "--jobs", type=int, default="1", help="Number of jobs to run in parallel (Default %(default)s)")
-  parser.add_argument("config_file", help="YAML configuration file")
+  parser.add_argument("--dry", action='store_true', help="Stop after initialising runners. Runners are initialised in parallel and then discarded")
+  parser.add_argument("-j", "--jobs", type=int, default="1", help="Number of jobs to run in parallel. A --portfolio job runs a tool for each config file and "
+                           "counts as that many jobs (Default %(default)s)")
+  parser.add_argument("--executor", default="thread", choices=['thread', 'process', 'async'],
+                      help="Supervise parallel jobs from threads in this process, from worker processes or from a single "
+                           "asyncio event loop in this process which requires the AsyncIO backend (Default %(default)s)")
+  parser.add_argument("--stream-output", dest="stream_output", default=None,
+                      help="Append each result to this file as soon as it is available. yaml_output is then produced from this file at the end of the run")
+  parser.add_argument("--stream-format", dest="stream_format", default="yaml", choices=ResultSink.formats(),
+                      help="Format of the file used by --stream-output (Default %(default)s)")
+  parser.add_argument("--resume", action='store_true',
+                      help="Resume an interrupted run. Programs that already have a result in yaml_output or the --stream-output file are skipped")
+  parser.add_argument("--history", action='append', default=[],
+                      help="Result YAML file from a previous run used to predict how long each program will take. "
+                           "Programs are then run in order of decreasing predicted run time. May be specified multiple times")
+  parser.add_argument("--history-default", dest="history_default", type=float, default=None,
+                      help="Predicted run time (in seconds) of programs that have no history. By default the median "
+                           "predicted run time of programs with history is used")
+  parser.add_argument("--memory-budget", dest="memory_budget", default=None,
+                      help="Total memory (in MiB) that running jobs may use. A job is only started when its max_memory fits "
+                           "inside the budget. Use \"auto\" to use the memory available when the batch starts. By default there is no budget")
+  parser.add_argument("--memory-overcommit", dest="memory_overcommit", action='store_true',
+                      help="When using --memory-budget, admit jobs based on the sampled memory usage of the running tools "
+                           "rather than the sum of their max_memory")
+  parser.add_argument("--cpu-slots", dest="cpu_slots", default=None,
+                      help="Pin each running job to its own CPU. Use \"physical\" for one slot per physical core "
+                           "(SMT siblings are left idle), \"logical\" for one slot per CPU or a CPU list (e.g. \"0-3,8\"). "
+                           "The slot used is recorded as cpu_slot in each result. By default jobs are not pinned")
+  parser.add_argument("--repeat", type=int, default=1,
+                      help="Run every program this many times. The runs are interleaved. The results of each repetition are "
+                           "written to their own file and combined (see analysis/merge_results.py) into yaml_output (Default %(default)s)")
+  parser.add_argument("--adaptive-min", dest="adaptive_min", type=int, default=2,
+                      help="When using adaptive repetition, the number of times every program is run before deciding "
+                           "if it needs to be run again (Default %(default)s)")
+  parser.add_argument("--adaptive-rel-stddev", dest="adaptive_rel_stddev", type=float, default=None,
+                      help="Enable adaptive repetition. A program is run again (up to --repeat times) whilst the standard "
+                           "deviation of its times relative to their mean is above this threshold")
+  parser.add_argument("--adaptive-ci-width", dest="adaptive_ci_width", type=float, default=None,
+                      help="Enable adaptive repetition. A program is run again (up to --repeat times) whilst the width of "
+                           "the 95%% confidence interval of its mean time relative to the mean is above this threshold")
+  parser.add_argument("--shard", default=None,
+                      help="Only run shard i of N (written \"i/N\", 0 <= i < N) of the program list. The split is deterministic "
+                           "so every shard can be run independently. Use stitch-shards.py to combine the outputs")
+  parser.add_argument("--shard-by", dest="shard_by", default="hash", choices=['hash', 'cost'],
+                      help="Split the program list by a stable hash of each program's path or into shards with a balanced "
+                           "predicted run time (requires --history) (Default %(default)s)")
+  parser.add_argument("--status-file", dest="status_file", default=None,
+                      help="Periodically write the progress of the run (jobs done, throughput, job times, result types and "
+                           "an ETA) as JSON to this file. The file is replaced atomically")
+  parser.add_argument("--status-interval", dest="status_interval", type=float, default=30.0,
+                      help="How often (in seconds) to write the --status-file (Default %(default)s)")
+  parser.add_argument("--ladder", default=None,
+                      help="Run with a timeout escalation ladder given as a comma separated list of increasing time limits "
+                           "in seconds (e.g. \"10,60,900\") which override max_time. Every program is run with the first limit "
+                           "and programs that time out are run again with the next limit")
+  parser.add_argument("--portfolio", action='store_true',
+                      help="Race the runners of all the config files on each program at the same time. As soon as one "
+                           "finds a bug or fully explores the program the others are killed. Requires several config files")
+  parser.add_argument("--cache", default=None,
+                      help="Directory of a result cache. Programs whose contents, runner, runner_config and tool are unchanged "
+                           "since a previous run that used the cache are not run again and their cached result is used instead")
+  parser.add_argument("--cache-max-size", dest="cache_max_size", type=float, default=0,
+                      help="Size (in MiB) to keep the --cache below by evicting the least recently used results. "
+                           "By default there is no limit")
+  parser.add_argument("--cache-timeouts", dest="cache_timeouts", action='store_true',
+                      help="Also cache results that timed out. By default they are always run again")
+  parser.add_argument("--dedup", action='store_true',
+                      help="Only run one of the programs in program_list that have identical contents. Its result is also "
+                           "written (with deduplicated_from set) for each of the other programs")
+  parser.add_argument("--daemon", default=None,
+                      help="Unix socket of a scheduling daemon (see boogie-schedd.py) shared with other batch runs on this "
+                           "machine. Jobs only start once the daemon grants them a slot. -j still limits the number of "
+                           "jobs this run has running at once")
+  parser.add_argument("--deadline", default=None,
+                      help="Finish the batch by this deadline, given as a duration (e.g. \"3600\", \"90m\", \"2h\") or a "
+                           "date and time (e.g. \"2016-04-05T09:00\"). Jobs expected (from --history) to give the most answers "
+                           "per second are run first, max_time is shrunk so jobs finish by the deadline and programs that were "
+                           "never started are listed as not run")
+  parser.add_argument("--deadline-min-time", dest="deadline_min_time", type=float, default=10.0,
+                      help="When using --deadline, do not start a job that would get less than this many seconds "
+                           "(or its max_time if that is less) (Default %(default)s)")
+  parser.add_argument("config_file", nargs='+',
+                      help="YAML configuration file. If several are given every config is run on every program. "
+                           "Working directories and outputs are then kept separately for each config (see README.md)")
   parser.add_argument("program_list", help="File containing list of Boogie programs")
   parser.add_argument("working_dirs_root", help="Directory to create working directories inside")
   parser.add_argument("yaml_output", help="path to write YAML output to")
@@ -61,11 +255,139 @@ def entryPoint(args):
     _logger.error('jobs must be <= 0')
     return 1
 
-  config = None
+  if pargs.repeat <= 0:
+    _logger.error('--repeat must be > 0')
+    return 1
+
+  if pargs.status_interval <= 0.0:
+    _logger.error('--status-interval must be > 0')
+    return 1
+
+  ladder = None
+  if pargs.ladder != None:
+    try:
+      ladder = Ladder.parse(pargs.ladder)
+    except Ladder.LadderException as e:
+      _logger.error(e.msg)
+      return 1
+    if pargs.repeat > 1:
+      _logger.error('--ladder cannot be used with --repeat')
+      return 1
+
+  if pargs.portfolio:
+    if len(pargs.config_file) < 2:
+      _logger.error('--portfolio requires at least two config files')
+      return 1
+    if pargs.repeat > 1 or pargs.ladder != None:
+      _logger.error('--portfolio cannot be used with --repeat or --ladder')
+      return 1
+    if pargs.cpu_slots != None or pargs.daemon != None:
+      # A single slot would be shared by every runner in the portfolio
+      _logger.error('--portfolio cannot be used with --cpu-slots or --daemon')
+      return 1
+    if pargs.deadline != None:
+      _logger.error('--portfolio cannot be used with --deadline')
+      return 1
+    if pargs.jobs < len(pargs.config_file):
+      # Otherwise the runners would not have a job slot each
+      _logger.error('--portfolio requires -j to be at least the number of config files ({})'.format(
+        len(pargs.config_file)))
+      return 1
+
+  deadline = None
+  if pargs.deadline != None:
+    try:
+      deadline = Deadline.parse(pargs.deadline)
+    except Deadline.DeadlineException as e:
+      _logger.error(e.msg)
+      return 1
+    if pargs.deadline_min_time < 0:
+      _logger.error('--deadline-min-time must be >= 0')
+      return 1
+    _logger.info('Deadline is {}'.format(datetime.datetime.fromtimestamp(deadline).isoformat(' ')))
+    if len(pargs.history) == 0:
+      _logger.warning('--deadline without --history cannot prefer the jobs most likely to give an answer')
+
+  if pargs.daemon != None and pargs.cpu_slots != None:
+    _logger.error('--cpu-slots cannot be used with --daemon. Give the daemon the CPU slots instead')
+    return 1
+
+  cache = None
+  if pargs.cache != None:
+    try:
+      cache = ResultCache.ResultCache(pargs.cache, pargs.cache_max_size, pargs.cache_timeouts)
+    except ResultCache.ResultCacheException as e:
+      _logger.error(e.msg)
+      return 1
+  elif pargs.cache_max_size != 0 or pargs.cache_timeouts:
+    _logger.error('--cache-max-size and --cache-timeouts require --cache')
+    return 1
+
+  shard = None
+  if pargs.shard != None:
+    try:
+      shard = Shard.parse(pargs.shard)
+    except Shard.ShardException as e:
+      _logger.error(e.msg)
+      return 1
+    if pargs.shard_by == 'cost' and len(pargs.history) == 0:
+      _logger.error('--shard-by=cost requires --history')
+      return 1
+
+  useAdaptive = pargs.adaptive_rel_stddev != None or pargs.adaptive_ci_width != None
+  if useAdaptive:
+    if pargs.adaptive_min < 2:
+      _logger.error('--adaptive-min must be >= 2')
+      return 1
+    if pargs.repeat < pargs.adaptive_min:
+      _logger.error('--repeat must be >= --adaptive-min when using adaptive repetition')
+      return 1
+    for threshold in [ pargs.adaptive_rel_stddev, pargs.adaptive_ci_width ]:
+      if threshold != None and threshold < 0.0:
+        _logger.error('Adaptive repetition thresholds must be >= 0')
+        return 1
+
+  if pargs.memory_budget != None and pargs.memory_budget != 'auto':
+    try:
+      int(pargs.memory_budget)
+    except ValueError:
+      _logger.error('--memory-budget must be an integer or "auto"')
+      return 1
+
+  if pargs.memory_overcommit and pargs.memory_budget == None:
+    _logger.error('--memory-overcommit requires --memory-budget')
+    return 1
+
+  cpuSlots = None
+  if pargs.cpu_slots != None:
+    try:
+      if pargs.cpu_slots == 'physical':
+        cpuSlots = BatchScheduler.physicalCoreSlots()
+      elif pargs.cpu_slots == 'logical':
+        cpuSlots = BatchScheduler.logicalCpuSlots()
+      else:
+        available = set(BatchScheduler.availableCpus())
+        cpuSlots = [ ]
+        for cpu in BatchScheduler.parseCpuList(pargs.cpu_slots):
+          if not cpu in available:
+            _logger.error('CPU {} is not available to this process'.format(cpu))
+            return 1
+          cpuSlots.append({ cpu })
+    except BatchScheduler.BatchSchedulerException as e:
+      _logger.error(e.msg)
+      return 1
+    _logger.info('Using {} CPU slots: {}'.format(len(cpuSlots),
+      ','.join([ str(min(slot)) for slot in cpuSlots ])))
+    if pargs.jobs > len(cpuSlots):
+      _logger.warning('At most {} jobs will run in parallel because there are {} CPU slots'.format(
+        len(cpuSlots), len(cpuSlots)))
+
+  configs = []
   programList = None
   try:
-    _logger.debug('Loading configuration from "{}"'.format(pargs.config_file))
-    config = ConfigLoader.load(pargs.config_file)
+    for configFile in pargs.config_file:
+      _logger.debug('Loading configuration from "{}"'.format(configFile))
+      configs.append(ConfigLoader.load(configFile))
     _logger.debug('Loading program_list from "{}"'.format(pargs.program_list))
     programList = ProgramListLoader.load(pargs.program_list, pargs.rprefix)
   except (ProgramListLoader.ProgramListLoaderException, ConfigLoader.ConfigLoaderException) as e:
@@ -78,14 +400,155 @@ def entryPoint(args):
     logging.error('program_list cannot be empty')
     return 1
 
+  programToHistory = None
+  if len(pargs.history) > 0:
+    try:
+      programToHistory = History.load(pargs.history)
+    except History.HistoryException as e:
+      _logger.error(e.msg)
+      _logger.debug(traceback.format_exc())
+      return 1
+
+  if shard != None:
+    shardIndex, shardCount = shard
+    if pargs.shard_by == 'cost':
+      # Use the total predicted time over all the configs
+      estimates = { p: 0.0 for p in programList }
+      for config in configs:
+        for p, estimate in History.estimateTimes(programList, programToHistory,
+            config['runner_config'].get('max_time', 0), pargs.history_default).items():
+          estimates[p] += estimate
+      programList = Shard.byCost(programList, estimates, shardIndex, shardCount)
+    else:
+      programList = Shard.byHash(programList, shardIndex, shardCount)
+    _logger.info('Running shard {}/{} which has {} programs'.format(shardIndex, shardCount, len(programList)))
+
+  # Map each duplicate program to the program with the same contents
+  # that is run in its place and vice versa.
+  duplicateOf = { }
+  duplicates = { }
+  if pargs.dedup:
+    try:
+      for program, others in ProgramListLoader.groupByContents(programList).items():
+        if len(others) > 0:
+          duplicates[program] = others
+          for other in others:
+            duplicateOf[other] = program
+    except ProgramListLoader.ProgramListLoaderException as e:
+      _logger.error(e.msg)
+      return 1
+    _logger.info('Found {} programs with the same contents as another program. They will not be run'.format(
+      len(duplicateOf)))
+
   yamlOutputFile = os.path.abspath(pargs.yaml_output)
+  streamOutputFile = None
+  if pargs.stream_output != None:
+    streamOutputFile = os.path.abspath(pargs.stream_output)
+  workDirsRoot = os.path.abspath(pargs.working_dirs_root)
 
-  if os.path.exists(yamlOutputFile):
-    _logger.error('yaml_output file ("{}") already exists'.format(yamlOutputFile))
-    return 1
+  # When running a matrix of configs each config has its own working
+  # directories and output files which are named after the config file.
+  # When repeating each repetition of a config also has its own working
+  # directories and output files. The combined results of the repetitions
+  # are written to the config's output file. When running a portfolio each
+  # config has its own working directories but there is a single output.
+  matrix = len(configs) > 1 and not pargs.portfolio
+  batches = []
+  combinedOutputs = [] # (name, config, path) tuples
+  portfolioMembers = [] # (name, config, workDirsRoot) tuples
+  configNames = [ ]
+  for configFile, config in zip(pargs.config_file, configs):
+    name = os.path.splitext(os.path.basename(configFile))[0]
+    if name in configNames:
+      _logger.error('Config files must have different names but "{}" is used more than once'.format(name))
+      return 1
+    configNames.append(name)
+    if pargs.portfolio:
+      portfolioMembers.append((name, config, os.path.join(workDirsRoot, name)))
+      continue
+    if matrix:
+      configWorkDirsRoot = os.path.join(workDirsRoot, name)
+      configOutputFile = matrixOutputPath(yamlOutputFile, name)
+      configStreamOutputFile = matrixOutputPath(streamOutputFile, name) if streamOutputFile != None else None
+    else:
+      configWorkDirsRoot = workDirsRoot
+      configOutputFile = yamlOutputFile
+      configStreamOutputFile = streamOutputFile
+    combinedOutputs.append((name, config, configOutputFile))
+
+    if ladder != None:
+      if os.path.exists(configOutputFile) and not pargs.resume:
+        _logger.error('yaml_output file ("{}") already exists'.format(configOutputFile))
+        return 1
+      for rung, maxTime in enumerate(ladder):
+        rungConfig = config.copy()
+        rungConfig['runner_config'] = config['runner_config'].copy()
+        rungConfig['runner_config']['max_time'] = maxTime
+        batches.append(ConfigBatch(name, rungConfig,
+          os.path.join(configWorkDirsRoot, 'rung-{}'.format(rung)),
+          Ladder.rungOutputPath(configOutputFile, rung),
+          Ladder.rungOutputPath(configStreamOutputFile, rung) if configStreamOutputFile != None else None,
+          rung=rung))
+      continue
+
+    if pargs.repeat == 1:
+      batches.append(ConfigBatch(name, config, configWorkDirsRoot, configOutputFile, configStreamOutputFile))
+      continue
+
+    if config['runner_config'].get('max_time', 0) <= 0:
+      _logger.error('"max_time" must be set to use --repeat')
+      return 1
+    if os.path.exists(configOutputFile) and not pargs.resume:
+      _logger.error('yaml_output file ("{}") already exists'.format(configOutputFile))
+      return 1
+    for repetition in range(0, pargs.repeat):
+      batches.append(ConfigBatch(name, config,
+        os.path.join(configWorkDirsRoot, 'rep-{}'.format(repetition)),
+        Repetition.repetitionOutputPath(configOutputFile, repetition),
+        Repetition.repetitionOutputPath(configStreamOutputFile, repetition) if configStreamOutputFile != None else None,
+        repetition))
+
+  if pargs.portfolio:
+    maxTimes = [ config['runner_config'].get('max_time', 0) for _, config, _ in portfolioMembers ]
+    portfolioConfig = { 'runner': 'portfolio of {}'.format(', '.join(configNames)),
+                        'runner_config': { 'max_time': 0 if min(maxTimes) <= 0 else max(maxTimes) } }
+    combinedOutputs.append(('portfolio', portfolioConfig, yamlOutputFile))
+    batches.append(ConfigBatch('portfolio', portfolioConfig, workDirsRoot, yamlOutputFile, streamOutputFile))
+
+  for batch in batches:
+    if os.path.exists(batch.yamlOutputFile) and not pargs.resume:
+      _logger.error('yaml_output file ("{}") already exists'.format(batch.yamlOutputFile))
+      return 1
+
+    if batch.streamOutputFile != None:
+      if os.path.exists(batch.streamOutputFile) and not pargs.resume:
+        _logger.error('stream_output file ("{}") already exists'.format(batch.streamOutputFile))
+        return 1
+      if batch.streamOutputFile == batch.yamlOutputFile:
+        _logger.error('stream_output and yaml_output cannot be the same file')
+        return 1
+
+    # Load results from the run we are resuming
+    if pargs.resume:
+      try:
+        batch.completedResults = loadCompletedResults([(batch.yamlOutputFile, None),
+          (batch.streamOutputFile, pargs.stream_format)] if batch.streamOutputFile != None else [(batch.yamlOutputFile, None)])
+      except (ResultSink.ResultSinkException, yaml.YAMLError) as e:
+        _logger.error('Failed to load previous results')
+        _logger.error(e)
+        _logger.debug(traceback.format_exc())
+        return 1
+      unknownPrograms = set(batch.completedResults.keys()).difference(set(programList))
+      if len(unknownPrograms) > 0:
+        _logger.error('Previous results contain programs not in program_list:\n{}'.format(
+          '\n'.join(sorted(unknownPrograms))))
+        return 1
+      label = batch.label(matrix)
+      _logger.info('Found {} completed results, {} programs left to run{}'.format(
+        len(batch.completedResults), len(programList) - len(batch.completedResults),
+        ' for {}'.format(label) if label != None else ''))
 
   # Setup the directory to hold working directories
-  workDirsRoot = os.path.abspath(pargs.working_dirs_root)
   if os.path.exists(workDirsRoot):
     # Check its a directory and its empty
     if not os.path.isdir(workDirsRoot):
@@ -93,7 +556,7 @@ def entryPoint(args):
       return 1
 
     workDirsRootContents = next(os.walk(workDirsRoot, topdown=True))
-    if len(workDirsRootContents[1]) > 0 or len(workDirsRootContents[2]) > 0:
+    if (len(workDirsRootContents[1]) > 0 or len(workDirsRootContents[2]) > 0) and not pargs.resume:
       _logger.error('"{}" is not empty ({},{})'.format(workDirsRoot,
         workDirsRootContents[1], workDirsRootContents[2]))
       return 1
@@ -107,126 +570,469 @@ def entryPoint(args):
       _logger.debug(traceback.format_exc())
       return 1
 
-  # Get Runner class to use
-  RunnerClass = RunnerFactory.getRunnerClass(config['runner'])
+  for config in configs:
+    # Get Runner class to use
+    RunnerClass = RunnerFactory.getRunnerClass(config['runner'])
 
-  if not 'runner_config' in config:
-    _logger.error('"runner_config" missing from config')
-    return 1
+    if not 'runner_config' in config:
+      _logger.error('"runner_config" missing from config')
+      return 1
 
-  if not isinstance(config['runner_config'],dict):
-    _logger.error('"runner_config" should map to a dictionary')
-    return 1
+    if not isinstance(config['runner_config'],dict):
+      _logger.error('"runner_config" should map to a dictionary')
+      return 1
+
+    if pargs.executor == 'async':
+      backend = config['runner_config'].get('backend', {})
+      if not isinstance(backend, dict) or backend.get('name', None) != 'AsyncIO':
+        _logger.error('--executor=async requires every config to use the "AsyncIO" backend')
+        return 1
 
-  rc = config['runner_config']
+  for root in [ batch.workDirsRoot for batch in batches ] + [ m[2] for m in portfolioMembers ]:
+    if root != workDirsRoot:
+      os.makedirs(root, exist_ok=True)
 
-  # Create the runners
-  runners = []
+  # Work out the jobs to run. The runners themselves (and their working
+  # directories) are created just in time by the worker that runs them.
+  # When running a matrix or repeating the batches are interleaved so
+  # that every batch makes progress through the program list at the same
+  # rate.
+  def makeJob(batch, index, program):
+    workDir = os.path.join(batch.workDirsRoot, 'workdir-{}'.format(index))
+    assert pargs.resume or not os.path.exists(workDir)
+    # Pass in a copy of rc so that if a runner accidently modifies
+    # a config it won't affect other runners.
+    rc = batch.config['runner_config']
+    job = BatchScheduler.Job(program, workDir, rc.copy(), context=batch)
+    if batch.rung != None:
+      job.tags['ladder_rung'] = batch.rung
+      job.tags['ladder_max_time'] = rc['max_time']
+    return job
+
+  def makePortfolioJob(batch, index, program):
+    members = [ (name, config['runner'], os.path.join(root, 'workdir-{}'.format(index)), config['runner_config'].copy())
+                for name, config, root in portfolioMembers ]
+    return BatchScheduler.PortfolioJob(program, members, context=batch)
+
+  # With adaptive repetition only the first ``--adaptive-min`` repetitions
+  # are scheduled up front. Each later repetition of a program is only
+  # scheduled once all its earlier repetitions have finished and their
+  # times vary too much.
+  adaptive = { } # Config name to AdaptiveRepetition
+  if useAdaptive:
+    for name, config, _ in combinedOutputs:
+      adaptive[name] = Repetition.AdaptiveRepetition(config['runner_config']['max_time'],
+        pargs.adaptive_min, pargs.repeat, pargs.adaptive_rel_stddev, pargs.adaptive_ci_width)
+  repetitionBatches = { } # (name, repetition) to batch
+  rungBatches = { } # (name, rung) to batch
+  for batch in batches:
+    repetitionBatches[(batch.name, batch.repetition)] = batch
+    rungBatches[(batch.name, batch.rung)] = batch
+  repetitionResults = { } # (name, program) to list of results
+  repetitionsPending = collections.Counter() # (name, program) to number of unfinished jobs
+  nextRepetition = { } # (name, program) to the repetition to schedule next
+  programIndex = { program: index for index, program in enumerate(programList) }
+
+  status = None
+  jobs = []
   for index, program in enumerate(programList):
-    _logger.info('Creating runner {} out of {} ({:.1f}%)'.format(index +1, len(programList), 100*float(index +1)/len(programList)))
-    # Create working directory for this runner
-    workDir = os.path.join(workDirsRoot, 'workdir-{}'.format(index))
-    assert not os.path.exists(workDir)
+    if program in duplicateOf:
+      continue
+    for batch in batches:
+      if pargs.portfolio:
+        if program in batch.completedResults:
+          _logger.debug('Skipping "{}" which already has a result'.format(program))
+        else:
+          jobs.append(makePortfolioJob(batch, index, program))
+        continue
+      workDir = os.path.join(batch.workDirsRoot, 'workdir-{}'.format(index))
+      key = (batch.name, program)
+      if program in batch.completedResults:
+        if (not batch.completedResults[program].get('cache_hit', False) and
+            not 'deduplicated_from' in batch.completedResults[program] and
+            batch.completedResults[program]['working_directory'] != workDir):
+          _logger.error('Previous result for "{}" used working directory "{}" but expected "{}". Has program_list changed?'.format(
+            program, batch.completedResults[program]['working_directory'], workDir))
+          return 1
+        _logger.debug('Skipping "{}" which already has a result'.format(program))
+        if useAdaptive:
+          repetitionResults.setdefault(key, []).append(batch.completedResults[program])
+          nextRepetition[key] = max(nextRepetition.get(key, pargs.adaptive_min), batch.repetition +1)
+        continue
+      if ladder != None and batch.rung > 0:
+        # Only climb the ladder if the previous rung timed out
+        previous = rungBatches[(batch.name, batch.rung -1)].completedResults.get(program, None)
+        if not Ladder.timedOut(previous):
+          continue
+      if useAdaptive:
+        if batch.repetition >= pargs.adaptive_min:
+          continue
+        repetitionsPending[key] += 1
+      jobs.append(makeJob(batch, index, program))
+
+  def scheduleRepetition(key, addJob):
+    """
+      Schedule the next repetition of a program if it needs one.
+    """
+    name, program = key
+    repetition = nextRepetition.setdefault(key, pargs.adaptive_min)
+    results = repetitionResults.pop(key, [])
+    if repetition >= pargs.repeat or not adaptive[name].needsRerun(results):
+      _logger.debug('Not repeating "{}" after {} repetitions'.format(program, len(results)))
+      return
+    repetitionResults[key] = results
+    nextRepetition[key] = repetition +1
+    repetitionsPending[key] += 1
+    job = makeJob(repetitionBatches[(name, repetition)], programIndex[program], program)
+    jobs.append(job)
+    addJob(job)
+    if status != None:
+      status.addJobs(1)
+
+  if useAdaptive:
+    # Programs whose scheduled repetitions all finished in the run we
+    # are resuming.
+    for program in programList:
+      if program in duplicateOf:
+        continue
+      for name in adaptive.keys():
+        if repetitionsPending[(name, program)] == 0:
+          scheduleRepetition((name, program), lambda job: None)
+
+  if programToHistory != None:
+    # Run the jobs expected to take longest first so that long jobs
+    # don't end up running on their own at the end of the batch.
+    estimates = { }
+    for name, config, _ in combinedOutputs:
+      estimates[name] = History.estimateTimes(list(set([ job.program for job in jobs if job.context.name == name ])),
+        programToHistory, config['runner_config'].get('max_time', 0), pargs.history_default)
+    jobs.sort(key=lambda job: estimates[job.context.name][job.program], reverse=True)
+    _logger.info('Scheduling longest expected jobs first. Total expected job time {:.1f} seconds'.format(
+      sum([ estimates[job.context.name][job.program] for job in jobs ])))
+
+  if pargs.repeat > 1:
+    # Spread the repetitions of each program over the run so they don't
+    # run at the same time and drift in the performance of the host
+    # affects every repetition in a similar way.
+    jobs[:] = Repetition.interleave(jobs, lambda job: (job.context.name, job.program),
+      lambda job: job.context.repetition, pargs.repeat, pargs.jobs)
+
+  scheduler = BatchScheduler.BatchScheduler(pargs.jobs)
+  for job in jobs:
+    scheduler.addJob(job)
 
+  if pargs.memory_budget != None:
+    if pargs.memory_budget == 'auto':
+      memoryBudget = BatchScheduler.detectMemoryBudgetInMiB()
+      _logger.info('Detected memory budget of {} MiB'.format(memoryBudget))
+    else:
+      memoryBudget = int(pargs.memory_budget)
+    if memoryBudget <= 0:
+      _logger.error('Memory budget must be > 0')
+      return 1
+    memoryPolicy = BatchScheduler.MemoryBudgetPolicy(memoryBudget, sampleUsage=pargs.memory_overcommit)
     try:
-      os.mkdir(workDir)
-    except Exception as e:
-      _logger.error('Failed to create working directory "{}"'.format(workDir))
-      _logger.error(e)
-      _logger.debug(traceback.format_exc())
+      for job in jobs:
+        memoryPolicy.check(job)
+    except BatchScheduler.BatchSchedulerException as e:
+      _logger.error(e.msg)
       return 1
+    scheduler.addPolicy(memoryPolicy)
 
-    # Pass in a copy of rc so that if a runner accidently modifies
-    # a config it won't affect other runners.
-    runners.append(RunnerClass(program, workDir, rc.copy()))
+  if cpuSlots != None:
+    scheduler.addPolicy(BatchScheduler.CpuSlotPolicy(cpuSlots))
+
+  if deadline != None and not pargs.dry:
+    deadlinePolicy = Deadline.DeadlinePolicy(deadline,
+      Deadline.ValueModel(programToHistory if programToHistory != None else { }), pargs.deadline_min_time)
+    scheduler.setPicker(deadlinePolicy.pick)
+    scheduler.addPolicy(deadlinePolicy)
+
+  daemonPolicy = None
+  if pargs.daemon != None and not pargs.dry:
+    try:
+      daemonPolicy = SchedulerDaemon.DaemonPolicy(SchedulerDaemon.Client(pargs.daemon), pargs.jobs)
+      for job in jobs:
+        daemonPolicy.check(job)
+    except (SchedulerDaemon.SchedulerDaemonException, BatchScheduler.BatchSchedulerException) as e:
+      _logger.error(e.msg)
+      return 1
+    _logger.info('Using scheduling daemon at {} ({} slots)'.format(pargs.daemon, daemonPolicy.client.slots))
+    scheduler.addPolicy(daemonPolicy)
 
   # Run the runners and build the report
-  report = []
   exitCode = 0
 
-  if pargs.dry:
-    _logger.info('Not running runners')
-    return exitCode
+  for batch in batches:
+    if batch.streamOutputFile != None and not pargs.dry:
+      _logger.info('Streaming results to {}'.format(batch.streamOutputFile))
+      if pargs.resume:
+        # Carry over the results of the run we are resuming. This drops
+        # error reports from the previous run because those programs will
+        # be rerun.
+        ResultSink.rewrite(batch.streamOutputFile, pargs.stream_format,
+          [ batch.completedResults[p] for p in programList if p in batch.completedResults ])
+      batch.sink = ResultSink.getSinkClass(pargs.stream_format)(batch.streamOutputFile)
+    else:
+      # Carry over the results of the run we are resuming
+      for program in programList:
+        if program in batch.completedResults:
+          batch.recordResult(batch.completedResults[program])
+
+  def fanOut(batch, result):
+    """
+      Record ``result`` for the duplicates of the program it is for.
+    """
+    for duplicate in duplicates.get(result['program'], [ ]):
+      if duplicate in batch.completedResults:
+        continue
+      copy = result.copy()
+      copy['program'] = duplicate
+      copy['deduplicated_from'] = result['program']
+      batch.recordResult(copy)
+      batch.deduplicatedCount += 1
+      if isinstance(result.get('total_time', None), (int, float)):
+        batch.deduplicatedTime += result['total_time']
+
+  if not pargs.dry:
+    # Programs that finished in the run we are resuming before the
+    # results for their duplicates were written.
+    for batch in batches:
+      for program in duplicates.keys():
+        if program in batch.completedResults:
+          fanOut(batch, batch.completedResults[program])
+
+  def jobName(job):
+    label = job.context.label(matrix)
+    if label != None:
+      return '{} ({})'.format(job.program, label)
+    return job.program
+
+  def handleResult(job, result):
+    nonlocal exitCode
+    if pargs.dry:
+      # Only set up errors are reported
+      if result != None:
+        _logger.error('{} runner could not be set up:\n{}'.format(jobName(job), result['error']))
+        exitCode = 1
+      return
+
+    if 'error' in result:
+      _logger.error('{} runner hit exception:\n{}'.format(jobName(job), result['error']))
+      exitCode = 1
+    job.context.recordResult(result)
+    fanOut(job.context, result)
+    if job in cacheKeys and not result.get('cache_hit', False) and not scheduler.cancelled:
+      cache.put(cacheKeys.pop(job), result, ignoreKeys=job.tags.keys())
+    repetitionFinished(job, result)
+    climbLadder(job, result)
+
+  def repetitionFinished(job, result):
+    if not useAdaptive:
+      return
+    key = (job.context.name, job.program)
+    repetitionResults.setdefault(key, []).append(result)
+    repetitionsPending[key] -= 1
+    if repetitionsPending[key] == 0 and not scheduler.cancelled:
+      scheduleRepetition(key, scheduler.addJob)
+
+  def climbLadder(job, result):
+    if ladder == None or scheduler.cancelled:
+      return
+    rung = job.context.rung
+    if rung +1 >= len(ladder) or not Ladder.timedOut(result):
+      return
+    _logger.info('{} timed out. Rerunning with max_time {}'.format(jobName(job), ladder[rung +1]))
+    nextJob = makeJob(rungBatches[(job.context.name, rung +1)], programIndex[job.program], job.program)
+    jobs.append(nextJob)
+    scheduler.addJob(nextJob)
+    if status != None:
+      status.addJobs(1)
+
+  cacheKeys = { } # Job to cache key
+  def lookupCache(job):
+    """
+      Returns a future holding the cached result of ``job`` or None if
+      it has to be run.
+    """
+    try:
+      key = cache.key(job.context.config['runner'], job.program, job.rc)
+    except OSError as e:
+      _logger.warning('Not using result cache for {}: {}'.format(jobName(job), e))
+      return None
+    except ResultCache.ResultCacheException as e:
+      _logger.warning('Not using result cache for {}: {}'.format(jobName(job), e.msg))
+      return None
+    result = cache.get(key, job.program)
+    if result == None:
+      cacheKeys[job] = key
+      return None
+    _logger.debug('Using cached result for {}'.format(jobName(job)))
+    result.update({ k: v for k, v in job.tags.items() if not k in _runPlacementTags })
+    future = concurrent.futures.Future()
+    future.set_result(result)
+    return future
+
+  def submitJob(job):
+    if status != None:
+      status.jobStarted(job)
+    if cache != None and not pargs.dry and not isinstance(job, BatchScheduler.PortfolioJob):
+      future = lookupCache(job)
+      if future != None:
+        return future
+    # When resuming the working directory of an incomplete job is removed.
+    if isinstance(job, BatchScheduler.PortfolioJob):
+      return executor.submit(BatchWorker.runPortfolio, job.members, job.program, clean=pargs.resume, dry=pargs.dry)
+    return executor.submit(BatchWorker.runJob, job.context.config['runner'], job.program, job.workDir, job.rc,
+                           clean=pargs.resume, dry=pargs.dry, cpus=job.cpus, tags=dict(job.tags))
 
   startTime = datetime.datetime.now()
   _logger.info('Starting {}'.format(startTime.isoformat(' ')))
 
-  if pargs.jobs == 1:
-    _logger.info('Running jobs sequentially')
-    for r in runners:
-      try:
-        r.run()
-        report.append(r.getResults())
-      except KeyboardInterrupt:
-        _logger.error('Keyboard interrupt')
-        # This is slightly redundant because the runner
-        # currently kills itself if KeyboardInterrupt is thrown
-        r.kill()
-        break
-      except:
-        _logger.error("Error handling:{}".format(r.program))
-        _logger.error(traceback.format_exc())
-
-        # Attempt to add the error to the report
-        errorLog = {}
-        errorLog['program'] = r.program
-        errorLog['error'] = traceback.format_exc()
-        report.append(errorLog)
-        exitCode = 1
+  if pargs.status_file != None and not pargs.dry:
+    _logger.info('Writing status to {} every {} seconds'.format(pargs.status_file, pargs.status_interval))
+    status = BatchStatus.BatchStatus(os.path.abspath(pargs.status_file), len(jobs), pargs.jobs,
+      max([ batch.config['runner_config'].get('max_time', 0) for batch in batches ]), pargs.status_interval)
+    status.start()
+
+  # FIXME: Make windows compatible
+  # Catch signals so we can clean up
+  signal.signal(signal.SIGINT, handleInterrupt)
+  signal.signal(signal.SIGTERM, handleInterrupt)
+
+  completedFutureCounter=0
+  if pargs.executor == 'process':
+    _logger.info('Running jobs using {} worker processes'.format(pargs.jobs))
+    # Each job is its own task rather than grouping jobs per worker. The
+    # workers are long lived so a task only costs pickling the job and its
+    # result, which is small next to running a tool. A future per job is
+    # what lets the scheduler admit, cancel and record jobs one at a time
+    # (memory budget, CPU slots, deadline, streamed results) and a worker
+    # only ever supervises one tool so its supervision never competes
+    # for the GIL.
+    cancelEvent = multiprocessing.Event()
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=pargs.jobs,
+      initializer=BatchWorker.initWorker,
+      initargs=(cancelEvent, logLevel, logFormat))
+  elif pargs.executor == 'async':
+    _logger.info('Running jobs from an event loop')
+    executor = BatchWorker.AsyncJobExecutor(pargs.jobs)
   else:
+    _logger.info('Running jobs using {} threads'.format(pargs.jobs))
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=pargs.jobs)
+  try:
+    with executor:
+      _scheduler = scheduler
+      for job, future in scheduler.run(submitJob):
+        program = job.program
+        if future.cancelled() and scheduler.stopped and not scheduler.cancelled:
+          # Never started because of the deadline. This isn't a failure.
+          job.context.notRun.append(program)
+          job.context.notRun.extend(duplicates.get(program, [ ]))
+          if status != None:
+            status.jobNotRun(job)
+          continue
+        _logger.debug('{} runner finished'.format(jobName(job)))
 
-    # FIXME: Make windows compatible
-    # Catch signals so we can clean up
-    signal.signal(signal.SIGINT, handleInterrupt)
-    signal.signal(signal.SIGTERM, handleInterrupt)
+        if future.done() and not future.cancelled():
+          completedFutureCounter += 1
+          _logger.info('Completed {}/{} ({:.1f}%)'.format(completedFutureCounter, len(jobs), 100*(float(completedFutureCounter)/len(jobs))))
 
-    _logger.info('Running jobs in parallel')
-    completedFutureCounter=0
-    import concurrent.futures
-    try:
-      with concurrent.futures.ThreadPoolExecutor(max_workers=pargs.jobs) as executor:
-        futureToRunner = { executor.submit(r.run) : r for r in runners }
-        for future in concurrent.futures.as_completed(futureToRunner):
-          r = futureToRunner[future]
-          _logger.debug('{} runner finished'.format(r.programPathArgument))
-
-          if future.done() and not future.cancelled():
-            completedFutureCounter += 1
-            _logger.info('Completed {}/{} ({:.1f}%)'.format(completedFutureCounter, len(runners), 100*(float(completedFutureCounter)/len(runners))))
-
-          excep = None
-          try:
-            if future.exception():
-              excep = future.exception()
-          except concurrent.futures.CancelledError as e:
-            excep = e
-
-          if excep != None:
-            # Attempt to log the error report
-            errorLog = {}
-            errorLog['program'] = r.program
-            errorLog['error'] = "\n".join(traceback.format_exception(type(excep), excep, None))
-            # Only emit messages about exceptions that aren't to do with cancellation
-            if not isinstance(excep, concurrent.futures.CancelledError):
-              _logger.error('{} runner hit exception:\n{}'.format(r.programPathArgument, errorLog['error']))
-            report.append(errorLog)
-          else:
-            report.append(r.getResults())
-    except KeyboardInterrupt:
-      # The executor should of been cleaned terminated.
-      # We'll then write what we can to the output YAML file
-      _logger.error('Keyboard interrupt')
-    finally:
-      # Stop catching signals and just use default handlers
-      signal.signal(signal.SIGINT, signal.SIG_DFL)
-      signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        excep = None
+        try:
+          if future.exception():
+            excep = future.exception()
+        except concurrent.futures.CancelledError as e:
+          excep = e
+
+        if excep != None:
+          # Attempt to log the error report
+          errorLog = {}
+          errorLog['program'] = program
+          errorLog['error'] = "\n".join(traceback.format_exception(type(excep), excep, None))
+          # Only emit messages about exceptions that aren't to do with cancellation
+          if not isinstance(excep, concurrent.futures.CancelledError):
+            _logger.error('{} runner hit exception:\n{}'.format(jobName(job), errorLog['error']))
+          if not pargs.dry:
+            job.context.recordResult(errorLog)
+            fanOut(job.context, errorLog)
+            repetitionFinished(job, errorLog)
+          result = errorLog
+        else:
+          result = future.result()
+          handleResult(job, result)
+        if status != None:
+          status.jobFinished(job, result)
+  except KeyboardInterrupt:
+    # The executor should of been cleaned terminated.
+    # We'll then write what we can to the output YAML file
+    _logger.error('Keyboard interrupt')
+  finally:
+    _scheduler = None
+    if status != None:
+      status.stop()
+    if daemonPolicy != None:
+      # Releases any slots the daemon granted us
+      daemonPolicy.close()
+    # Stop catching signals and just use default handlers
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+  if pargs.dry:
+    _logger.info('Not running runners')
+    return exitCode
 
   # Write result to YAML file
-  _logger.info('Writing output to {}'.format(yamlOutputFile))
-  result = yaml.dump(report, default_flow_style=False)
-  with open(yamlOutputFile, 'w') as f:
-    f.write('# BoogieRunner report using runner {}\n'.format(config['runner']))
-    f.write(result)
+  for batch in batches:
+    _logger.info('Writing output to {}'.format(batch.yamlOutputFile))
+    header = 'BoogieRunner report using runner {}'.format(batch.config['runner'])
+    if pargs.dedup:
+      summary = '{} duplicate programs were not run saving {:.1f} seconds'.format(
+        batch.deduplicatedCount, batch.deduplicatedTime)
+      _logger.info('{}{}'.format(summary, ' for {}'.format(batch.label(matrix)) if batch.label(matrix) != None else ''))
+      header += '\n# ' + summary
+    if deadline != None:
+      notRunFile = notRunListPath(batch.yamlOutputFile)
+      summary = '{} programs were not run before the deadline'.format(len(batch.notRun))
+      _logger.info('{}{}. Writing them to {}'.format(summary,
+        ' for {}'.format(batch.label(matrix)) if batch.label(matrix) != None else '', notRunFile))
+      header += '\n# ' + summary
+      with open(notRunFile, 'w') as f:
+        for program in sorted(batch.notRun, key=lambda p: programIndex[p]):
+          f.write(program + '\n')
+    if batch.sink != None:
+      batch.sink.close()
+      ResultSink.finalise(batch.streamOutputFile, pargs.stream_format, batch.yamlOutputFile, header)
+    else:
+      result = yaml.dump(batch.report, default_flow_style=False)
+      with open(batch.yamlOutputFile, 'w') as f:
+        f.write('# {}\n'.format(header))
+        f.write(result)
+
+  if pargs.repeat > 1:
+    for name, config, outputFile in combinedOutputs:
+      _logger.info('Writing combined output to {}'.format(outputFile))
+      combined = Repetition.combineReports([ b.yamlOutputFile for b in batches if b.name == name ],
+        config['runner_config']['max_time'])
+      for r in combined:
+        if 'error' in r:
+          _logger.error('Failed to combine results for {}:\n{}'.format(r['program'], r['error']))
+          exitCode = 1
+      with open(outputFile, 'w') as f:
+        f.write('# BoogieRunner report using runner {} combined from {} repetitions\n'.format(config['runner'], pargs.repeat))
+        f.write(yaml.dump(combined, default_flow_style=False))
+
+  if ladder != None:
+    for name, config, outputFile in combinedOutputs:
+      _logger.info('Writing final rung results to {}'.format(outputFile))
+      final = Ladder.combineReports([ b.yamlOutputFile for b in batches if b.name == name ])
+      with open(outputFile, 'w') as f:
+        f.write('# BoogieRunner report using runner {} with timeout ladder {}\n'.format(config['runner'],
+          ','.join([ str(t) for t in ladder ])))
+        f.write(yaml.dump(final, default_flow_style=False))
+
+  if cache != None:
+    _logger.info('Result cache: {} hits, {} misses'.format(cache.hits, cache.misses))
 
   endTime = datetime.datetime.now()
   _logger.info('Finished {}'.format(endTime.isoformat(' ')))
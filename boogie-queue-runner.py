@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+    Script to run a Boogie tool over a set of boogie programs using
+    workers on multiple hosts that share a work queue directory.
+"""
+import argparse
+import concurrent.futures
+import datetime
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+import traceback
+import yaml
+from  BoogieRunner import ProgramListLoader
+from  BoogieRunner import ConfigLoader
+from  BoogieRunner import BatchWorker
+from  BoogieRunner import WorkQueue
+
+_logger = None
+_cancelled = False
+_running = None
+_abandoned = None
+cancelEvent = None
+
+def handleInterrupt(signum, frame):
+  global _cancelled
+  logging.info('Received signal {}'.format(signum))
+  # Ignore repeated signals. Cancelling is not reentrant.
+  if _cancelled:
+    return
+  _cancelled = True
+  _logger.warning('Cancelling futures')
+  for future in list(_running.keys()) + list(_abandoned):
+    future.cancel()
+  if cancelEvent != None:
+    cancelEvent.set()
+  else:
+    BatchWorker.cancel()
+
+def create(pargs):
+  try:
+    config = ConfigLoader.load(pargs.config_file)
+    programList = ProgramListLoader.load(pargs.program_list, pargs.rprefix)
+  except (ProgramListLoader.ProgramListLoaderException, ConfigLoader.ConfigLoaderException) as e:
+    _logger.error(e)
+    _logger.debug(traceback.format_exc())
+    return 1
+
+  if len(programList) < 1:
+    _logger.error('program_list cannot be empty')
+    return 1
+
+  if pargs.lease_time <= 0:
+    _logger.error('--lease-time must be > 0')
+    return 1
+
+  workDirsRoot = os.path.abspath(pargs.working_dirs_root)
+  if os.path.exists(workDirsRoot):
+    if not os.path.isdir(workDirsRoot) or len(os.listdir(workDirsRoot)) > 0:
+      _logger.error('"{}" exists and is not an empty directory'.format(workDirsRoot))
+      return 1
+  else:
+    os.mkdir(workDirsRoot)
+
+  try:
+    queue = WorkQueue.WorkQueue.create(pargs.queue_dir, config, programList, workDirsRoot, pargs.lease_time)
+  except WorkQueue.WorkQueueException as e:
+    _logger.error(e.msg)
+    return 1
+  _logger.info('Created work queue "{}" with {} programs'.format(queue.root, len(programList)))
+  return 0
+
+def work(pargs, queue, logLevel, logFormat):
+  global _running, _abandoned, cancelEvent
+  if pargs.jobs <= 0:
+    _logger.error('jobs must be > 0')
+    return 1
+
+  runnerName = queue.config['runner']
+  rc = queue.config['runner_config']
+  # Renew claims well before they expire
+  renewPeriod = queue.leaseTime / 4.0
+  exitCode = 0
+  completedCounter = 0
+  _running = { } # Future to claim
+  # Futures of jobs whose claim was lost. Their runners are being killed
+  # and their results are never stored.
+  _abandoned = set()
+
+  queue.register()
+  signal.signal(signal.SIGINT, handleInterrupt)
+  signal.signal(signal.SIGTERM, handleInterrupt)
+
+  if pargs.executor == 'process':
+    _logger.info('Running jobs using {} worker processes'.format(pargs.jobs))
+    cancelEvent = multiprocessing.Event()
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=pargs.jobs,
+      initializer=BatchWorker.initWorker,
+      initargs=(cancelEvent, logLevel, logFormat))
+  else:
+    _logger.info('Running jobs using {} threads'.format(pargs.jobs))
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=pargs.jobs)
+  try:
+    with executor:
+      while True:
+        while not _cancelled and len(_running) + len(_abandoned) < pargs.jobs:
+          claim = queue.claim()
+          if claim == None:
+            break
+          _logger.info('Claimed "{}"'.format(claim.program))
+          # A reclaimed job may have a partial working directory left by
+          # its previous owner so always clean it. If the claim is lost
+          # the runner kills itself (see BatchWorker.runJob()).
+          future = executor.submit(BatchWorker.runJob, runnerName, claim.program, claim.workDir,
+                                   rc.copy(), clean=True, abandoned=queue.lostCheck(claim),
+                                   abandonPollTimePeriod=renewPeriod)
+          _running[future] = claim
+
+        if len(_running) + len(_abandoned) == 0:
+          if _cancelled or not pargs.wait or queue.done:
+            break
+          # Other workers hold the remaining jobs. Keep polling so that
+          # we can take over their jobs if they die.
+          time.sleep(renewPeriod)
+          continue
+
+        done, _ = concurrent.futures.wait(list(_running.keys()) + list(_abandoned), timeout=renewPeriod,
+          return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+          if future in _abandoned:
+            _abandoned.discard(future)
+            continue
+          claim = _running.pop(future)
+          try:
+            result = future.result()
+          except concurrent.futures.CancelledError:
+            result = None
+          except Exception as e:
+            result = { 'program': claim.program, 'error': traceback.format_exc() }
+
+          if result == None or _cancelled:
+            # Let another worker run the job
+            _logger.info('Releasing "{}"'.format(claim.program))
+            queue.release(claim)
+            continue
+
+          if 'error' in result:
+            _logger.error('{} runner hit exception:\n{}'.format(claim.program, result['error']))
+            exitCode = 1
+          if queue.complete(claim, result):
+            completedCounter += 1
+            _logger.info('Completed "{}" ({} by this worker)'.format(claim.program, completedCounter))
+
+        for future, claim in list(_running.items()):
+          if queue.renew(claim):
+            continue
+          # Another worker is running the job in the same working directory
+          _logger.warning('Lost claim on "{}". Abandoning it'.format(claim.program))
+          del _running[future]
+          _abandoned.add(future)
+          future.cancel()
+  finally:
+    queue.unregister()
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+  if _cancelled:
+    _logger.warning('Worker was cancelled')
+    return 1
+  return exitCode
+
+def status(pargs, queue):
+  counts = queue.status()
+  print('Programs: {total}\nCompleted: {completed}\nRunning: {running}\nStale: {stale}\nPending: {pending}\nWorkers: {workers}'.format(
+    **counts))
+  return 0
+
+def merge(pargs, queue):
+  yamlOutputFile = os.path.abspath(pargs.yaml_output)
+  if os.path.exists(yamlOutputFile):
+    _logger.error('yaml_output file ("{}") already exists'.format(yamlOutputFile))
+    return 1
+
+  try:
+    report = queue.loadResults()
+  except WorkQueue.WorkQueueException as e:
+    _logger.error(e.msg)
+    return 1
+
+  # Use the same format as boogie-batch-runner.py
+  _logger.info('Writing output to {}'.format(yamlOutputFile))
+  result = yaml.dump(report, default_flow_style=False)
+  with open(yamlOutputFile, 'w') as f:
+    f.write('# BoogieRunner report using runner {}\n'.format(queue.config['runner']))
+    f.write(result)
+  return 0
+
+def entryPoint(args):
+  global _logger
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("-l","--log-level",type=str, default="info", dest="log_level", choices=['debug','info','warning','error'])
+  subParsers = parser.add_subparsers(dest='command')
+  subParsers.required = True
+
+  createParser = subParsers.add_parser('create', help='Create a work queue from a config and program list')
+  createParser.add_argument("--rprefix", default=os.getcwd(), help="Prefix for relative paths for program_list")
+  createParser.add_argument("--lease-time", dest="lease_time", type=float, default=300.0,
+                            help="Time in seconds after which the claim of a worker that has stopped renewing it "
+                                 "is considered stale and the job is rerun (Default %(default)s)")
+  createParser.add_argument("config_file", help="YAML configuration file")
+  createParser.add_argument("program_list", help="File containing list of Boogie programs")
+  createParser.add_argument("working_dirs_root", help="Directory to create working directories inside. Must be on a shared file system")
+  createParser.add_argument("queue_dir", help="Directory to create the queue in. Must be on a shared file system")
+
+  workParser = subParsers.add_parser('work', help='Run jobs from a work queue')
+  workParser.add_argument("-j", "--jobs", type=int, default="1", help="Number of jobs to run in parallel (Default %(default)s)")
+  workParser.add_argument("--executor", default="thread", choices=['thread', 'process'],
+                          help="Supervise parallel jobs from threads in this process or from worker processes (Default %(default)s)")
+  workParser.add_argument("--no-wait", dest="wait", action='store_false',
+                          help="Exit when there are no jobs left to claim rather than waiting for other workers "
+                               "to finish (so their jobs can be reclaimed if they die)")
+  workParser.add_argument("queue_dir", help="Work queue directory")
+
+  statusParser = subParsers.add_parser('status', help='Show the progress of a work queue')
+  statusParser.add_argument("queue_dir", help="Work queue directory")
+
+  mergeParser = subParsers.add_parser('merge', help='Write the results of a completed work queue')
+  mergeParser.add_argument("queue_dir", help="Work queue directory")
+  mergeParser.add_argument("yaml_output", help="path to write YAML output to")
+
+  pargs = parser.parse_args(args)
+
+  logLevel = getattr(logging, pargs.log_level.upper(),None)
+  if logLevel == logging.DEBUG:
+    logFormat = '%(levelname)s:%(threadName)s: %(filename)s:%(lineno)d %(funcName)s()  : %(message)s'
+  else:
+    logFormat = '%(levelname)s:%(threadName)s: %(message)s'
+
+  logging.basicConfig(level=logLevel, format=logFormat)
+  _logger = logging.getLogger(__name__)
+
+  if pargs.command == 'create':
+    return create(pargs)
+
+  try:
+    queue = WorkQueue.WorkQueue(pargs.queue_dir)
+  except WorkQueue.WorkQueueException as e:
+    _logger.error(e.msg)
+    return 1
+
+  if pargs.command == 'work':
+    startTime = datetime.datetime.now()
+    exitCode = work(pargs, queue, logLevel, logFormat)
+    _logger.info('Total run time: {}'.format(datetime.datetime.now() - startTime))
+    return exitCode
+  elif pargs.command == 'status':
+    return status(pargs, queue)
+  else:
+    return merge(pargs, queue)
+
+if __name__ == '__main__':
+  sys.exit(entryPoint(sys.argv[1:]))
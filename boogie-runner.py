@@ -8,6 +8,7 @@ import logging
 import os
 from  BoogieRunner import ConfigLoader
 from  BoogieRunner import RunnerFactory
+from  BoogieRunner import Shard
 import traceback
 import yaml
 import sys
@@ -18,6 +19,9 @@ def entryPoint(args):
   parser = argparse.ArgumentParser(description=__doc__)
   parser.add_argument("-l","--log-level",type=str, default="info", dest="log_level", choices=['debug','info','warning','error'])
   parser.add_argument("--dry", action='store_true', help="Stop after initialising runners")
+  parser.add_argument("--shard", default=None,
+                      help="Only run the program if it belongs to shard i of N (written \"i/N\", 0 <= i < N) using the "
+                           "same stable hash as boogie-batch-runner.py --shard-by=hash. Otherwise exit without writing any output")
   parser.add_argument("config_file", help="YAML configuration file")
   parser.add_argument("boogie_program", help="Boogie program to pass to tool")
   parser.add_argument("working_dir", help="Working directory")
@@ -40,6 +44,16 @@ def entryPoint(args):
     _logger.error('Specified boogie program "{}" does not exist'.format(boogieProgram))
     return 1
 
+  if pargs.shard != None:
+    try:
+      shardIndex, shardCount = Shard.parse(pargs.shard)
+    except Shard.ShardException as e:
+      _logger.error(e.msg)
+      return 1
+    if Shard.shardOfProgram(boogieProgram, shardCount) != shardIndex:
+      _logger.info('"{}" is not in shard {}/{}. Skipping'.format(boogieProgram, shardIndex, shardCount))
+      return 0
+
   config = None
   try:
     _logger.debug('Loading configuration from "{}"'.format(pargs.config_file))
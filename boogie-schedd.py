@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+    Scheduling daemon that owns the job slots of this machine so that
+    several ``boogie-batch-runner.py --daemon`` runs (possibly by
+    different users) can share it. Free slots are granted to the user
+    holding the fewest slots so every user gets a fair share.
+"""
+import argparse
+import logging
+import os
+from  BoogieRunner import BatchScheduler
+from  BoogieRunner import SchedulerDaemon
+import signal
+import threading
+import sys
+
+_logger = None
+
+def entryPoint(args):
+  global _logger
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("-l","--log-level",type=str, default="info", dest="log_level", choices=['debug','info','warning','error'])
+  parser.add_argument("-j", "--jobs", type=int, default=None,
+                      help="Number of jobs that may run at once across all clients. Defaults to the number of CPUs")
+  parser.add_argument("--cpu-slots", dest="cpu_slots", default=None,
+                      help="Pin each job to its own CPU. Use \"physical\" for one slot per physical core, \"logical\" "
+                           "for one slot per CPU or a CPU list (e.g. \"0-3,8\"). The number of slots is the number of jobs "
+                           "that may run at once. Cannot be used with -j")
+  parser.add_argument("--memory-budget", dest="memory_budget", default=None,
+                      help="Total memory (in MiB) that running jobs may use. A job is only granted a slot when its "
+                           "max_memory fits inside the budget. Use \"auto\" to use the memory available when the daemon "
+                           "starts. By default there is no budget")
+  parser.add_argument("socket", help="Path of the Unix socket to listen on")
+
+  pargs = parser.parse_args(args)
+
+  logLevel = getattr(logging, pargs.log_level.upper(),None)
+  if logLevel == logging.DEBUG:
+    logFormat = '%(levelname)s:%(threadName)s: %(filename)s:%(lineno)d %(funcName)s()  : %(message)s'
+  else:
+    logFormat = '%(levelname)s:%(threadName)s: %(message)s'
+
+  logging.basicConfig(level=logLevel, format=logFormat)
+  _logger = logging.getLogger(__name__)
+
+  if pargs.cpu_slots != None and pargs.jobs != None:
+    _logger.error('--cpu-slots cannot be used with -j')
+    return 1
+
+  if pargs.cpu_slots != None:
+    try:
+      if pargs.cpu_slots == 'physical':
+        slots = BatchScheduler.physicalCoreSlots()
+      elif pargs.cpu_slots == 'logical':
+        slots = BatchScheduler.logicalCpuSlots()
+      else:
+        available = set(BatchScheduler.availableCpus())
+        slots = [ ]
+        for cpu in BatchScheduler.parseCpuList(pargs.cpu_slots):
+          if not cpu in available:
+            _logger.error('CPU {} is not available to this process'.format(cpu))
+            return 1
+          slots.append({ cpu })
+    except BatchScheduler.BatchSchedulerException as e:
+      _logger.error(e.msg)
+      return 1
+  else:
+    jobs = pargs.jobs if pargs.jobs != None else len(BatchScheduler.availableCpus())
+    if jobs <= 0:
+      _logger.error('jobs must be > 0')
+      return 1
+    slots = [ None ] * jobs
+
+  memoryBudget = None
+  if pargs.memory_budget != None:
+    if pargs.memory_budget == 'auto':
+      memoryBudget = BatchScheduler.detectMemoryBudgetInMiB()
+      _logger.info('Detected memory budget of {} MiB'.format(memoryBudget))
+    else:
+      try:
+        memoryBudget = int(pargs.memory_budget)
+      except ValueError:
+        _logger.error('--memory-budget must be an integer or "auto"')
+        return 1
+    if memoryBudget <= 0:
+      _logger.error('Memory budget must be > 0')
+      return 1
+
+  daemon = SchedulerDaemon.Daemon(os.path.abspath(pargs.socket), slots, memoryBudget)
+
+  def handleSignal(signum, frame):
+    _logger.info('Received signal {}. Shutting down'.format(signum))
+    # shutdown() blocks until serve() returns so it can't be called from
+    # the thread running serve()
+    threading.Thread(target=daemon.shutdown).start()
+
+  signal.signal(signal.SIGINT, handleSignal)
+  signal.signal(signal.SIGTERM, handleSignal)
+
+  try:
+    daemon.serve()
+  except SchedulerDaemon.SchedulerDaemonException as e:
+    _logger.error(e.msg)
+    return 1
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(entryPoint(sys.argv[1:]))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+    Script to stitch the YAML outputs of running each shard of a program
+    list (see ``--shard``) back into a single YAML output. Every program
+    in the program list must have exactly one result.
+"""
+import argparse
+import logging
+import os
+from  BoogieRunner import ProgramListLoader
+from  BoogieRunner import ResultSink
+import traceback
+import yaml
+import sys
+
+_logger = None
+
+def readHeader(path):
+  with open(path, 'r') as f:
+    line = f.readline()
+  if line.startswith('#'):
+    return line
+  return None
+
+def entryPoint(args):
+  global _logger
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("-l","--log-level",type=str, default="info", dest="log_level", choices=['debug','info','warning','error'])
+  parser.add_argument("--rprefix", default=os.getcwd(), help="Prefix for relative paths for program_list")
+  parser.add_argument("program_list", help="File containing list of Boogie programs that was sharded")
+  parser.add_argument("yaml_output", help="path to write YAML output to")
+  parser.add_argument("shard_ymls", nargs='+', help="YAML output of each shard")
+
+  pargs = parser.parse_args(args)
+
+  logLevel = getattr(logging, pargs.log_level.upper(),None)
+  if logLevel == logging.DEBUG:
+    logFormat = '%(levelname)s:%(threadName)s: %(filename)s:%(lineno)d %(funcName)s()  : %(message)s'
+  else:
+    logFormat = '%(levelname)s:%(threadName)s: %(message)s'
+
+  logging.basicConfig(level=logLevel, format=logFormat)
+  _logger = logging.getLogger(__name__)
+
+  try:
+    programList = ProgramListLoader.load(pargs.program_list, pargs.rprefix, existCheck=False)
+  except ProgramListLoader.ProgramListLoaderException as e:
+    _logger.error(e)
+    _logger.debug(traceback.format_exc())
+    return 1
+
+  yamlOutputFile = os.path.abspath(pargs.yaml_output)
+  if os.path.exists(yamlOutputFile):
+    _logger.error('yaml_output file ("{}") already exists'.format(yamlOutputFile))
+    return 1
+
+  header = None
+  programToResult = { }
+  programToShard = { }
+  problems = 0
+  for path in pargs.shard_ymls:
+    if not os.path.exists(path):
+      _logger.error('Shard output "{}" does not exist'.format(path))
+      return 1
+
+    shardHeader = readHeader(path)
+    if header == None:
+      header = shardHeader
+    elif shardHeader != header:
+      _logger.error('Header of "{}" ({}) does not match header of "{}" ({})'.format(path,
+        shardHeader, pargs.shard_ymls[0], header))
+      return 1
+
+    _logger.info('Loading shard output "{}"'.format(path))
+    try:
+      results = ResultSink.loadReport(path)
+    except (ResultSink.ResultSinkException, yaml.YAMLError) as e:
+      _logger.error('Failed to load "{}"'.format(path))
+      _logger.error(e)
+      return 1
+
+    for r in results:
+      if not isinstance(r, dict) or not 'program' in r:
+        _logger.error('Unexpected result in "{}"'.format(path))
+        return 1
+      program = r['program']
+      if program in programToResult:
+        _logger.error('"{}" has a result in "{}" and "{}"'.format(program, programToShard[program], path))
+        problems += 1
+        continue
+      programToResult[program] = r
+      programToShard[program] = path
+
+  programSet = set(programList)
+  for program in sorted(set(programToResult.keys()).difference(programSet)):
+    _logger.error('"{}" in "{}" is not in the program list'.format(program, programToShard[program]))
+    problems += 1
+  for program in programList:
+    if not program in programToResult:
+      _logger.error('"{}" does not have a result'.format(program))
+      problems += 1
+
+  if problems > 0:
+    _logger.error('Found {} problems. Not writing output'.format(problems))
+    return 1
+
+  errorCount = len([ r for r in programToResult.values() if 'error' in r ])
+  if errorCount > 0:
+    _logger.warning('{} results are error reports'.format(errorCount))
+
+  _logger.info('Writing {} results to {}'.format(len(programList), yamlOutputFile))
+  report = [ programToResult[program] for program in programList ]
+  with open(yamlOutputFile, 'w') as f:
+    if header != None:
+      f.write(header)
+    f.write(yaml.dump(report, default_flow_style=False))
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(entryPoint(sys.argv[1:]))
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Tests that the AsyncIO backend starts tools without blocking the
+  supervisor's loop.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+
+# Hack
+sys.path.insert(0, repoDir)
+from BoogieRunner.Backends import AsyncIO
+
+def _waitUntil(predicate, timeout=5.0):
+  endTime = time.monotonic() + timeout
+  while not predicate() and time.monotonic() < endTime:
+    time.sleep(0.01)
+  return predicate()
+
+class SpawnTests(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tempDir.cleanup)
+    self.logFile = os.path.join(self.tempDir.name, 'log')
+    self.backend = AsyncIO.AsyncIOBackend('/bin/sh', self.tempDir.name, 0, 0, 0)
+    self.spawnStarted = threading.Event()
+    self.spawnThreads = [ ]
+    self.spawned = [ ]
+
+  def slowSpawn(self, *args):
+    # Stands in for forking a large runner
+    self.spawnThreads.append(threading.current_thread())
+    self.spawnStarted.set()
+    time.sleep(0.5)
+    popen = AsyncIO.AsyncIOBackend._spawn(self.backend, *args)
+    self.spawned.append(popen)
+    return popen
+
+  def testSpawnDoesNotBlockLoop(self):
+    supervisor = AsyncIO.getSupervisor()
+    with mock.patch.object(self.backend, '_spawn', side_effect=self.slowSpawn):
+      future = supervisor.submit(self.backend.runAsync([ '/bin/sh', '-c', 'exit 3' ], self.logFile, { }))
+      self.assertTrue(self.spawnStarted.wait(5.0))
+      # The loop can still run other work whilst the tool is started
+      startTime = time.monotonic()
+      supervisor.submit(asyncio.sleep(0)).result(timeout=5.0)
+      self.assertTrue(time.monotonic() - startTime < 0.25)
+      result = future.result(timeout=5.0)
+    self.assertEqual(result.exitCode, 3)
+    self.assertFalse(any([ thread.name == 'asyncio_supervisor' for thread in self.spawnThreads ]))
+
+  def testCancelWhilstSpawningKillsTool(self):
+    supervisor = AsyncIO.getSupervisor()
+    with mock.patch.object(self.backend, '_spawn', side_effect=self.slowSpawn):
+      future = supervisor.submit(self.backend.runAsync([ '/bin/sleep', '60' ], self.logFile, { }))
+      self.assertTrue(self.spawnStarted.wait(5.0))
+      future.cancel()
+      self.assertTrue(_waitUntil(lambda: len(self.spawned) > 0))
+      pid = self.spawned[0].pid
+      # Killed and reaped
+      self.assertTrue(_waitUntil(lambda: not os.path.exists('/proc/{}'.format(pid))))
+
+if __name__ == '__main__':
+  unittest.main()
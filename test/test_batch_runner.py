@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  End to end tests of boogie-batch-runner.py using a stand in for KLEE
+  on a tiny program list.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import yaml
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+batchRunner = os.path.join(repoDir, 'boogie-batch-runner.py')
+
+# Stands in for KLEE. Records each program it runs and exits with 1 (a
+# bug was found) if the program says so.
+_fakeKlee = '''#!/bin/sh
+prog="$(eval echo \\${{$#}})"
+echo "$prog" >> {runLog}
+if grep -q BUG "$prog"; then echo "KLEE: ERROR: foo.c:1: assertion"; exit 1; fi
+exit 0
+'''
+
+_config = '''runner: Klee
+runner_config:
+  tool_path: "{toolPath}"
+  max_time: 10
+  entry_point: "main"
+  backend:
+    name: "{backend}"
+'''
+
+class BatchRunnerTestCase(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tempDir.cleanup)
+    self.runLog = self.path('runs.log')
+    self.toolPath = self.write('klee', _fakeKlee.format(runLog=self.runLog))
+    os.chmod(self.toolPath, 0o755)
+    self.config = self.writeConfig('klee.yml')
+    self.programs = [ ]
+    for name, contents in [ ('p0.c', 'ok 0'), ('p1.c', 'BUG'), ('p2.c', 'ok 2'), ('p3.c', 'ok 3') ]:
+      self.programs.append(self.write(name, contents))
+    self.programList = self.write('programs.txt', '\n'.join([ os.path.basename(p) for p in self.programs ]))
+    self.workDirs = self.path('wd')
+    self.output = self.path('out.yml')
+
+  def path(self, name):
+    return os.path.join(self.tempDir.name, name)
+
+  def write(self, name, contents):
+    with open(self.path(name), 'w') as f:
+      f.write(contents)
+    return self.path(name)
+
+  def writeConfig(self, name, backend='PythonPsUtil'):
+    return self.write(name, _config.format(toolPath=self.toolPath, backend=backend))
+
+  def runBatch(self, *args, configs=None, workDirs=None, output=None):
+    """
+      Run boogie-batch-runner.py on the program list. Returns the
+      process' exit code and its log.
+    """
+    cmdLine = [ sys.executable, batchRunner, '-l', 'warning', '--rprefix', self.tempDir.name ]
+    cmdLine += list(args)
+    cmdLine += configs if configs != None else [ self.config ]
+    cmdLine += [ self.programList, workDirs if workDirs != None else self.workDirs,
+      output if output != None else self.output ]
+    process = subprocess.run(cmdLine, cwd=self.tempDir.name, stdout=subprocess.PIPE,
+      stderr=subprocess.STDOUT, universal_newlines=True, timeout=120)
+    return process.returncode, process.stdout
+
+  def load(self, path):
+    with open(path, 'r') as f:
+      return yaml.load(f, Loader=yaml.SafeLoader)
+
+  def ranPrograms(self):
+    if not os.path.exists(self.runLog):
+      return [ ]
+    with open(self.runLog, 'r') as f:
+      return sorted([ line.strip() for line in f if len(line.strip()) > 0 ])
+
+  def checkResults(self, results):
+    self.assertEqual(sorted([ r['program'] for r in results ]), self.programs)
+    for r in results:
+      self.assertFalse('error' in r, r)
+      self.assertEqual(r['bug_found'], r['program'].endswith('p1.c'))
+
+class ExecutorTests(BatchRunnerTestCase):
+  def testExecutors(self):
+    asyncConfig = self.writeConfig('kasync.yml', backend='AsyncIO')
+    for executor, config in [ ('thread', self.config), ('process', self.config), ('async', asyncConfig) ]:
+      with self.subTest(executor=executor):
+        if os.path.exists(self.runLog):
+          os.remove(self.runLog)
+        output = self.path('out-{}.yml'.format(executor))
+        exitCode, log = self.runBatch('-j', '2', '--executor', executor, configs=[ config ],
+          workDirs=self.path('wd-' + executor), output=output)
+        self.assertEqual(exitCode, 0, log)
+        self.checkResults(self.load(output))
+        self.assertEqual(self.ranPrograms(), self.programs)
+
+  def testAsyncNeedsAsyncIOBackend(self):
+    exitCode, log = self.runBatch('--executor', 'async')
+    self.assertEqual(exitCode, 1)
+    self.assertFalse(os.path.exists(self.output))
+
+  def testInvalidJobs(self):
+    exitCode, log = self.runBatch('-j', '0')
+    self.assertEqual(exitCode, 1)
+    self.assertFalse(os.path.exists(self.output))
+
+class ResumeTests(BatchRunnerTestCase):
+  def setUp(self):
+    super().setUp()
+    self.streamOutput = self.path('stream.jsonl')
+
+  def interruptedRun(self):
+    """
+      Make it look like a run was interrupted having completed the first
+      two programs. The third program's error report must be rerun.
+    """
+    exitCode, log = self.runBatch('--stream-output', self.streamOutput, '--stream-format', 'jsonl')
+    self.assertEqual(exitCode, 0, log)
+    with open(self.streamOutput, 'r') as f:
+      results = [ json.loads(line) for line in f ]
+    completed = [ r for r in results if r['program'] in self.programs[:2] ]
+    self.assertEqual(len(completed), 2)
+    error = { 'program': self.programs[2], 'error': 'cancelled' }
+    with open(self.streamOutput, 'w') as f:
+      for r in completed + [ error ]:
+        f.write(json.dumps(r) + '\n')
+    os.remove(self.output)
+    os.remove(self.runLog)
+    return completed
+
+  def testResume(self):
+    completed = self.interruptedRun()
+    exitCode, log = self.runBatch('--resume', '--stream-output', self.streamOutput, '--stream-format', 'jsonl')
+    self.assertEqual(exitCode, 0, log)
+    # Only the programs without a completed result are rerun
+    self.assertEqual(self.ranPrograms(), self.programs[2:])
+    results = self.load(self.output)
+    self.checkResults(results)
+    for r in completed:
+      self.assertTrue(r in results)
+
+  def testOutputExistsWithoutResume(self):
+    exitCode, log = self.runBatch()
+    self.assertEqual(exitCode, 0, log)
+    exitCode, log = self.runBatch()
+    self.assertEqual(exitCode, 1)
+    self.assertTrue('already exists' in log, log)
+
+  def testUnknownProgram(self):
+    exitCode, log = self.runBatch()
+    self.assertEqual(exitCode, 0, log)
+    os.remove(self.runLog)
+    # Drop a program from the list that the previous results include
+    with open(self.programList, 'w') as f:
+      f.write('\n'.join([ os.path.basename(p) for p in self.programs[1:] ]))
+    exitCode, log = self.runBatch('--resume')
+    self.assertEqual(exitCode, 1)
+    self.assertTrue('not in program_list' in log, log)
+    self.assertEqual(self.ranPrograms(), [ ])
+
+class SetupFailureTests(BatchRunnerTestCase):
+  def setUp(self):
+    super().setUp()
+    # The entry point is found whilst each runner is set up. One program
+    # does not have one.
+    with open(self.config, 'w') as f:
+      f.write(_config.format(toolPath=self.toolPath, backend='PythonPsUtil').replace(
+        'entry_point: "main"', 'entry_point:\n    use_bool_attribute: "entry"'))
+    for program in self.programs:
+      with open(program, 'a') as f:
+        f.write('\nprocedure {:entry} main() {\n}\n')
+    self.noEntry = self.write('noentry.c', 'procedure main() {\n}\n')
+    with open(self.programList, 'a') as f:
+      f.write('\nnoentry.c')
+
+  def testErrorReportedPerProgram(self):
+    exitCode, log = self.runBatch('-j', '2')
+    self.assertEqual(exitCode, 1)
+    # The other programs still run
+    self.assertEqual(self.ranPrograms(), self.programs)
+    results = self.load(self.output)
+    errors = [ r for r in results if 'error' in r ]
+    self.assertEqual(len(errors), 1)
+    self.assertEqual(errors[0]['program'], self.noEntry)
+    self.assertTrue('Failed to find entry point' in errors[0]['error'], errors[0]['error'])
+    self.checkResults([ r for r in results if r['program'] != self.noEntry ])
+
+  def testDryRun(self):
+    exitCode, log = self.runBatch('--dry')
+    self.assertEqual(exitCode, 1)
+    self.assertTrue('noentry.c' in log, log)
+    self.assertEqual(self.ranPrograms(), [ ])
+
+class MatrixTests(BatchRunnerTestCase):
+  def testOutputPerConfig(self):
+    configs = [ self.writeConfig('a.yml'), self.writeConfig('b.yml') ]
+    exitCode, log = self.runBatch('-j', '2', configs=configs)
+    self.assertEqual(exitCode, 0, log)
+    self.assertFalse(os.path.exists(self.output))
+    for name in [ 'a', 'b' ]:
+      results = self.load(self.path('out-{}.yml'.format(name)))
+      self.checkResults(results)
+      for r in results:
+        self.assertEqual(os.path.dirname(r['working_directory']), os.path.join(self.workDirs, name))
+    # Every program is run once for each config
+    self.assertEqual(self.ranPrograms(), sorted(self.programs * 2))
+
+  def testResumeOneConfig(self):
+    configs = [ self.writeConfig('a.yml'), self.writeConfig('b.yml') ]
+    exitCode, log = self.runBatch(configs=configs)
+    self.assertEqual(exitCode, 0, log)
+    os.remove(self.path('out-b.yml'))
+    os.remove(self.runLog)
+    exitCode, log = self.runBatch('--resume', configs=configs)
+    self.assertEqual(exitCode, 0, log)
+    self.assertEqual(self.ranPrograms(), self.programs)
+    self.checkResults(self.load(self.path('out-b.yml')))
+
+  def testDuplicateConfigName(self):
+    os.mkdir(self.path('other'))
+    configs = [ self.writeConfig('a.yml'), self.writeConfig(os.path.join('other', 'a.yml')) ]
+    exitCode, log = self.runBatch(configs=configs)
+    self.assertEqual(exitCode, 1)
+    self.assertTrue('"a" is used more than once' in log, log)
+    self.assertEqual(self.ranPrograms(), [ ])
+
+class DedupTests(BatchRunnerTestCase):
+  def setUp(self):
+    super().setUp()
+    # Copies of p0.c and p1.c. They come after the originals once the
+    # program list is sorted so the originals are run.
+    self.copies = { self.write('z0.c', 'ok 0'): self.programs[0], self.write('z1.c', 'BUG'): self.programs[1] }
+    with open(self.programList, 'a') as f:
+      f.write('\nz0.c\nz1.c')
+
+  def testDuplicatesNotRun(self):
+    exitCode, log = self.runBatch('--dedup')
+    self.assertEqual(exitCode, 0, log)
+    self.assertEqual(self.ranPrograms(), self.programs)
+    results = { r['program']: r for r in self.load(self.output) }
+    self.assertEqual(len(results), 6)
+    for program in self.programs:
+      self.assertFalse('deduplicated_from' in results[program])
+    for copy, original in self.copies.items():
+      self.assertEqual(results[copy]['deduplicated_from'], original)
+      self.assertEqual(results[copy]['bug_found'], results[original]['bug_found'])
+      self.assertEqual(results[copy]['working_directory'], results[original]['working_directory'])
+
+  def testDuplicatesRunWithoutDedup(self):
+    exitCode, log = self.runBatch()
+    self.assertEqual(exitCode, 0, log)
+    self.assertEqual(self.ranPrograms(), sorted(self.programs + list(self.copies.keys())))
+    for r in self.load(self.output):
+      self.assertFalse('deduplicated_from' in r)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Tests for the admission and picking logic of ``BatchScheduler``.
+"""
+import concurrent.futures
+import os
+import sys
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+
+# Hack
+sys.path.insert(0, repoDir)
+from BoogieRunner import BatchScheduler
+
+def makeJob(program, maxMemory=0, maxTime=0):
+  return BatchScheduler.Job(program, '/tmp/wd-{}'.format(program),
+    { 'max_memory': maxMemory, 'max_time': maxTime })
+
+def runAll(scheduler):
+  """
+    Run every job in ``scheduler``. Jobs finish as soon as they are
+    submitted but stay running until the scheduler next waits so a
+    single dispatch pass admits jobs against the ones admitted before
+    them in that pass.
+
+    Returns a list with the jobs that were running after each job was
+    submitted and the list of finished jobs.
+  """
+  runningAtSubmit = [ ]
+  def submit(job):
+    runningAtSubmit.append(scheduler.runningJobs + [ job ])
+    future = concurrent.futures.Future()
+    future.set_result(None)
+    return future
+  finished = [ job for job, _ in scheduler.run(submit) ]
+  return runningAtSubmit, finished
+
+class MemoryBudgetPolicyTests(unittest.TestCase):
+  def testReservesMaxMemory(self):
+    scheduler = BatchScheduler.BatchScheduler(4)
+    scheduler.addPolicy(BatchScheduler.MemoryBudgetPolicy(1000))
+    for index in range(0, 6):
+      scheduler.addJob(makeJob(index, maxMemory=400))
+    runningAtSubmit, finished = runAll(scheduler)
+    self.assertEqual(len(finished), 6)
+    self.assertEqual(max([ len(running) for running in runningAtSubmit ]), 2)
+
+  def testOvercommitReservesUnsampledTools(self):
+    # No tool has started when the jobs of a dispatch pass are admitted
+    # so nothing can be sampled. Their max_memory must still count.
+    sampled = [ ]
+    def sampler(workDirs):
+      sampled.append(list(workDirs))
+      return { }
+    scheduler = BatchScheduler.BatchScheduler(4)
+    scheduler.addPolicy(BatchScheduler.MemoryBudgetPolicy(1000, sampleUsage=True, sampler=sampler))
+    for index in range(0, 6):
+      scheduler.addJob(makeJob(index, maxMemory=400))
+    runningAtSubmit, finished = runAll(scheduler)
+    self.assertEqual(len(finished), 6)
+    self.assertEqual(max([ len(running) for running in runningAtSubmit ]), 2)
+    self.assertTrue(len(sampled) > 0)
+
+  def testOvercommitUsesSampledUsage(self):
+    policy = BatchScheduler.MemoryBudgetPolicy(1000, sampleUsage=True,
+      sampler=lambda workDirs: { workDir: 50.0 for workDir in workDirs })
+    running = [ makeJob(index, maxMemory=400) for index in range(0, 3) ]
+    # Reserving max_memory would give 1200 MiB. Sampling gives 150 MiB.
+    self.assertTrue(policy.canAdmit(makeJob(3, maxMemory=400), running))
+    self.assertFalse(policy.canAdmit(makeJob(4, maxMemory=900), running))
+
+  def testOvercommitKeepsLastSample(self):
+    samples = [ { '/tmp/wd-0': 100.0 }, { } ]
+    policy = BatchScheduler.MemoryBudgetPolicy(1000, sampleUsage=True, sampler=lambda workDirs: samples.pop(0))
+    running = [ makeJob(0, maxMemory=800) ]
+    self.assertTrue(policy.canAdmit(makeJob(1, maxMemory=800), running))
+    # The tool has been sampled before so its reservation is not restored
+    self.assertTrue(policy.canAdmit(makeJob(2, maxMemory=800), running))
+    policy.finished(running[0])
+    samples.append({ })
+    self.assertFalse(policy.canAdmit(makeJob(3, maxMemory=800), running))
+
+  def testCheck(self):
+    policy = BatchScheduler.MemoryBudgetPolicy(1000)
+    policy.check(makeJob(0, maxMemory=1000))
+    with self.assertRaises(BatchScheduler.BatchSchedulerException):
+      policy.check(makeJob(0, maxMemory=0))
+    with self.assertRaises(BatchScheduler.BatchSchedulerException):
+      policy.check(makeJob(0, maxMemory=1001))
+
+class SampleToolMemoryUsageTests(unittest.TestCase):
+  def testOnlyCountsTools(self):
+    import subprocess
+    import tempfile
+    import time
+    with tempfile.TemporaryDirectory() as workDir, tempfile.TemporaryDirectory() as otherDir:
+      # The intermediate shell stands in for a worker process
+      worker = subprocess.Popen([ 'sh', '-c', 'cd "{}" && sleep 30'.format(workDir) ], cwd=otherDir)
+      try:
+        for _ in range(0, 100):
+          usage = BatchScheduler.sampleToolMemoryUsageInMiB([ workDir ])
+          if workDir in usage:
+            break
+          time.sleep(0.05)
+        self.assertIn(workDir, usage)
+        self.assertTrue(usage[workDir] > 0)
+        self.assertEqual(BatchScheduler.sampleToolMemoryUsageInMiB([ otherDir + '-missing' ]), { })
+      finally:
+        worker.kill()
+        worker.wait()
+
+class CpuSlotPolicyTests(unittest.TestCase):
+  def testSlotsAreReused(self):
+    scheduler = BatchScheduler.BatchScheduler(4)
+    scheduler.addPolicy(BatchScheduler.CpuSlotPolicy([ { 0 }, { 1 } ]))
+    jobs = [ makeJob(index) for index in range(0, 5) ]
+    for job in jobs:
+      scheduler.addJob(job)
+    runningAtSubmit, finished = runAll(scheduler)
+    self.assertEqual(len(finished), 5)
+    self.assertEqual(max([ len(running) for running in runningAtSubmit ]), 2)
+    for running in runningAtSubmit:
+      self.assertEqual(len(set([ job.tags['cpu_slot'] for job in running ])), len(running))
+
+  def testParseCpuList(self):
+    self.assertEqual(BatchScheduler.parseCpuList('0-3,8,10-11'), [ 0, 1, 2, 3, 8, 10, 11 ])
+    for bad in [ '3-1', 'a', ',' ]:
+      with self.assertRaises(BatchScheduler.BatchSchedulerException):
+        BatchScheduler.parseCpuList(bad)
+
+class JobSlotTests(unittest.TestCase):
+  def makePortfolio(self, program, memberCount):
+    members = [ ('c{}'.format(index), 'Klee', '/tmp/wd-{}-{}'.format(program, index), { })
+      for index in range(0, memberCount) ]
+    return BatchScheduler.PortfolioJob(program, members)
+
+  def testPortfolioUsesSlotPerMember(self):
+    scheduler = BatchScheduler.BatchScheduler(5)
+    for index in range(0, 4):
+      scheduler.addJob(self.makePortfolio(index, 2))
+    scheduler.addJob(makeJob(4))
+    runningAtSubmit, finished = runAll(scheduler)
+    self.assertEqual(len(finished), 5)
+    self.assertEqual(max([ sum([ job.slots for job in running ]) for running in runningAtSubmit ]), 5)
+    # Two portfolios fill 4 slots. The third must wait.
+    self.assertEqual(len(runningAtSubmit[1]), 2)
+    self.assertEqual(len(runningAtSubmit[2]), 1)
+
+  def testPortfolioLargerThanSlots(self):
+    scheduler = BatchScheduler.BatchScheduler(2)
+    with self.assertRaises(BatchScheduler.BatchSchedulerException):
+      scheduler.addJob(self.makePortfolio(0, 3))
+
+class PickerTests(unittest.TestCase):
+  def testPickerOrderAndStop(self):
+    scheduler = BatchScheduler.BatchScheduler(1)
+    jobs = [ makeJob(index) for index in range(0, 4) ]
+    for job in jobs:
+      scheduler.addJob(job)
+    picked = [ ]
+    def picker(pending):
+      if len(picked) == 2:
+        return None
+      # Pick the last pending job
+      picked.append(pending[-1])
+      return pending[-1]
+    scheduler.setPicker(picker)
+    def submit(job):
+      future = concurrent.futures.Future()
+      future.set_result(None)
+      return future
+    results = list(scheduler.run(submit))
+    self.assertTrue(scheduler.stopped)
+    self.assertEqual([ job for job, future in results if not future.cancelled() ], [ jobs[3], jobs[2] ])
+    self.assertEqual([ job for job, future in results if future.cancelled() ], [ jobs[0], jobs[1] ])
+
+if __name__ == '__main__':
+  unittest.main()
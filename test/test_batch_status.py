@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Tests for the status file written by ``boogie-batch-runner.py``.
+"""
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+
+# Hack
+sys.path.insert(0, repoDir)
+from BoogieRunner import BatchStatus
+
+def result(totalTime, bugFound=False, timeoutHit=False):
+  return { 'program': 'p.bpl', 'total_time': totalTime, 'bug_found': bugFound,
+    'timeout_hit': timeoutHit, 'failed': False }
+
+class _Clock:
+  def __init__(self):
+    self.now = 1000.0
+
+  def time(self):
+    return self.now
+
+class PercentileTests(unittest.TestCase):
+  def testNearestRank(self):
+    values = [ float(v) for v in range(1, 11) ]
+    self.assertEqual(BatchStatus.percentile(values, 0), 1.0)
+    self.assertEqual(BatchStatus.percentile(values, 50), 5.0)
+    self.assertEqual(BatchStatus.percentile(values, 90), 9.0)
+    self.assertEqual(BatchStatus.percentile(values, 99), 10.0)
+    self.assertEqual(BatchStatus.percentile([ 7.0 ], 50), 7.0)
+
+class BatchStatusTests(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tempDir.cleanup)
+    self.clock = _Clock()
+    patcher = mock.patch.object(BatchStatus, 'time', self.clock)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.path = os.path.join(self.tempDir.name, 'status.json')
+    self.status = BatchStatus.BatchStatus(self.path, 6, 2, 100, 60.0)
+
+  def finish(self, job, result):
+    self.status.jobStarted(job)
+    self.status.jobFinished(job, result)
+
+  def testCounts(self):
+    self.finish('a', result(10.0, bugFound=True))
+    self.finish('b', result(20.0))
+    self.finish('c', result(100.0, timeoutHit=True))
+    self.finish('d', { 'program': 'd.bpl', 'error': 'Failed to run' })
+    with self.assertLogs('BoogieRunner.BatchStatus', level='WARNING'):
+      # Can't both find a bug and fail
+      self.finish('e', dict(result(5.0, bugFound=True), failed=True))
+    self.status.jobStarted('f')
+    snapshot = self.status.snapshot()
+    self.assertEqual(snapshot['jobs'], { 'total': 6, 'done': 5, 'running': 1, 'queued': 0, 'not_run': 0 })
+    types = snapshot['result_types']
+    self.assertEqual((types['BUG_FOUND'], types['FULLY_EXPLORED'], types['TIMED_OUT'], types['ERROR'], types['UNKNOWN']),
+      (1, 1, 1, 1, 1))
+    self.assertEqual(snapshot['job_time']['median'], 10.0)
+    self.assertEqual(snapshot['job_time']['max'], 100.0)
+
+  def testNotRunAndAddedJobs(self):
+    self.status.addJobs(2)
+    self.status.jobNotRun('a')
+    self.assertEqual(self.status.snapshot()['jobs'],
+      { 'total': 7, 'done': 0, 'running': 0, 'queued': 7, 'not_run': 1 })
+
+  def testEta(self):
+    self.assertEqual(self.status.snapshot()['eta_seconds'], None)
+    self.finish('a', result(10.0))
+    self.finish('b', result(20.0))
+    self.finish('c', result(100.0, timeoutHit=True))
+    self.status.jobStarted('d')
+    self.clock.now += 5.0
+    # A third of the jobs time out and the rest take 15 seconds
+    expectedJobTime = (2 / 3) * 15.0 + (1 / 3) * 100.0
+    # 2 queued jobs and the rest of the running one shared by 2 workers
+    self.assertAlmostEqual(self.status.snapshot()['eta_seconds'],
+      (2 * expectedJobTime + expectedJobTime - 5.0) / 2)
+    # Running for longer than any job that finished so expected to time out
+    self.clock.now += 25.0
+    self.assertAlmostEqual(self.status.snapshot()['eta_seconds'],
+      (2 * expectedJobTime + 100.0 - 30.0) / 2)
+
+  def testWrite(self):
+    self.finish('a', result(10.0))
+    self.status.start()
+    self.status.stop()
+    with open(self.path, 'r') as f:
+      written = json.load(f)
+    self.assertEqual(written['jobs']['done'], 1)
+    self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Tests for the limits and statistics files of the CGroup backend using
+  a directory that stands in for a delegated cgroup v2 root.
+"""
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+
+# Hack
+sys.path.insert(0, repoDir)
+from BoogieRunner.Backends import CGroup
+
+class CGroupTests(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tempDir.cleanup)
+    self.root = os.path.join(self.tempDir.name, 'root')
+    os.mkdir(self.root)
+    self.write(os.path.join(self.root, 'cgroup.controllers'), 'cpuset cpu io memory pids\n')
+    self.write(os.path.join(self.root, 'cgroup.subtree_control'), '')
+
+  def write(self, path, contents):
+    with open(path, 'w') as f:
+      f.write(contents)
+
+  def read(self, path):
+    with open(path, 'r') as f:
+      return f.read()
+
+  def backend(self, memoryLimit=100, **kwargs):
+    return CGroup.CGroupBackend('/bin/true', self.tempDir.name, 0, memoryLimit, None,
+      cgroup_root=self.root, **kwargs)
+
+  def leaves(self):
+    return [ name for name in os.listdir(self.root) if name.startswith('boogie-runner-') ]
+
+  def testEnablesControllers(self):
+    self.backend(cpu_limit=1.5)
+    self.assertEqual(self.read(os.path.join(self.root, 'cgroup.subtree_control')), '+memory +cpu')
+
+  def testMissingController(self):
+    self.write(os.path.join(self.root, 'cgroup.controllers'), 'pids\n')
+    with self.assertRaises(CGroup.CGroupBackendException):
+      self.backend()
+
+  def testNotACGroup(self):
+    os.remove(os.path.join(self.root, 'cgroup.controllers'))
+    with self.assertRaises(CGroup.CGroupBackendException):
+      self.backend()
+
+  def testLimits(self):
+    leaf = self.backend(cpu_limit=1.5)._createCGroup()
+    self.assertEqual(os.path.dirname(leaf), self.root)
+    self.assertEqual(self.read(os.path.join(leaf, 'memory.max')), str(100 * (2**20)))
+    self.assertEqual(self.read(os.path.join(leaf, 'memory.oom.group')), '1')
+    self.assertEqual(self.read(os.path.join(leaf, 'cpu.max')), '150000 100000')
+    # Swap accounting is disabled so swap is not limited
+    self.assertFalse(os.path.exists(os.path.join(leaf, 'memory.swap.max')))
+
+  def testNoLimits(self):
+    leaf = self.backend(memoryLimit=0)._createCGroup()
+    self.assertEqual(os.listdir(leaf), [ ])
+
+  def writeStats(self, leaf, oomKills, peak=True):
+    os.mkdir(leaf)
+    self.write(os.path.join(leaf, 'memory.events'),
+      'low 0\nhigh 0\nmax 12\noom 1\noom_kill {}\noom_group_kill 0\n'.format(oomKills))
+    self.write(os.path.join(leaf, 'cpu.stat'),
+      'usage_usec 3500000\nuser_usec 2500000\nsystem_usec 1000000\nnr_periods 0\n')
+    if peak:
+      self.write(os.path.join(leaf, 'memory.peak'), '{}\n'.format(64 * (2**20)))
+
+  def testReadStats(self):
+    backend = self.backend()
+    leaf = os.path.join(self.root, 'leaf')
+    self.writeStats(leaf, oomKills=1)
+    self.assertEqual(backend._readStats(leaf), (True, 2.5, 1.0, 64.0))
+
+  def testReadStatsWithoutPeak(self):
+    backend = self.backend()
+    leaf = os.path.join(self.root, 'leaf')
+    # memory.peak needs Linux >= 5.19
+    self.writeStats(leaf, oomKills=0, peak=False)
+    self.assertEqual(backend._readStats(leaf), (False, 2.5, 1.0, None))
+
+  def testLeafRemovedWhenLogCannotBeOpened(self):
+    backend = self.backend()
+    createCGroup = backend._createCGroup
+    def createFakeCGroup():
+      leaf = createCGroup()
+      self.write(os.path.join(leaf, 'cgroup.events'), 'populated 0\nfrozen 0\n')
+      return leaf
+    rmdir = os.rmdir
+    def removeFakeCGroup(path):
+      # Unlike a real cgroup the interface files have to be removed first
+      for name in os.listdir(path):
+        os.remove(os.path.join(path, name))
+      rmdir(path)
+    with mock.patch.object(backend, '_createCGroup', side_effect=createFakeCGroup), \
+         mock.patch.object(CGroup.os, 'rmdir', side_effect=removeFakeCGroup) as removed:
+      with self.assertRaises(FileNotFoundError):
+        backend.run([ '/bin/true' ], os.path.join(self.tempDir.name, 'missing', 'log'), { })
+    self.assertEqual(removed.call_count, 1)
+    self.assertEqual(self.leaves(), [ ])
+    self.assertEqual(backend._leaf, None)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Tests for running a batch against a deadline.
+"""
+import concurrent.futures
+import datetime
+import os
+import sys
+import unittest
+from unittest import mock
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+
+# Hack
+sys.path.insert(0, repoDir)
+from BoogieRunner import BatchScheduler
+from BoogieRunner import Deadline
+
+def answer(program, totalTime):
+  return { 'program': program, 'total_time': totalTime, 'bug_found': True,
+    'timeout_hit': False, 'failed': False }
+
+def timeout(program, totalTime):
+  return { 'program': program, 'total_time': totalTime, 'bug_found': False,
+    'timeout_hit': True, 'failed': False }
+
+class _Clock:
+  def __init__(self):
+    self.now = 1000.0
+
+  def time(self):
+    return self.now
+
+class ParseTests(unittest.TestCase):
+  def testDurations(self):
+    for deadlineString, seconds in [ ('90', 90), ('90s', 90), ('90m', 5400), (' 2h ', 7200), ('1.5d', 129600) ]:
+      self.assertEqual(Deadline.parse(deadlineString, now=100.0), 100.0 + seconds)
+
+  def testDateAndTime(self):
+    self.assertEqual(Deadline.parse('2016-04-05T09:00'),
+      datetime.datetime(2016, 4, 5, 9, 0).timestamp())
+
+  def testInvalid(self):
+    for deadlineString in [ '', 'soon', '10y', '-5m' ]:
+      with self.assertRaises(Deadline.DeadlineException):
+        Deadline.parse(deadlineString)
+
+class ValueModelTests(unittest.TestCase):
+  def setUp(self):
+    self.model = Deadline.ValueModel({
+      'a': [ answer('a', 10.0), answer('a', 30.0), timeout('a', 100.0) ],
+      'b': [ timeout('b', 100.0) ],
+      'c': [ { 'program': 'c', 'error': 'no time' } ] })
+
+  def testEstimate(self):
+    probability, expectedTime = self.model.estimate('a', 20.0)
+    self.assertAlmostEqual(probability, 1 / 3)
+    # Killed at 20 seconds unless it answered first
+    self.assertAlmostEqual(expectedTime, (10.0 + 20.0 + 20.0) / 3)
+    probability, expectedTime = self.model.estimate('a', 100.0)
+    self.assertAlmostEqual(probability, 2 / 3)
+    self.assertAlmostEqual(expectedTime, (10.0 + 30.0 + 100.0) / 3)
+    self.assertEqual(self.model.estimate('b', 100.0), (0.0, 100.0))
+
+  def testProgramsWithoutHistoryUsePooledHistory(self):
+    self.assertTrue(self.model.hasHistory('a'))
+    self.assertFalse(self.model.hasHistory('c'))
+    probability, _ = self.model.estimate('unknown', 50.0)
+    # a answered twice within 50 seconds out of the four runs of a and b
+    self.assertAlmostEqual(probability, 2 / 4)
+    self.assertEqual(Deadline.ValueModel({ }).estimate('unknown', 50.0), (1.0, 50.0))
+
+  def testDensity(self):
+    self.assertTrue(self.model.density('a', 100.0) > self.model.density('b', 100.0))
+
+class DeadlinePolicyTests(unittest.TestCase):
+  def setUp(self):
+    self.clock = _Clock()
+    patcher = mock.patch.object(Deadline, 'time', self.clock)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def runJobs(self, jobs, deadlineIn, programToResults={ }, minTime=10):
+    """
+      Run ``jobs`` one at a time where each one takes its whole
+      ``max_time``. Returns the jobs that were started in order and the
+      jobs that were never started.
+    """
+    scheduler = BatchScheduler.BatchScheduler(1)
+    policy = Deadline.DeadlinePolicy(self.clock.now + deadlineIn,
+      Deadline.ValueModel(programToResults), minTime)
+    scheduler.setPicker(policy.pick)
+    scheduler.addPolicy(policy)
+    for job in jobs:
+      scheduler.addJob(job)
+    started = [ ]
+    def submit(job):
+      started.append(job)
+      self.clock.now += job.maxTime
+      future = concurrent.futures.Future()
+      future.set_result(None)
+      return future
+    notStarted = [ job for job, future in scheduler.run(submit) if future.cancelled() ]
+    self.assertTrue(scheduler.stopped or len(notStarted) == 0)
+    return started, notStarted
+
+  def makeJob(self, program, maxTime):
+    return BatchScheduler.Job(program, '/tmp/wd-{}'.format(program), { 'max_time': maxTime })
+
+  def testMaxTimeShrinksToTheDeadline(self):
+    jobs = [ self.makeJob('p{}'.format(index), 100) for index in range(0, 4) ]
+    started, notStarted = self.runJobs(jobs, 250)
+    self.assertEqual(started, jobs[:3])
+    self.assertEqual(notStarted, jobs[3:])
+    self.assertEqual([ job.maxTime for job in started ], [ 100, 100, 50 ])
+    self.assertEqual([ job.tags.get('deadline_max_time') for job in started ], [ None, None, 50 ])
+    # The config shared with other jobs is left alone
+    self.assertEqual(jobs[3].maxTime, 100)
+
+  def testUnlimitedJobGetsTheRemainingTime(self):
+    job = self.makeJob('p', 0)
+    started, _ = self.runJobs([ job ], 60.5)
+    self.assertEqual(job.maxTime, 60)
+    self.assertEqual(job.tags['deadline_max_time'], 60)
+
+  def testTooLittleTimeLeft(self):
+    jobs = [ self.makeJob('p0', 100), self.makeJob('p1', 100) ]
+    started, notStarted = self.runJobs(jobs, 105, minTime=10)
+    self.assertEqual(started, jobs[:1])
+    self.assertEqual(notStarted, jobs[1:])
+
+  def testMostAnswersPerSecondFirst(self):
+    history = { 'slow': [ answer('slow', 80.0) ], 'fast': [ answer('fast', 5.0) ],
+      'never': [ timeout('never', 100.0) ] }
+    jobs = [ self.makeJob(program, 100) for program in [ 'never', 'slow', 'fast' ] ]
+    started, _ = self.runJobs(jobs, 1000, history)
+    self.assertEqual([ job.program for job in started ], [ 'fast', 'slow', 'never' ])
+
+  def testJobThatCantAnswerInTheTimeLeftIsNotStarted(self):
+    history = { 'slow': [ answer('slow', 80.0) ] }
+    jobs = [ self.makeJob('slow', 100) ]
+    started, notStarted = self.runJobs(jobs, 50, history)
+    self.assertEqual(started, [ ])
+    self.assertEqual(notStarted, jobs)
+
+if __name__ == '__main__':
+  unittest.main()
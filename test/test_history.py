@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Tests for loading the history of previous runs and estimating run
+  times from it.
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+
+# Hack
+sys.path.insert(0, repoDir)
+from BoogieRunner import History
+
+def result(program, totalTime, bugFound=False, timeoutHit=False, failed=False):
+  return { 'program': program, 'total_time': totalTime, 'bug_found': bugFound,
+    'timeout_hit': timeoutHit, 'failed': failed, 'out_of_memory': False }
+
+_goodReport = '''
+- {program: a.bpl, total_time: 2.0, bug_found: false, timeout_hit: false, failed: false}
+- {program: a.bpl, total_time: 4.0, bug_found: true, timeout_hit: false, failed: false}
+- {program: b.bpl, error: Failed to run}
+# A bug can't be found by a run that failed
+- {program: c.bpl, total_time: 1.0, bug_found: true, timeout_hit: false, failed: true}
+# Missing fields
+- {program: d.bpl, total_time: 1.0}
+- {program: e.bpl, bug_found: false, timeout_hit: false, failed: false}
+- [ not, a, result ]
+'''
+
+class LoadTests(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tempDir.cleanup)
+
+  def write(self, name, contents):
+    path = os.path.join(self.tempDir.name, name)
+    with open(path, 'w') as f:
+      f.write(contents)
+    return path
+
+  def testSkipsMalformedResults(self):
+    path = self.write('good.yml', _goodReport)
+    with self.assertLogs('BoogieRunner.History', level='WARNING') as logs:
+      programToResults = History.load([ path ])
+    self.assertEqual(list(programToResults.keys()), [ 'a.bpl' ])
+    self.assertEqual([ r['total_time'] for r in programToResults['a.bpl'] ], [ 2.0, 4.0 ])
+    self.assertTrue(any('4 malformed' in line for line in logs.output))
+
+  def testSkipsMalformedFiles(self):
+    paths = [ self.write('bad.yml', '- {program: a.bpl\n  - ]'),
+              self.write('notalist.yml', 'program: a.bpl'),
+              self.write('good.yml', _goodReport) ]
+    with self.assertLogs('BoogieRunner.History', level='WARNING') as logs:
+      programToResults = History.load(paths)
+    self.assertEqual(len(programToResults['a.bpl']), 2)
+    self.assertTrue(any('bad.yml' in line for line in logs.output))
+    self.assertTrue(any('notalist.yml' in line for line in logs.output))
+
+  def testMissingFile(self):
+    with self.assertRaises(History.HistoryException):
+      History.load([ os.path.join(self.tempDir.name, 'missing.yml') ])
+
+class EstimateTests(unittest.TestCase):
+  def testTimeoutsTakeMaxTime(self):
+    results = [ result('a', 2.0), result('a', 7.0, timeoutHit=True) ]
+    self.assertEqual(History.estimateTime(results, 10), 6.0)
+    self.assertEqual(History.estimateTime([ result('a', 20.0) ], 10), 10.0)
+    self.assertEqual(History.estimateTime([ result('a', 20.0) ], 0), 20.0)
+
+  def testDefaultEstimateIsMedian(self):
+    programToResults = { 'a': [ result('a', 1.0) ], 'b': [ result('b', 3.0) ], 'c': [ result('c', 8.0) ] }
+    estimates = History.estimateTimes([ 'a', 'b', 'c', 'd' ], programToResults, 0)
+    self.assertEqual(estimates, { 'a': 1.0, 'b': 3.0, 'c': 8.0, 'd': 3.0 })
+
+if __name__ == '__main__':
+  unittest.main()
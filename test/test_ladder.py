@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Tests for running a batch with a timeout escalation ladder.
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+
+# Hack
+sys.path.insert(0, repoDir)
+from BoogieRunner import Ladder
+
+def result(program, totalTime, timeoutHit=False):
+  return { 'program': program, 'total_time': totalTime, 'bug_found': False,
+    'timeout_hit': timeoutHit, 'failed': False }
+
+class ParseTests(unittest.TestCase):
+  def testValid(self):
+    rungs = Ladder.parse('10,60,900')
+    self.assertEqual(rungs, [ 10, 60, 900 ])
+    # Integer limits stay integers so they look the same as in config files
+    self.assertTrue(all([ isinstance(r, int) for r in rungs ]))
+    self.assertEqual(Ladder.parse('0.5, 2.5'), [ 0.5, 2.5 ])
+    self.assertEqual(Ladder.parse('30'), [ 30 ])
+
+  def testInvalid(self):
+    for ladderString in [ '', '10,,60', 'ten', '0,10', '-5,10', '60,10', '10,10' ]:
+      with self.assertRaises(Ladder.LadderException):
+        Ladder.parse(ladderString)
+
+class RungTests(unittest.TestCase):
+  def testRungOutputPath(self):
+    self.assertEqual(Ladder.rungOutputPath('/r/out.yml', 2), '/r/out-rung2.yml')
+
+  def testTimedOut(self):
+    self.assertTrue(Ladder.timedOut(result('a', 10.0, timeoutHit=True)))
+    self.assertFalse(Ladder.timedOut(result('a', 1.0)))
+    self.assertFalse(Ladder.timedOut(None))
+    self.assertFalse(Ladder.timedOut({ 'program': 'a', 'error': 'Failed to run' }))
+    with self.assertLogs('BoogieRunner.Ladder', level='WARNING'):
+      self.assertFalse(Ladder.timedOut({ 'program': 'a' }))
+
+  def testCombineReportsTakesLastRung(self):
+    with tempfile.TemporaryDirectory() as tempDir:
+      paths = [ os.path.join(tempDir, 'rung{}.yml'.format(rung)) for rung in range(0, 2) ]
+      with open(paths[0], 'w') as f:
+        f.write('- {program: a, total_time: 10.0, bug_found: false, timeout_hit: true, failed: false}\n'
+                '- {program: b, total_time: 2.0, bug_found: false, timeout_hit: false, failed: false}\n')
+      with open(paths[1], 'w') as f:
+        f.write('- {program: a, total_time: 30.0, bug_found: true, timeout_hit: false, failed: false}\n')
+      combined = Ladder.combineReports(paths)
+    self.assertEqual([ (r['program'], r['total_time']) for r in combined ], [ ('a', 30.0), ('b', 2.0) ])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Tests that a portfolio kills the runners that lose the race and
+  records the winner.
+"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+
+# Hack
+sys.path.insert(0, repoDir)
+from BoogieRunner import BatchWorker
+from BoogieRunner.Runners.Klee import KleeRunner
+from BoogieRunner.Runners.RunnerBase import RunnerBaseClass
+
+# Stands in for KLEE. Finds a bug quickly.
+_fastKlee = '''#!/bin/sh
+sleep 0.2
+echo "KLEE: ERROR: foo.c:1: assertion"
+exit 1
+'''
+
+# Stands in for KLEE. Runs until it is killed.
+_slowKlee = '''#!/bin/sh
+exec sleep 60
+'''
+
+class PortfolioTests(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tempDir.cleanup)
+    self.program = self.write('p.c', 'int main() { return 0; }', 0o644)
+
+  def write(self, name, contents, mode):
+    path = os.path.join(self.tempDir.name, name)
+    with open(path, 'w') as f:
+      f.write(contents)
+    os.chmod(path, mode)
+    return path
+
+  def member(self, name, script):
+    rc = { 'tool_path': self.write(name, script, 0o755), 'max_time': 30,
+      'entry_point': 'main', 'backend': { 'name': 'PythonPsUtil', 'config': {} } }
+    return (name, 'Klee', os.path.join(self.tempDir.name, 'wd-' + name), rc)
+
+  def testLosersAreKilled(self):
+    members = [ self.member('slow', _slowKlee), self.member('fast', _fastKlee) ]
+    killed = [ ]
+    def kill(runner, *args, **kwargs):
+      killed.append(os.path.basename(runner.toolPath))
+      return RunnerBaseClass.kill(runner, *args, **kwargs)
+    startTime = time.monotonic()
+    with mock.patch.object(KleeRunner, 'softTimeoutDiff', 0), \
+        mock.patch.object(KleeRunner, 'kill', autospec=True, side_effect=kill):
+      result = BatchWorker.runPortfolio(members, self.program, killPollTimePeriod=0.1)
+    self.assertTrue(time.monotonic() - startTime < 20)
+
+    self.assertTrue(len(killed) > 0)
+    self.assertEqual(set(killed), { 'slow' })
+    self.assertEqual(result['portfolio_winner'], 'fast')
+    self.assertTrue(result['portfolio_time'] > 0.0)
+    self.assertTrue(result['bug_found'])
+    self.assertFalse('portfolio_cancelled' in result)
+
+    results = result['portfolio_results']
+    self.assertEqual(list(results.keys()), [ 'slow', 'fast' ])
+    self.assertFalse(results['fast']['portfolio_cancelled'])
+    self.assertEqual(results['fast']['exit_code'], 1)
+    # The loser's partial state is kept
+    self.assertTrue(results['slow']['portfolio_cancelled'])
+    self.assertFalse('error' in results['slow'])
+    self.assertNotEqual(results['slow']['exit_code'], 0)
+    self.assertNotEqual(results['slow']['bug_found'], True)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Tests that the process group of a tool is killed with it but is never
+  signalled once the tool has been reaped.
+"""
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+
+# Hack
+sys.path.insert(0, repoDir)
+from BoogieRunner import ProcessTree
+from BoogieRunner.Backends import AsyncIO
+from BoogieRunner.Backends import PythonPsUtil
+
+# Leaves a child in the process group of the tool that outlives it
+_orphanScript = 'sleep 60 & echo $! > orphan.pid; {}'
+
+def _isRunning(pid):
+  try:
+    with open('/proc/{}/stat'.format(pid), 'r') as f:
+      # A zombie is not running
+      return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+  except FileNotFoundError:
+    return False
+
+def _waitForExit(pid, timeout=5.0):
+  endTime = time.monotonic() + timeout
+  while _isRunning(pid) and time.monotonic() < endTime:
+    time.sleep(0.01)
+  return not _isRunning(pid)
+
+class ProcessGroupTests(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tempDir.cleanup)
+
+  def orphanPid(self):
+    with open(os.path.join(self.tempDir.name, 'orphan.pid'), 'r') as f:
+      return int(f.read())
+
+  def testReapKillsOrphansThenStopsSignalling(self):
+    popen = subprocess.Popen([ 'sh', '-c', _orphanScript.format('exit 0') ],
+      cwd=self.tempDir.name, start_new_session=True)
+    group = ProcessTree.ProcessGroup(popen.pid)
+    os.waitid(os.P_PID, popen.pid, os.WEXITED | os.WNOWAIT)
+    orphan = self.orphanPid()
+    self.assertTrue(_isRunning(orphan))
+    _, status = group.reap(lambda: os.waitpid(popen.pid, 0))
+    popen.returncode = 0
+    self.assertEqual(status, 0)
+    self.assertTrue(group.reaped)
+    self.assertTrue(_waitForExit(orphan))
+    # The group id may now belong to another process
+    with mock.patch('os.killpg') as killpg:
+      group.signal(signal.SIGKILL)
+      self.assertFalse(killpg.called)
+
+  def testSignal(self):
+    popen = subprocess.Popen([ 'sh', '-c', _orphanScript.format('wait') ],
+      cwd=self.tempDir.name, start_new_session=True)
+    group = ProcessTree.ProcessGroup(popen.pid)
+    while not os.path.exists(os.path.join(self.tempDir.name, 'orphan.pid')):
+      time.sleep(0.01)
+    group.signal(signal.SIGKILL)
+    self.assertEqual(popen.wait(), -signal.SIGKILL)
+
+class BackendTests(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tempDir.cleanup)
+    self.logFile = os.path.join(self.tempDir.name, 'log')
+
+  def orphanPid(self):
+    with open(os.path.join(self.tempDir.name, 'orphan.pid'), 'r') as f:
+      return int(f.read())
+
+  def backend(self, backendClass, timeLimit):
+    return backendClass('/bin/sh', self.tempDir.name, timeLimit, 0, None)
+
+  def checkBackend(self, backendClass):
+    for command, timeLimit, exitCode in [ ('exit 3', 0, 3), ('sleep 60', 1, None) ]:
+      with self.subTest(command=command):
+        backend = self.backend(backendClass, timeLimit)
+        with mock.patch('BoogieRunner.ProcessTree.signalProcessGroup',
+            wraps=ProcessTree.signalProcessGroup) as signalProcessGroup:
+          result = backend.run([ '/bin/sh', '-c', _orphanScript.format(command) ], self.logFile, {})
+          self.assertEqual(result.exitCode, exitCode)
+          self.assertEqual(result.outOfTime, exitCode == None)
+          self.assertTrue(_waitForExit(self.orphanPid()))
+          signalCount = signalProcessGroup.call_count
+          self.assertTrue(signalCount > 0)
+          backend.kill()
+          self.assertEqual(signalProcessGroup.call_count, signalCount)
+
+  def testPythonPsUtil(self):
+    self.checkBackend(PythonPsUtil.PythonPsUtilBackend)
+
+  def testAsyncIO(self):
+    self.checkBackend(AsyncIO.AsyncIOBackend)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Tests for the resource usage recorded by the PythonPsUtil backend and
+  the ways it enforces the memory limit, including the resource monitor
+  shared by every tool in a process.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+from unittest import mock
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+
+# Hack
+sys.path.insert(0, repoDir)
+from BoogieRunner.Backends import PythonPsUtil
+
+# Spins until it has used some CPU time
+_busyScript = 'import time\nwhile time.process_time() < 0.3: pass'
+
+class ResourceUsageTests(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tempDir.cleanup)
+    self.logFile = os.path.join(self.tempDir.name, 'log')
+
+  def backend(self, stackLimit=None):
+    return PythonPsUtil.PythonPsUtilBackend(sys.executable, self.tempDir.name, 0, 0, stackLimit)
+
+  def testPeakMemoryExcludesRunner(self):
+    # Make the runner large. A tool forked from it inherits its peak
+    # resident set size.
+    ballast = b'\x01' * (256 * (2**20))
+    # A stack limit means subprocess forks rather than using vfork()
+    for stackLimit in [ None, 0 ]:
+      with self.subTest(stackLimit=stackLimit):
+        result = self.backend(stackLimit).run([ '/bin/sleep', '0.5' ], self.logFile, {})
+        self.assertEqual(result.exitCode, 0)
+        self.assertNotEqual(result.peakMemory, None)
+        self.assertTrue(0.0 < result.peakMemory < 32.0, result.peakMemory)
+
+  def testCpuTime(self):
+    result = self.backend().run([ sys.executable, '-c', _busyScript ], self.logFile, {})
+    self.assertEqual(result.exitCode, 0)
+    self.assertTrue(isinstance(result.userCpuTime, float))
+    self.assertTrue(isinstance(result.sysCpuTime, float))
+    self.assertTrue(result.userCpuTime + result.sysCpuTime >= 0.3)
+    self.assertTrue(result.userCpuTime <= result.runTime + 0.1)
+    self.assertTrue(result.sysCpuTime >= 0.0)
+
+  def testPeakMemoryOfTimedOutTool(self):
+    backend = PythonPsUtil.PythonPsUtilBackend(sys.executable, self.tempDir.name, 1, 0, None)
+    result = backend.run([ '/bin/sleep', '60' ], self.logFile, {})
+    self.assertTrue(result.outOfTime)
+    self.assertNotEqual(result.peakMemory, None)
+    self.assertNotEqual(result.userCpuTime, None)
+
+# Allocates more than the memory limit given to it
+_allocateScript = 'b = bytearray(512 * (2**20))'
+
+class MemoryRLimitTests(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tempDir.cleanup)
+    self.logFile = os.path.join(self.tempDir.name, 'log')
+
+  def runScript(self, script, **kwargs):
+    backend = PythonPsUtil.PythonPsUtilBackend(sys.executable, self.tempDir.name, 10, 256, None, **kwargs)
+    with mock.patch.object(PythonPsUtil._ResourceMonitor, 'register') as register:
+      result = backend.run([ sys.executable, '-c', script ], self.logFile, { })
+    self.polled = register.called
+    return result
+
+  def testAllocationFailure(self):
+    result = self.runScript(_allocateScript, memory_limit_mode='rlimit_as')
+    self.assertNotEqual(result.exitCode, 0)
+    self.assertTrue(result.outOfMemory)
+    self.assertFalse(result.outOfTime)
+    self.assertFalse(self.polled)
+
+  def testFailingExit(self):
+    result = self.runScript('import sys; sys.exit(3)', memory_limit_mode='rlimit_as')
+    self.assertEqual(result.exitCode, 3)
+    self.assertFalse(result.outOfMemory)
+    self.assertFalse(self.polled)
+
+  def testLogOnlySearchedInRLimitMode(self):
+    script = 'import sys; print("error: out of memory"); sys.exit(1)'
+    result = self.runScript(script, memory_limit_mode='rlimit_as')
+    self.assertTrue(result.outOfMemory)
+    result = self.runScript(script)
+    self.assertEqual(result.exitCode, 1)
+    self.assertFalse(result.outOfMemory)
+    self.assertTrue(self.polled)
+
+class _FakeBackend:
+  """
+    Stands in for the backend of a monitored job.
+  """
+  def __init__(self, memoryUsage):
+    self.memoryUsage = memoryUsage
+    self._outOfMemory = False
+    self.terminated = [ ]
+    # If set sampling the job blocks until ``release`` is set
+    self.sampling = None
+    self.release = None
+
+  def _processIsRunning(self, process):
+    if self.sampling != None:
+      self.sampling.set()
+      self.release.wait(5.0)
+    return True
+
+  def _getProcessMemoryUsageInMiB(self, process):
+    return self.memoryUsage
+
+  def _terminateProcess(self, process, pause):
+    self.terminated.append(pause)
+
+class ResourceMonitorTests(unittest.TestCase):
+  def setUp(self):
+    patcher = mock.patch.object(PythonPsUtil.ProcessTree, 'descendants', return_value=[ ])
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.monitor = PythonPsUtil._ResourceMonitor()
+
+  def job(self, backend, memoryLimit):
+    # No process has this PID so it has no peak memory
+    return PythonPsUtil._MonitoredJob(backend, types.SimpleNamespace(pid=-1), memoryLimit, 0.01)
+
+  def waitForKill(self, job):
+    endTime = time.monotonic() + 5.0
+    while job.killThread == None and time.monotonic() < endTime:
+      time.sleep(0.01)
+    self.assertNotEqual(job.killThread, None)
+    job.killThread.join(5.0)
+
+  def testKillsOnlyJobsOverTheirLimit(self):
+    overBackend, underBackend = _FakeBackend(500.0), _FakeBackend(500.0)
+    over, under = self.job(overBackend, 100), self.job(underBackend, 1000)
+    self.monitor.register(over)
+    self.monitor.register(under)
+    self.waitForKill(over)
+    time.sleep(0.05)
+    self.monitor.unregister(over)
+    self.monitor.unregister(under)
+    self.assertTrue(overBackend._outOfMemory)
+    # Gives the tool a chance to clean up
+    self.assertEqual(overBackend.terminated, [ 1.0 ])
+    self.assertFalse(underBackend._outOfMemory)
+    self.assertEqual(underBackend.terminated, [ ])
+    self.assertEqual(under.killThread, None)
+
+  def testJobWithoutLimitIsNotKilled(self):
+    backend = _FakeBackend(500.0)
+    job = self.job(backend, 0)
+    self.monitor.register(job)
+    time.sleep(0.05)
+    self.monitor.unregister(job)
+    self.assertFalse(backend._outOfMemory)
+    self.assertEqual(job.killThread, None)
+
+  def testUnregisterWaitsForSample(self):
+    backend = _FakeBackend(500.0)
+    backend.sampling, backend.release = threading.Event(), threading.Event()
+    job = self.job(backend, 100)
+    self.monitor.register(job)
+    self.assertTrue(backend.sampling.wait(5.0))
+    # Registering whilst a sample is in progress does not block
+    other = self.job(_FakeBackend(0.0), 100)
+    self.monitor.register(other)
+    unregistered = threading.Event()
+    unregister = threading.Thread(target=lambda: (self.monitor.unregister(job), unregistered.set()))
+    unregister.start()
+    self.assertFalse(unregistered.wait(0.1))
+    backend.release.set()
+    self.assertTrue(unregistered.wait(5.0))
+    # The sample that was in progress has started killing the tool
+    self.assertTrue(backend._outOfMemory)
+    self.assertNotEqual(job.killThread, None)
+    job.killThread.join(5.0)
+    self.monitor.unregister(other)
+
+  def testThreadStopsWhenIdle(self):
+    job = self.job(_FakeBackend(0.0), 100)
+    self.monitor.register(job)
+    thread = self.monitor._thread
+    self.assertTrue(thread.is_alive())
+    self.monitor.unregister(job)
+    thread.join(5.0)
+    self.assertFalse(thread.is_alive())
+    self.assertEqual(self.monitor._thread, None)
+
+class SharedMonitorTests(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tempDir.cleanup)
+
+  def testTwoToolsWithDifferentLimits(self):
+    # Both tools use about the same memory but only one is over its limit
+    script = 'import time\nb = b"\\x01" * (200 * (2**20))\ntime.sleep(1.5)'
+    results = { }
+    monitorThreads = set()
+    def run(name, memoryLimit):
+      backend = PythonPsUtil.PythonPsUtilBackend(sys.executable, self.tempDir.name, 30, memoryLimit, None,
+        memory_limit_poll_time_period=0.1)
+      results[name] = backend.run([ sys.executable, '-c', script ],
+        os.path.join(self.tempDir.name, name + '.log'), { })
+    threads = [ threading.Thread(target=run, args=('small', 100)), threading.Thread(target=run, args=('large', 2000)) ]
+    for thread in threads:
+      thread.start()
+    while any([ thread.is_alive() for thread in threads ]):
+      monitorThreads.update([ t.ident for t in threading.enumerate() if t.name == 'resource_monitor' ])
+      time.sleep(0.05)
+    self.assertEqual(len(monitorThreads), 1)
+    self.assertTrue(results['small'].outOfMemory)
+    self.assertNotEqual(results['small'].exitCode, 0)
+    self.assertFalse(results['large'].outOfMemory)
+    self.assertEqual(results['large'].exitCode, 0)
+    self.assertTrue(results['large'].peakMemory > 150.0)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Tests for running each program several times.
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+
+# Hack
+sys.path.insert(0, repoDir)
+from BoogieRunner import Repetition
+
+def interleave(programs, repeat, minimumGap):
+  # Jobs are built program major like boogie-batch-runner.py does
+  jobs = [ (program, repetition) for program in programs for repetition in range(0, repeat) ]
+  return Repetition.interleave(jobs, lambda job: job[0], lambda job: job[1], repeat, minimumGap)
+
+class InterleaveTests(unittest.TestCase):
+  def positions(self, jobs):
+    positions = { }
+    for position, (program, _) in enumerate(jobs):
+      positions.setdefault(program, []).append(position)
+    return positions
+
+  def testRepetitionsAreSpread(self):
+    programs = [ 'p{}'.format(i) for i in range(0, 30) ]
+    jobs = interleave(programs, 3, 4)
+    self.assertEqual(len(jobs), 90)
+    # Every repetition keeps the order of the programs
+    for repetition in range(0, 3):
+      self.assertEqual([ p for p, r in jobs if r == repetition ], programs)
+    for program, positions in self.positions(jobs).items():
+      gaps = [ b - a for a, b in zip(positions, positions[1:]) ]
+      self.assertTrue(min(gaps) >= 10, (program, positions))
+    # The repetitions overlap rather than running back to back
+    self.assertEqual(jobs[10], ('p0', 1))
+    self.assertEqual(jobs[-1], ('p29', 2))
+
+  def testMinimumGap(self):
+    jobs = interleave([ 'a', 'b', 'c', 'd' ], 2, 8)
+    # Too few programs for the gap so the repetitions run back to back
+    self.assertEqual(jobs, [ (p, r) for r in range(0, 2) for p in 'abcd' ])
+    jobs = interleave([ 'p{}'.format(i) for i in range(0, 20) ], 2, 8)
+    for positions in self.positions(jobs).values():
+      self.assertTrue(positions[1] - positions[0] >= 8)
+
+  def testSingleRepetition(self):
+    self.assertEqual(interleave([ 'b', 'a' ], 1, 4), [ ('b', 0), ('a', 0) ])
+
+def result(totalTime, timeoutHit=False):
+  return { 'program': 'p.bpl', 'total_time': totalTime, 'bug_found': False,
+    'timeout_hit': timeoutHit, 'failed': False }
+
+class AdaptiveRepetitionTests(unittest.TestCase):
+  def needsRerun(self, times, **kwargs):
+    adaptive = Repetition.AdaptiveRepetition(100, kwargs.pop('minRuns', 2), kwargs.pop('maxRuns', 10), **kwargs)
+    return adaptive.needsRerun([ t if isinstance(t, dict) else result(t) for t in times ])
+
+  def testMinRuns(self):
+    self.assertTrue(self.needsRerun([ ], relStdDevThreshold=0.1))
+    self.assertTrue(self.needsRerun([ 10.0, 10.0 ], minRuns=3, relStdDevThreshold=0.1))
+    self.assertFalse(self.needsRerun([ 10.0, 10.0, 10.0 ], minRuns=3, relStdDevThreshold=0.1))
+
+  def testRelStdDev(self):
+    # The relative stddev of 9 and 11 is about 0.14
+    self.assertTrue(self.needsRerun([ 9.0, 11.0 ], relStdDevThreshold=0.1))
+    self.assertFalse(self.needsRerun([ 9.0, 11.0 ], relStdDevThreshold=0.2))
+
+  def testCiWidth(self):
+    # With 2 runs the critical value is 12.7 so the relative width is about 2.5
+    self.assertTrue(self.needsRerun([ 9.0, 11.0 ], ciWidthThreshold=2.0))
+    self.assertFalse(self.needsRerun([ 9.0, 11.0 ], ciWidthThreshold=3.0))
+    # Narrows as runs are added
+    self.assertFalse(self.needsRerun([ 9.0, 11.0 ] * 4, ciWidthThreshold=0.2))
+
+  def testZeroTimesConverge(self):
+    # _computeTimes() only rejects zero times with assertions enabled
+    with mock.patch.object(Repetition, '_computeTimes', return_value=(0.0, 0.0)):
+      self.assertFalse(self.needsRerun([ 0.0, 0.0 ], relStdDevThreshold=0.1))
+      self.assertFalse(self.needsRerun([ 0.0, 0.0 ], ciWidthThreshold=0.1))
+
+  def testMaxRuns(self):
+    self.assertFalse(self.needsRerun([ 1.0, 50.0, 99.0 ], maxRuns=3, relStdDevThreshold=0.1))
+
+  def testTimeoutsTakeMaxTime(self):
+    # A timeout counts as 100 seconds however long the run was recorded as
+    self.assertFalse(self.needsRerun([ result(100.0, timeoutHit=True), result(5.0, timeoutHit=True) ],
+      relStdDevThreshold=0.1))
+
+  def testStopsOnErrors(self):
+    self.assertFalse(self.needsRerun([ 9.0, { 'program': 'p.bpl', 'error': 'Failed to run' } ],
+      relStdDevThreshold=0.1))
+
+  def testStopsOnUnclassifiableResults(self):
+    # A run can't both find a bug and fail
+    broken = dict(result(10.0), bug_found=True, failed=True)
+    with self.assertLogs('BoogieRunner.Repetition', level='WARNING'):
+      self.assertFalse(self.needsRerun([ 9.0, broken ], relStdDevThreshold=0.1))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Tests for the keys of the result cache.
+"""
+import os
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+
+# Hack
+sys.path.insert(0, repoDir)
+from BoogieRunner import ResultCache
+
+class ResultCacheKeyTests(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tempDir.cleanup)
+    self.toolDir = os.path.join(self.tempDir.name, 'tool')
+    os.makedirs(os.path.join(self.toolDir, 'lib'))
+    self.toolPath = self.write('tool/boogie', 'boogie')
+    self.write('tool/lib/Core.dll', 'core v1')
+    self.program = self.write('p.bpl', 'procedure main() {}')
+
+  def write(self, relativePath, contents):
+    path = os.path.join(self.tempDir.name, relativePath)
+    with open(path, 'w') as f:
+      f.write(contents)
+    return path
+
+  def key(self, rc=None):
+    # A new cache per key as tools are assumed not to change during a run
+    cache = ResultCache.ResultCache(os.path.join(self.tempDir.name, 'cache'))
+    return cache.key('Boogie', self.program, rc if rc != None else { 'tool_path': self.toolPath })
+
+  def testSameToolSameKey(self):
+    self.assertEqual(self.key(), self.key())
+
+  def testToolChangesKey(self):
+    oldKey = self.key()
+    self.write('tool/boogie', 'boogie v2')
+    self.assertNotEqual(self.key(), oldKey)
+
+  def testOnlyListedFilesChangeKey(self):
+    oldKey = self.key()
+    # e.g. a log the tool writes next to itself
+    self.write('tool/boogie.log', 'log')
+    self.write('tool/lib/Core.dll', 'core v2')
+    self.assertEqual(self.key(), oldKey)
+
+  def testToolFingerprintFiles(self):
+    rc = { 'tool_path': self.toolPath, 'tool_fingerprint_files': [ 'lib' ] }
+    oldKey = self.key(rc)
+    self.assertNotEqual(oldKey, self.key())
+    self.write('tool/lib/Core.dll', 'core v2')
+    self.assertNotEqual(self.key(rc), oldKey)
+    rc['tool_fingerprint_files'] = [ 'missing.dll' ]
+    with self.assertRaises(ResultCache.ResultCacheException):
+      self.key(rc)
+
+  def testToolSymlinkIsFollowed(self):
+    link = os.path.join(self.tempDir.name, 'boogie')
+    os.symlink(self.toolPath, link)
+    cache = ResultCache.ResultCache(os.path.join(self.tempDir.name, 'cache'))
+    self.assertEqual(cache.toolFingerprint({ 'tool_path': link }),
+      cache.toolFingerprint({ 'tool_path': self.toolPath }))
+
+  def testConfigChangesKey(self):
+    self.assertNotEqual(self.key(), self.key({ 'tool_path': self.toolPath, 'max_time': 10 }))
+
+  def testToolFingerprint(self):
+    rc = { 'tool_path': self.toolPath, 'tool_fingerprint': 'boogie-2.4.1' }
+    oldKey = self.key(rc)
+    self.write('tool/lib/Core.dll', 'core v2')
+    self.assertEqual(self.key(rc), oldKey)
+    rc['tool_fingerprint'] = 'boogie-2.4.2'
+    self.assertNotEqual(self.key(rc), oldKey)
+
+  def testMissingTool(self):
+    with self.assertRaises(ResultCache.ResultCacheException):
+      self.key({ 'tool_path': os.path.join(self.toolDir, 'missing') })
+
+  def testDockerUsesImageId(self):
+    imageIds = { 'boogie:latest': 'sha256:aaaa' }
+    class Client:
+      def inspect_image(self, name):
+        return { 'Id': imageIds[name] }
+    rc = { 'tool_path': '/opt/boogie/boogie',
+      'backend': { 'name': 'Docker', 'config': { 'image': 'boogie:latest' } } }
+    with mock.patch.dict(sys.modules, { 'docker': types.SimpleNamespace(Client=Client) }):
+      oldKey = self.key(rc)
+      # The tag now names a different image
+      imageIds['boogie:latest'] = 'sha256:bbbb'
+      self.assertNotEqual(self.key(rc), oldKey)
+      del imageIds['boogie:latest']
+      with self.assertRaises(ResultCache.ResultCacheException):
+        self.key(rc)
+
+if __name__ == '__main__':
+  unittest.main()
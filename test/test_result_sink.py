@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Tests for streaming results to disk and converting the stream into
+  a report.
+"""
+import os
+import sys
+import tempfile
+import unittest
+import yaml
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+
+# Hack
+sys.path.insert(0, repoDir)
+from BoogieRunner import ResultSink
+
+results = [ { 'program': 'p{}.bpl'.format(i), 'total_time': float(i), 'bug_found': i % 2 == 0 } for i in range(0, 5) ]
+
+class ResultSinkTests(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tempDir.cleanup)
+
+  def stream(self, formatName, toWrite, name='stream'):
+    # Sinks append to existing streams
+    path = os.path.join(self.tempDir.name, '{}.{}'.format(name, formatName))
+    with ResultSink.getSinkClass(formatName)(path) as sink:
+      for result in toWrite:
+        sink.append(result)
+    return path
+
+  def truncate(self, path, byteCount):
+    with open(path, 'r+b') as f:
+      f.truncate(os.path.getsize(path) - byteCount)
+
+  def testRoundTrip(self):
+    for formatName in ResultSink.formats():
+      with self.subTest(format=formatName):
+        path = self.stream(formatName, results)
+        self.assertEqual(list(ResultSink.load(path, formatName)), results)
+
+  def testTruncatedLastResultIsSkipped(self):
+    for formatName in ResultSink.formats():
+      with self.subTest(format=formatName):
+        path = self.stream(formatName, results)
+        # Lose the end of the last result as if the runner was killed
+        self.truncate(path, 3)
+        with self.assertLogs('BoogieRunner.ResultSink', level='WARNING'):
+          self.assertEqual(list(ResultSink.load(path, formatName)), results[:-1])
+
+  def testCorruptResultInTheMiddle(self):
+    path = self.stream('jsonl', results)
+    with open(path, 'r') as f:
+      lines = f.readlines()
+    lines[1] = lines[1][:10] + '\n'
+    with open(path, 'w') as f:
+      f.writelines(lines)
+    with self.assertRaises(ResultSink.ResultSinkException):
+      list(ResultSink.load(path, 'jsonl'))
+
+  def testUnknownFormat(self):
+    with self.assertRaises(ResultSink.ResultSinkException):
+      ResultSink.getSinkClass('xml')
+
+  def testFinalise(self):
+    for formatName in ResultSink.formats():
+      with self.subTest(format=formatName):
+        outputPath = os.path.join(self.tempDir.name, 'report.yml')
+        count = ResultSink.finalise(self.stream(formatName, results), formatName, outputPath, header='a header')
+        self.assertEqual(count, len(results))
+        self.assertEqual(ResultSink.loadReport(outputPath), results)
+        ResultSink.finalise(self.stream(formatName, [ ], name='empty'), formatName, outputPath)
+        self.assertEqual(ResultSink.loadReport(outputPath), [ ])
+
+  def testRewrite(self):
+    for formatName in ResultSink.formats():
+      with self.subTest(format=formatName):
+        path = self.stream(formatName, results)
+        ResultSink.rewrite(path, formatName, results[:2])
+        self.assertEqual(list(ResultSink.load(path, formatName)), results[:2])
+
+  def testLoadReportRejectsNonLists(self):
+    path = os.path.join(self.tempDir.name, 'report.yml')
+    with open(path, 'w') as f:
+      f.write(yaml.dump({ 'program': 'p.bpl' }))
+    with self.assertRaises(ResultSink.ResultSinkException):
+      ResultSink.loadReport(path)
+
+if __name__ == '__main__':
+  unittest.main()
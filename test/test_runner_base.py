@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Tests that every way of running a job runs the runner's
+  ``finishRun()`` after the tool has run.
+"""
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+
+# Hack
+sys.path.insert(0, repoDir)
+from BoogieRunner import BatchWorker
+from BoogieRunner.Backends.BackendBase import BackendResult
+from BoogieRunner.Runners.Klee import KleeRunner
+
+# Stands in for KLEE. Exits with 1 (a bug was found) if the program says so.
+_fakeKlee = '''#!/bin/sh
+prog="$(eval echo \\${$#})"
+if grep -q BUG "$prog"; then echo "KLEE: ERROR: foo.c:1: assertion"; exit 1; fi
+if grep -q HANG "$prog"; then sleep 60; fi
+exit 0
+'''
+
+class FinishRunTests(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tempDir.cleanup)
+    self.toolPath = os.path.join(self.tempDir.name, 'klee')
+    with open(self.toolPath, 'w') as f:
+      f.write(_fakeKlee)
+    os.chmod(self.toolPath, 0o755)
+
+  def program(self, name, contents):
+    path = os.path.join(self.tempDir.name, name)
+    with open(path, 'w') as f:
+      f.write(contents)
+    return path
+
+  def config(self, backend):
+    return { 'tool_path': self.toolPath, 'max_memory': 0, 'max_time': 1,
+      'entry_point': 'main', 'backend': { 'name': backend, 'config': {} } }
+
+  def runJobs(self, run):
+    jobs = [ ('bug.c', 'BUG', 1, False), ('hang.c', 'HANG', None, True) ]
+    for name, contents, exitCode, outOfTime in jobs:
+      with self.subTest(program=name):
+        workDir = os.path.join(self.tempDir.name, 'wd-' + name)
+        with mock.patch.object(KleeRunner, 'softTimeoutDiff', 0), \
+            mock.patch.object(KleeRunner, 'finishRun', autospec=True) as finishRun:
+          result = run(self.program(name, contents), workDir)
+          self.assertEqual(finishRun.call_count, 1)
+          backendResult = finishRun.call_args[0][1]
+          self.assertTrue(isinstance(backendResult, BackendResult))
+          self.assertEqual(backendResult.exitCode, exitCode)
+          self.assertEqual(backendResult.outOfTime, outOfTime)
+          self.assertEqual(result['exit_code'], exitCode)
+          self.assertEqual(result['bug_found'], exitCode == 1)
+
+  def testRunJob(self):
+    self.runJobs(lambda program, workDir: BatchWorker.runJob('Klee', program, workDir,
+      self.config('PythonPsUtil')))
+
+  def testRunJobAsync(self):
+    executor = BatchWorker.AsyncJobExecutor(1)
+    self.addCleanup(executor.shutdown)
+    self.runJobs(lambda program, workDir: executor.submit(BatchWorker.runJob, 'Klee',
+      program, workDir, self.config('AsyncIO')).result())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Tests for the scheduling daemon, its client and ``DaemonPolicy``.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+
+# Hack
+sys.path.insert(0, repoDir)
+from BoogieRunner import BatchScheduler
+from BoogieRunner import SchedulerDaemon
+
+def makeJob(program, maxMemory):
+  return BatchScheduler.Job(program, '/tmp/wd-{}'.format(program), { 'max_memory': maxMemory })
+
+def waitFor(condition, timeout=5.0):
+  endTime = time.monotonic() + timeout
+  while not condition():
+    if time.monotonic() > endTime:
+      return False
+    time.sleep(0.01)
+  return True
+
+class _FakeSocket:
+  def __init__(self):
+    self.messages = [ ]
+
+  def sendall(self, data):
+    self.messages.extend([ json.loads(line) for line in data.decode('utf-8').splitlines() ])
+
+class _FakeConnection(SchedulerDaemon._Connection):
+  def __init__(self, user):
+    super().__init__(_FakeSocket(), user)
+
+  def grantedIds(self):
+    return [ m['id'] for m in self.sock.messages if m['op'] == 'grant' ]
+
+class DaemonScheduleTests(unittest.TestCase):
+  def request(self, daemon, connection, requestId, memory):
+    daemon._handleMessage(connection, { 'op': 'request', 'id': requestId, 'memory': memory })
+
+  def testFairShare(self):
+    daemon = SchedulerDaemon.Daemon('/unused', [ None ] * 2)
+    alice = _FakeConnection('alice')
+    bob = _FakeConnection('bob')
+    for requestId in range(0, 3):
+      self.request(daemon, alice, requestId, 0)
+    self.request(daemon, bob, 0, 0)
+    self.assertEqual(alice.grantedIds(), [ 0, 1 ])
+    daemon._handleMessage(alice, { 'op': 'release', 'id': 0 })
+    # Bob holds no slots so goes before Alice's older request
+    self.assertEqual(bob.grantedIds(), [ 0 ])
+    self.assertEqual(alice.grantedIds(), [ 0, 1 ])
+
+  def testLargeRequestIsNotStarved(self):
+    daemon = SchedulerDaemon.Daemon('/unused', [ None ] * 4, memoryBudget=8000)
+    alice = _FakeConnection('alice')
+    bob = _FakeConnection('bob')
+    self.request(daemon, alice, 0, 6000)
+    self.request(daemon, bob, 0, 4000)
+    self.request(daemon, alice, 1, 1000)
+    self.request(daemon, alice, 2, 1000)
+    # Bob's request is first in line but doesn't fit. Alice's small
+    # requests must not take the memory freed for it.
+    self.assertEqual(alice.grantedIds(), [ 0 ])
+    self.assertEqual(bob.grantedIds(), [ ])
+    daemon._handleMessage(alice, { 'op': 'release', 'id': 0 })
+    self.assertEqual(bob.grantedIds(), [ 0 ])
+    self.assertEqual(alice.grantedIds(), [ 0, 1, 2 ])
+
+  def testDisconnectReleases(self):
+    daemon = SchedulerDaemon.Daemon('/unused', [ None ])
+    alice = _FakeConnection('alice')
+    bob = _FakeConnection('bob')
+    self.request(daemon, alice, 0, 0)
+    self.request(daemon, bob, 0, 0)
+    self.assertEqual(bob.grantedIds(), [ ])
+    daemon._disconnected(alice)
+    self.assertEqual(bob.grantedIds(), [ 0 ])
+
+class DaemonPolicyTests(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.TemporaryDirectory()
+    self.socketPath = os.path.join(self.tempDir.name, 'schedd.sock')
+    self.daemon = SchedulerDaemon.Daemon(self.socketPath, [ None ] * 4, memoryBudget=8000)
+    self.thread = threading.Thread(target=self.daemon.serve, daemon=True)
+    self.thread.start()
+    self.assertTrue(waitFor(lambda: self.daemon._server != None and os.path.exists(self.socketPath)))
+    self.policies = [ ]
+
+  def tearDown(self):
+    for policy in self.policies:
+      policy.close()
+    self.daemon.shutdown()
+    self.thread.join()
+    self.tempDir.cleanup()
+
+  def makePolicy(self, maxJobs):
+    policy = SchedulerDaemon.DaemonPolicy(SchedulerDaemon.Client(self.socketPath), maxJobs)
+    self.policies.append(policy)
+    return policy
+
+  def admitWhenGranted(self, policy, job, pending, running):
+    def admitted():
+      policy.queued(pending, running)
+      return policy.canAdmit(job, running)
+    return waitFor(admitted)
+
+  def grantedCount(self):
+    with self.daemon._lock:
+      return len(self.daemon._granted)
+
+  def waitingCount(self):
+    with self.daemon._lock:
+      return len(self.daemon._waiting)
+
+  def testMixedSizesDoNotHoardGrants(self):
+    policy = self.makePolicy(4)
+    a = makeJob('a', 1000)
+    b = makeJob('b', 4000)
+    self.assertTrue(self.admitWhenGranted(policy, a, [ a, b ], [ ]))
+    policy.started(a)
+    self.assertTrue(self.admitWhenGranted(policy, b, [ b ], [ a ]))
+    policy.started(b)
+    # Nothing is pending so no other slots of the daemon are held
+    policy.queued([ ], [ a, b ])
+    self.assertTrue(waitFor(lambda: self.grantedCount() == 2 and self.waitingCount() == 0))
+    self.assertEqual(policy.client.outstandingCount, 2)
+    policy.finished(a)
+    policy.finished(b)
+    self.assertTrue(waitFor(lambda: self.grantedCount() == 0))
+
+  def testRequestsWithdrawnWhenQueueDrains(self):
+    hog = self.makePolicy(4)
+    big = [ makeJob('big-{}'.format(index), 4000) for index in range(0, 2) ]
+    for index, job in enumerate(big):
+      self.assertTrue(self.admitWhenGranted(hog, job, big[index:], big[:index]))
+      hog.started(job)
+    policy = self.makePolicy(4)
+    jobs = [ makeJob(index, 1000) for index in range(0, 3) ]
+    policy.queued(jobs, [ ])
+    self.assertTrue(waitFor(lambda: self.waitingCount() == 3))
+    self.assertFalse(policy.canAdmit(jobs[0], [ ]))
+    # The jobs went away (e.g. the batch was stopped)
+    policy.queued([ ], [ ])
+    self.assertTrue(waitFor(lambda: self.waitingCount() == 0))
+    self.assertEqual(policy.client.outstandingCount, 0)
+
+  def testOtherUsersAreNotBlocked(self):
+    first = self.makePolicy(4)
+    second = self.makePolicy(4)
+    small = [ makeJob('small-{}'.format(index), 1000) for index in range(0, 4) ]
+    self.assertTrue(self.admitWhenGranted(first, small[0], small, [ ]))
+    first.started(small[0])
+    # ``first`` only runs one job at a time. Its other requests are
+    # withdrawn so the daemon's other slots are free for ``second``.
+    first.maxJobs = 1
+    first.queued(small[1:], [ small[0] ])
+    other = [ makeJob('other-{}'.format(index), 1000) for index in range(0, 3) ]
+    for index, job in enumerate(other):
+      self.assertTrue(self.admitWhenGranted(second, job, other[index:], other[:index]))
+      second.started(job)
+
+  def testFallsBackWhenDaemonDies(self):
+    policy = self.makePolicy(2)
+    job = makeJob('a', 1000)
+    # Stands in for the daemon going away
+    policy.client.close()
+    self.assertTrue(waitFor(lambda: policy.client.disconnected))
+    policy.queued([ job ], [ ])
+    self.assertTrue(policy.canAdmit(job, [ ]))
+
+if __name__ == '__main__':
+  unittest.main()
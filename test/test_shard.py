@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Tests for splitting a program list into shards.
+"""
+import os
+import subprocess
+import sys
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+
+# Hack
+sys.path.insert(0, repoDir)
+from BoogieRunner import Shard
+
+programs = [ '/benchmarks/p{}.bpl'.format(i) for i in range(0, 100) ]
+
+class ParseTests(unittest.TestCase):
+  def testValid(self):
+    self.assertEqual(Shard.parse('0/1'), (0, 1))
+    self.assertEqual(Shard.parse('3/8'), (3, 8))
+
+  def testInvalid(self):
+    for shardString in [ '', '1', '1/2/3', 'a/2', '2/2', '-1/2', '0/0' ]:
+      with self.assertRaises(Shard.ShardException):
+        Shard.parse(shardString)
+
+class ByHashTests(unittest.TestCase):
+  def testShardsPartitionThePrograms(self):
+    shards = [ Shard.byHash(programs, index, 4) for index in range(0, 4) ]
+    self.assertEqual(sorted(sum(shards, [ ])), sorted(programs))
+    for shard in shards:
+      # Keeps the order of the program list
+      self.assertEqual(shard, sorted(shard, key=programs.index))
+      self.assertTrue(len(shard) > 10)
+
+  def testStableAcrossProcesses(self):
+    # Unlike hash() the shard must not depend on PYTHONHASHSEED
+    script = ('import sys; sys.path.insert(0, {!r}); from BoogieRunner import Shard; '
+      'print(Shard.byHash({!r}, 1, 4))'.format(repoDir, programs))
+    outputs = set()
+    for seed in [ '1', '2' ]:
+      env = dict(os.environ, PYTHONHASHSEED=seed)
+      outputs.add(subprocess.check_output([ sys.executable, '-c', script ], env=env))
+    self.assertEqual(len(outputs), 1)
+    self.assertEqual(outputs.pop().decode().strip(), str(Shard.byHash(programs, 1, 4)))
+
+class ByCostTests(unittest.TestCase):
+  def testBalancesCost(self):
+    estimates = { p: float(index + 1) for index, p in enumerate(programs) }
+    shards = [ Shard.byCost(programs, estimates, index, 3) for index in range(0, 3) ]
+    self.assertEqual(sorted(sum(shards, [ ])), sorted(programs))
+    costs = [ sum([ estimates[p] for p in shard ]) for shard in shards ]
+    # Greedy assignment is within the largest cost of a perfect split
+    self.assertTrue(max(costs) - min(costs) <= max(estimates.values()))
+    for shard in shards:
+      self.assertEqual(shard, sorted(shard, key=programs.index))
+
+  def testTiesAreDeterministic(self):
+    estimates = { p: 1.0 for p in programs }
+    shards = [ Shard.byCost(programs, estimates, index, 3) for index in range(0, 3) ]
+    self.assertEqual(sorted([ len(shard) for shard in shards ]), [ 33, 33, 34 ])
+    # Ties are broken by path, not by the order of the program list
+    self.assertEqual(Shard.byCost(list(reversed(programs)), estimates, 0, 3),
+      list(reversed(shards[0])))
+
+  def testOneExpensiveProgram(self):
+    estimates = { p: 1.0 for p in programs }
+    estimates[programs[50]] = 1000.0
+    shard = [ s for s in range(0, 2) if programs[50] in Shard.byCost(programs, estimates, s, 2) ][0]
+    self.assertEqual(Shard.byCost(programs, estimates, shard, 2), [ programs[50] ])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# vim: set sw=2 ts=2 softtabstop=2 expandtab:
+"""
+  Tests for claiming, renewing and reclaiming jobs in a ``WorkQueue``
+  and for abandoning the jobs whose claim was lost.
+"""
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+
+# Hack
+sys.path.insert(0, repoDir)
+from BoogieRunner import BatchWorker
+from BoogieRunner import WorkQueue
+
+class WorkQueueTests(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tempDir.cleanup)
+    self.root = os.path.join(self.tempDir.name, 'queue')
+    self.programs = [ '/p/a.bpl', '/p/b.bpl' ]
+    WorkQueue.WorkQueue.create(self.root, { 'runner': 'Fake' }, self.programs,
+      os.path.join(self.tempDir.name, 'wd'), 10.0)
+
+  def worker(self):
+    queue = WorkQueue.WorkQueue(self.root)
+    queue.register()
+    self.addCleanup(queue.unregister)
+    return queue
+
+  def expire(self, queue, claim):
+    path = queue._claimPath(claim.index, claim.generation)
+    past = os.stat(path).st_mtime - 2 * queue.leaseTime
+    os.utime(path, (past, past))
+
+  def testClaimsInOrderOnce(self):
+    first = self.worker()
+    second = self.worker()
+    claims = [ first.claim(), second.claim() ]
+    self.assertEqual([ c.program for c in claims ], self.programs)
+    self.assertEqual([ c.generation for c in claims ], [ 0, 0 ])
+    # Both claims are current so there is nothing left to claim
+    self.assertEqual(first.claim(), None)
+    self.assertEqual(first.status()['running'], 2)
+
+  def testStaleClaimIsReclaimed(self):
+    first = self.worker()
+    second = self.worker()
+    claim = first.claim()
+    second.claim()
+    self.expire(first, claim)
+    self.assertEqual(first.status()['stale'], 1)
+    reclaim = second.claim()
+    self.assertEqual((reclaim.index, reclaim.generation), (claim.index, 1))
+    self.assertTrue(reclaim.isReclaim)
+
+  def testRenewedClaimIsNotReclaimed(self):
+    first = self.worker()
+    second = self.worker()
+    claim = first.claim()
+    second.claim()
+    self.expire(first, claim)
+    self.assertTrue(first.renew(claim))
+    self.assertEqual(second.claim(), None)
+
+  def testLostLease(self):
+    first = self.worker()
+    second = self.worker()
+    claim = first.claim()
+    other = second.claim()
+    lost = first.lostCheck(claim)
+    # The check is sent to worker processes
+    lost = pickle.loads(pickle.dumps(lost))
+    self.assertFalse(lost())
+    self.expire(first, claim)
+    reclaim = second.claim()
+    self.assertEqual(reclaim.index, claim.index)
+    self.assertTrue(lost())
+    self.assertFalse(first.renew(claim))
+    # The old owner must never publish its result
+    self.assertFalse(first.complete(claim, { 'program': claim.program, 'owner': 'first' }))
+    self.assertTrue(second.complete(reclaim, { 'program': claim.program, 'owner': 'second' }))
+    second.complete(other, { 'program': other.program, 'owner': 'second' })
+    self.assertEqual([ r['owner'] for r in second.loadResults() ], [ 'second', 'second' ])
+
+  def testFirstResultWins(self):
+    first = self.worker()
+    claim = first.claim()
+    self.assertTrue(first.complete(claim, { 'program': claim.program, 'n': 0 }))
+    self.assertFalse(first.complete(claim, { 'program': claim.program, 'n': 1 }))
+
+class _FakeRunner:
+  def __init__(self):
+    self.program = 'fake'
+    self.killCount = 0
+
+  def kill(self):
+    self.killCount += 1
+
+class WatchdogTests(unittest.TestCase):
+  def testKillsAbandonedRunnerUntilUnwatched(self):
+    watchdog = BatchWorker._Watchdog()
+    runner = _FakeRunner()
+    abandon = threading.Event()
+    watchdog.watch(runner, abandon.is_set, 0.01)
+    time.sleep(0.1)
+    self.assertEqual(runner.killCount, 0)
+    abandon.set()
+    endTime = time.monotonic() + 5.0
+    while runner.killCount < 3 and time.monotonic() < endTime:
+      time.sleep(0.01)
+    # Killed repeatedly in case the tool had not started yet
+    self.assertTrue(runner.killCount >= 3)
+    self.assertTrue(watchdog.unwatch(runner))
+    killCount = runner.killCount
+    time.sleep(0.1)
+    self.assertTrue(runner.killCount <= killCount + 1)
+
+  def testNotAbandoned(self):
+    watchdog = BatchWorker._Watchdog()
+    runner = _FakeRunner()
+    watchdog.watch(runner, lambda: False, 0.01)
+    time.sleep(0.05)
+    self.assertFalse(watchdog.unwatch(runner))
+    self.assertEqual(runner.killCount, 0)
+
+if __name__ == '__main__':
+  unittest.main()